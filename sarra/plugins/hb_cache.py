@@ -3,14 +3,18 @@
 """
   default on_heartbeat handler to clean the cache.
   by invoking parent.cache.save() it will only write out the values that are still relevant.
+  also reports how many entries expired, or were evicted by cache_max_entries/cache_max_bytes,
+  since the last heartbeat.
 
 """
 
 class Hb_Cache(object): 
 
     def __init__(self,parent):
-        self.last_time  = time.time()
-        self.last_count = 0
+        self.last_time    = time.time()
+        self.last_count   = 0
+        self.last_expired = 0
+        self.last_evicted = 0
           
     def perform(self,parent):
         self.logger     = parent.logger
@@ -26,16 +30,21 @@ class Hb_Cache(object):
            now       = time.time()
            new_count = parent.cache.count
 
-           self.logger.info("hb_cache was %d, but since %5.2f sec, increased up to %d, now saved %d entries" % 
-                           ( self.last_count, now-self.last_time, count, new_count))
+           expired   = parent.cache.expired - self.last_expired
+           evicted   = parent.cache.evicted - self.last_evicted
 
-           self.last_time  = now
-           self.last_count = new_count
+           self.logger.info("hb_cache was %d, but since %5.2f sec, increased up to %d, now saved %d entries (%d expired, %d evicted, ~%d bytes)" % 
+                           ( self.last_count, now-self.last_time, count, new_count, expired, evicted, parent.cache.bytes))
+
+           self.last_time    = now
+           self.last_count   = new_count
+           self.last_expired = parent.cache.expired
+           self.last_evicted = parent.cache.evicted
 
         else :
 
            parent.cache.save()
-           self.logger.info("hb_cache saved (%d)" % len(parent.cache.cache_dict))
+           self.logger.info("hb_cache saved (%d, %d evicted)" % (parent.cache.count, parent.cache.evicted))
 
         return True
 
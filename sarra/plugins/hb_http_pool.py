@@ -0,0 +1,39 @@
+#!/usr/bin/python3
+
+"""
+  on_heartbeat handler for the http keep-alive connections (sr_http_pool) :
+  reports, since the last heartbeat, how many requests went on a connection
+  kept from a previous one (reuse rate), how many connections were opened,
+  sent again because the server had closed an idle connection, and how many
+  connections are idle in the pool.
+
+  usage: on_heartbeat hb_http_pool
+
+"""
+
+class HTTP_POOL(object):
+
+   def __init__(self,parent):
+       self.last = None
+
+   def on_heartbeat(self,parent):
+
+       try   : from sr_http       import http_pool
+       except: from sarra.sr_http import http_pool
+
+       stats = http_pool.stats()
+       last  = self.last
+       if last == None : last = { 'connections' : 0, 'reused' : 0, 'retries' : 0 }
+
+       opened  = stats['connections'] - last['connections']
+       reused  = stats['reused']      - last['reused']
+       retries = stats['retries']     - last['retries']
+
+       parent.logger.info("hb_http_pool %d requests, %d on reused connections (%.2f%% reuse), %d connections opened, %d sent again, %d idle" % \
+                          ( opened+reused, reused, 100.0*reused/max(opened+reused,1), opened, retries, stats['idle'] ))
+
+       self.last = stats
+
+       return True
+
+self.plugin='HTTP_POOL'
@@ -0,0 +1,45 @@
+#!/usr/bin/python3
+
+"""
+  on_heartbeat handler for mask_cache : reports how often accept/reject
+  did not have to try the masks since the last heartbeat (hit rate),
+  whether the cache is keyed on directories, and how many entries were evicted.
+
+"""
+
+class MASK_CACHE(object): 
+
+   def __init__(self,parent):
+       self.last_hits    = 0
+       self.last_misses  = 0
+       self.last_evicted = 0
+       self.last_matcher = None
+
+   def on_heartbeat(self,parent):
+
+       masks = parent.masks_matcher
+       if masks == None or masks.cache_size <= 0 : return True
+
+       # masks compiled again : counts start over
+
+       if masks is not self.last_matcher :
+          self.last_hits    = 0
+          self.last_misses  = 0
+          self.last_evicted = 0
+          self.last_matcher = masks
+
+       hits    = masks.hits    - self.last_hits
+       misses  = masks.misses  - self.last_misses
+       evicted = masks.evicted - self.last_evicted
+
+       parent.logger.info("hb_mask_cache %d hits, %d misses (%.2f%% hit rate), %d of %d entries, keyed on %s, %d evicted" % \
+                          ( hits, misses, 100.0*hits/max(hits+misses,1), len(masks.cache), masks.cache_size, \
+                            ['url','directory'][masks.directory_only], evicted ))
+
+       self.last_hits    = masks.hits
+       self.last_misses  = masks.misses
+       self.last_evicted = masks.evicted
+
+       return True
+
+self.plugin='MASK_CACHE'
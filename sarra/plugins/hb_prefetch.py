@@ -0,0 +1,24 @@
+#!/usr/bin/python3
+
+"""
+  on_heartbeat handler for prefetch_adaptive : reports the prefetch in use,
+  the measured processing time per message, and the changes since the last heartbeat.
+
+"""
+
+class PREFETCH(object): 
+
+   def __init__(self,parent):
+       pass
+
+   def on_heartbeat(self,parent):
+
+       if not parent.prefetch_adaptive : return True
+
+       if not hasattr(parent,'consumer'): return True
+
+       parent.consumer.consumer.on_heartbeat_prefetch()
+
+       return True
+
+self.plugin='PREFETCH'
@@ -39,12 +39,14 @@ except: pass
 try   : import pika
 except: pass
 
-import logging, os, random, sys, time
+import collections, logging, os, random, select, sys, time
 
 try :    
          from sr_util            import *
+         import sr_membroker
 except : 
          from sarra.sr_util      import *
+         import sarra.sr_membroker as sr_membroker
 
 # ==========
 # HostConnect
@@ -79,6 +81,9 @@ class HostConnect:
 
        self.use_pika          = self.pika_available
 
+       # mem://host/ : in process broker stand-in, used as amqplib (see sr_membroker)
+       self.use_mem           = False
+
    def add_build(self,func):
        self.rebuilds.append(func)
 
@@ -111,7 +116,11 @@ class HostConnect:
                host = self.host
                if self.port   != None : host = host + ':%s' % self.port
                self.logger.debug("%s://%s:<pw>@%s%s ssl=%s" % (self.protocol,self.user,host,self.vhost,self.ssl))
-               if self.use_pika:
+               if self.use_mem:
+                      self.logger.debug("in process broker is used")
+                      self.connection = sr_membroker.Connection(host, userid=self.user, password=self.password, \
+                                                                virtual_host=self.vhost)
+               elif self.use_pika:
                       self.logger.debug("PIKA is used")
                       logger = logging.getLogger('pika')
                       logger.setLevel(logging.CRITICAL)
@@ -190,6 +199,30 @@ class HostConnect:
        self.close()
        self.connect()
 
+   # rpc : channel.method(*args) answered within iotime seconds or TimeoutException.
+   # A deadline, no signal : usable from any thread.  pika : the method of the
+   # channel's asynchronous side, connection events processed until its answer.
+   # amqplib : the socket times out.
+
+   def rpc(self,channel,iotime,method,*args):
+       deadline = sr_deadline(iotime)
+
+       if self.use_mem :
+          return getattr(channel,method)(*args)
+
+       if self.use_pika :
+          answer = []
+          getattr(channel._impl,method)(*args,callback=answer.append)
+          while not answer :
+                deadline.check("sr_amqp %s" % method)
+                self.connection.process_data_events(time_limit=deadline.remaining())
+          return answer[0]
+
+       sock = self.connection.transport.sock
+       deadline.settimeout(sock)
+       try    : return getattr(channel,method)(*args)
+       finally: sock.settimeout(None)
+
    def set_credentials(self,protocol,user,password,host,port,vhost):
        self.protocol = protocol
        self.user     = user
@@ -202,6 +235,9 @@ class HostConnect:
        if self.vhost    == None    : self.vhost = '/'
        if self.vhost    == ''      : self.vhost = '/'
 
+       self.use_mem = self.protocol == 'mem'
+       if self.use_mem : self.use_pika = False
+
    def set_url(self,url):
        self.protocol = url.scheme
        self.user     = url.username
@@ -218,8 +254,15 @@ class HostConnect:
        if self.vhost    == None    : self.vhost = '/'
        if self.vhost    == ''      : self.vhost = '/'
 
+       self.use_mem = self.protocol == 'mem'
+       if self.use_mem : self.use_pika = False
+
    def set_pika(self,pika=True):
 
+       if self.use_mem :
+          self.use_pika = False
+          return
+
        self.use_pika = pika
 
        # good choices
@@ -259,6 +302,38 @@ class Consumer:
       self.prefetch = 20
       self.channel  = None
 
+      # push mode : the broker sends up to prefetch messages ahead (basic_consume)
+      # instead of one basic_get round trip per message
+
+      self.push         = False
+      self.consumer_tag = None
+      self.deliveries   = []
+
+      # batched acknowledgements : one ack (multiple=True) for ack_batch messages,
+      # or for what was consumed in ack_interval seconds
+
+      self.ack_batch    = 1
+      self.ack_interval = 0
+      self.ack_tag      = None
+      self.ack_count    = 0
+      self.ack_time     = 0
+      self.before_ack   = []
+
+      # adaptive prefetch : prefetch_min <= prefetch <= prefetch_max set so that the
+      # messages ahead hold about adapt_buffer seconds of work, given the processing
+      # time per message, without taking more than a fair share of a short queue
+
+      self.adaptive       = False
+      self.prefetch_min   = 1
+      self.prefetch_max   = 1000
+      self.instances      = 1
+      self.adapt_buffer   = 1.0
+      self.adapt_interval = 10
+      self.adapt_time     = time.time()
+      self.adaptations    = []
+      self.proc_time      = None
+      self.depth          = None
+
       self.exchange_type = 'topic'
 
       self.hc.add_build(self.build)
@@ -269,9 +344,26 @@ class Consumer:
       if self.hc.use_pika :
          self.for_pika_msg = raw_message(self.logger)
 
+   def add_ack_batch(self,batch,interval):
+       self.ack_batch    = batch
+       self.ack_interval = interval
+
+   def add_before_ack(self,func):
+       self.before_ack.append(func)
+
    def add_prefetch(self,prefetch):
        self.prefetch = prefetch
 
+   def add_prefetch_adaptive(self,prefetch_min,prefetch_max,instances=1):
+       self.adaptive     = True
+       self.prefetch_min = prefetch_min
+       self.prefetch_max = prefetch_max
+       self.instances    = max(instances,1)
+       self.prefetch     = min(max(self.prefetch,prefetch_min),prefetch_max)
+
+   def add_push(self,push=True):
+       self.push = push
+
    def build(self):
        self.logger.debug("building consumer")
        self.channel = self.hc.new_channel()
@@ -280,20 +372,120 @@ class Consumer:
        if self.prefetch != 0 :
           prefetch_size = 0      # dont care
           a_global      = False  # only apply here
+          # adaptive : channel wide (one consumer per channel), so that changes apply at once
+          if self.adaptive : a_global = True
           self.channel.basic_qos(prefetch_size,self.prefetch,a_global)
-       
+
+       # deliveries of a previous channel cannot be acked on this one
+       # (the broker gives the unacknowledged ones again)
+       self.consumer_tag = None
+       self.deliveries   = []
+       self.ack_tag      = None
+       self.ack_count    = 0
+
    def ack(self,msg):
        self.logger.debug("--------------> ACK")
        self.logger.debug("--------------> %s" % msg.delivery_tag )
-       self.channel.basic_ack(msg.delivery_tag)
 
-   def consume(self,queuename):
+       if self.ack_batch <= 1 :
+          self.channel.basic_ack(msg.delivery_tag)
+          return
+
+       # batched : messages are processed in order, acking this one acks all previous ones
+
+       now = time.time()
+       if self.ack_count == 0 : self.ack_time = now
+
+       self.ack_tag    = msg.delivery_tag
+       self.ack_count += 1
+
+       if self.ack_count >= self.ack_batch or now - self.ack_time >= self.ack_interval :
+          self.ack_flush()
+
+   def ack_flush(self):
+
+       # what was produced from these messages must be safe before they are acknowledged
+
+       for func in self.before_ack :
+           if not func() : return
+
+       if self.ack_tag == None : return
+
+       self.logger.debug("--------------> ACK %d messages up to %s" % (self.ack_count,self.ack_tag) )
+       tag            = self.ack_tag
+       self.ack_tag   = None
+       self.ack_count = 0
+       self.channel.basic_ack(tag,True)
+
+   def on_heartbeat_prefetch(self):
+
+       if self.proc_time == None :
+          self.logger.info("prefetch %d, nothing processed yet" % self.prefetch)
+          return
+
+       self.logger.info("prefetch %d (%d to %d), processing %.4f sec/msg, queue %s, %d changes since last heartbeat" % \
+                       (self.prefetch,self.prefetch_min,self.prefetch_max,self.proc_time,self.depth,len(self.adaptations)))
+       for old, new, proc_time, depth in self.adaptations :
+           self.logger.info("prefetch %d -> %d (processing %.4f sec/msg, queue %s)" % (old,new,proc_time,depth))
+
+       self.adaptations = []
+
+   def prefetch_adapt(self,queuename,elapse):
+
+       # processing time of a message : weighted average
+
+       if self.proc_time == None : self.proc_time = elapse
+       else                      : self.proc_time = 0.9 * self.proc_time + 0.1 * elapse
+
+       now = time.time()
+       if now - self.adapt_time < self.adapt_interval : return
+       self.adapt_time = now
+
+       target = int(self.adapt_buffer / max(self.proc_time,0.0001)) + 1
+
+       # a short queue is shared amongst the instances
+
+       self.depth = self.queue_depth(queuename)
+       if self.depth != None : target = min(target, self.depth // self.instances + 1)
+
+       # at most doubled or halved each time, within bounds
+
+       target = min(max(target,self.prefetch//2),self.prefetch*2)
+       target = min(max(target,self.prefetch_min),self.prefetch_max)
+
+       if abs(target - self.prefetch) < max(1,self.prefetch//4) : return
+
+       self.logger.debug("prefetch %d -> %d (processing %.4f sec/msg, queue %s)" % \
+                        (self.prefetch,target,self.proc_time,self.depth))
+       self.adaptations.append( (self.prefetch,target,self.proc_time,self.depth) )
+       self.prefetch = target
+
+       try   : self.channel.basic_qos(0,self.prefetch,True)
+       except:
+               (stype, value, tb) = sys.exc_info()
+               self.logger.error("sr_amqp/prefetch_adapt Type: %s, Value: %s" % (stype, value))
+
+   def queue_depth(self,queuename):
+
+       # messages ready in the queue (not counting those delivered and unacknowledged)
+
+       try   :
+               if self.hc.use_pika : return self.channel.queue_declare(queuename,passive=True).method.message_count
+               else                : return self.channel.queue_declare(queuename,passive=True)[1]
+       except:
+               (stype, value, tb) = sys.exc_info()
+               self.logger.error("sr_amqp/queue_depth Type: %s, Value: %s" % (stype, value))
+               return None
+
+   def consume(self,queuename,timeout=0):
 
        msg = None
 
        if not self.hc.asleep :
               try :
-                      if self.hc.use_pika :
+                      if self.push :
+                           msg = self.consume_push(queuename,timeout)
+                      elif self.hc.use_pika :
                            #self.logger.debug("consume PIKA is used")
                            method_frame, properties, body = self.channel.basic_get(queuename)
                            if method_frame and properties and body :
@@ -317,6 +509,54 @@ class Consumer:
 
        return msg
 
+   def consume_push(self,queuename,timeout):
+
+       # first call : ask the broker to push messages to us
+
+       if self.consumer_tag == None :
+          if   not self.hc.use_pika :
+               self.consumer_tag = self.channel.basic_consume(queuename,callback=self.deliveries.append)
+          elif int(pika.__version__.split('.')[0]) < 1 :
+               self.consumer_tag = self.channel.basic_consume(self.on_pika_delivery,queuename)
+          else :
+               self.consumer_tag = self.channel.basic_consume(queuename,self.on_pika_delivery)
+
+       # nothing received yet : wait for a delivery, up to timeout
+
+       if not self.deliveries :
+          if   self.hc.use_pika : self.hc.connection.process_data_events(time_limit=timeout)
+          elif self.hc.use_mem  : self.channel.wait(timeout)
+          else                  : self.wait_amqplib(timeout)
+
+       if not self.deliveries : return None
+
+       if not self.hc.use_pika : return self.deliveries.pop(0)
+
+       method_frame, properties, body = self.deliveries.pop(0)
+       self.for_pika_msg.pika_to_amqplib(method_frame, properties, body )
+       return self.for_pika_msg
+
+   def on_pika_delivery(self, channel, method_frame, properties, body):
+       self.deliveries.append( (method_frame, properties, body) )
+
+   def wait_amqplib(self,timeout):
+
+       # amqplib has no timeout on wait : make sure something is there to read first
+       # (only this consumer's deliveries come unsolicited on the connection)
+
+       conn      = self.hc.connection
+       transport = conn.transport
+
+       pending   = self.channel.method_queue or not conn.method_reader.queue.empty() or \
+                   getattr(transport,'_read_buffer',None)
+       if not pending and hasattr(transport,'sslobj') : pending = transport.sslobj.pending()
+
+       if not pending :
+          readable, writable, errors = select.select([transport.sock],[],[],timeout)
+          if not readable : return
+
+       self.channel.wait()
+
 # ==========
 # Publisher
 # ==========
@@ -331,42 +571,101 @@ class Publisher:
        self.restore_exchange = None
        self.restore_queue    = None
 
+       # batched publishing : a transaction commited every batch messages (or interval sec)
+       # or, with pika, asynchronous confirms with at most window messages unconfirmed.
+       # Messages are kept until the broker has them for sure, and published again
+       # after a reconnection, or a nack.
+
+       self.batch    = 1
+       self.interval = 1.0
+       self.window   = 0
+       self.mode     = None
+       self.pending  = []
+       self.pending_time = 0
+       self.inflight = collections.OrderedDict()
+       self.seq      = 0
+       self.resend   = []
+
+   def add_batch(self,batch,interval):
+       self.batch    = batch
+       self.interval = interval
+
+   def add_confirm_window(self,window):
+       self.window   = window
+
    def build(self):
        self.channel = self.hc.new_channel()
-       if self.hc.use_pika :  self.channel.confirm_delivery()
-       else:                  self.channel.tx_select()
+
+       # what the previous channel did not commit or confirm is lost : publish it again
+
+       self.resend  += self.pending + list(self.inflight.values())
+       self.pending  = []
+       self.inflight = collections.OrderedDict()
+       self.seq      = 0
+
+       # amqplib has no publisher confirms : commit the window as a batch
+
+       if self.window > 0 and not self.hc.use_pika and self.batch < self.window :
+          self.logger.info("sr_amqp/publish: no confirms with amqplib, commit every %d messages" % self.window)
+          self.batch = self.window
+
+       if   self.window > 0 and self.hc.use_pika :
+            self.mode = 'confirm'
+            self.channel._impl.confirm_delivery(self.on_confirm)
+       elif self.batch > 1 or not self.hc.use_pika :
+            self.mode = 'tx'
+            self.channel.tx_select()
+       else:
+            self.mode = None
+            self.channel.confirm_delivery()
 
    def isAlive(self):
        if not hasattr(self,'channel') : return False
-       alarm_set(self.iotime)
        try:
-               if self.hc.use_pika: self.channel.confirm_delivery()
-               else:                self.channel.tx_select()
+               if   self.mode == 'confirm' : self.hc.connection.process_data_events(time_limit=0)
+               elif self.mode == 'tx'      : self.hc.rpc(self.channel,self.iotime,'tx_select')
+               else:                         self.channel.confirm_delivery()
        except:
-               alarm_cancel()
                return False
-       alarm_cancel()
        return True
 
+   def on_confirm(self,frame):
+       method = frame.method
+       nack   = isinstance(method,pika.spec.Basic.Nack)
+
+       tags   = [ method.delivery_tag ]
+       if method.multiple :
+          tags = []
+          for tag in self.inflight :
+              if tag > method.delivery_tag : break
+              tags.append(tag)
+
+       for tag in tags :
+           msg = self.inflight.pop(tag,None)
+           if nack and msg : self.resend.append(msg)
+
+       if nack : self.logger.error("sr_amqp/publish: broker refused %d messages, publishing them again" % len(tags))
+
    def publish(self,exchange_name,exchange_key,message,mheaders,mexp=0):
+
+       # transactions (amqplib, post_batch) or asynchronous confirms (post_confirm_window) :
+       # the message is queued, True unless what this call committed failed.  A later
+       # commit failure is returned by the publish or publish_flush doing it : callers
+       # that must know the message is safe check publish_flush()
+
+       if self.mode != None :
+          self.resend.append( (exchange_name,exchange_key,message,mheaders,mexp) )
+          return self.publish_flush(False)
+
+       # pika : the publish waits for the broker's confirmation
+
        try :
-              if self.hc.use_pika :
-                     #self.logger.debug("publish PIKA is used")
-                     if mexp :
-                        expms = '%s' % mexp
-                        properties = pika.BasicProperties(content_type='text/plain', delivery_mode=1, headers=mheaders,expiration=expms)
-                     else:
-                        properties = pika.BasicProperties(content_type='text/plain', delivery_mode=1, headers=mheaders)
-                     self.channel.basic_publish(exchange_name, exchange_key, message, properties, True )
+              if mexp :
+                 expms = '%s' % mexp
+                 properties = pika.BasicProperties(content_type='text/plain', delivery_mode=1, headers=mheaders,expiration=expms)
               else:
-                     #self.logger.debug("publish AMQPLIB is used")
-                     if mexp :
-                        expms = '%s' % mexp
-                        msg = amqp.Message(message, content_type= 'text/plain',application_headers=mheaders,expiration=expms)
-                     else:
-                        msg = amqp.Message(message, content_type= 'text/plain',application_headers=mheaders)
-                     self.channel.basic_publish(msg, exchange_name, exchange_key )
-                     self.channel.tx_commit()
+                 properties = pika.BasicProperties(content_type='text/plain', delivery_mode=1, headers=mheaders)
+              self.channel.basic_publish(exchange_name, exchange_key, message, properties, True )
               return True
        except :
               if self.hc.loop :
@@ -383,6 +682,109 @@ class Publisher:
                  self.logger.error("could not publish %s %s %s %s" % (exchange_name,exchange_key,message,mheaders))
                  return False
 
+   def publish_flush(self,wait=True):
+
+       # publish what is waiting, and when wait is set (or the batch is due),
+       # make sure the broker has everything (commit, or wait for confirms)
+
+       if self.mode == None : return True
+
+       try :
+              while self.resend :
+                    msg = self.resend.pop(0)
+                    self.publish_send(*msg)
+
+              if   self.mode == 'confirm' :
+                   if wait : self.wait_confirms(0)
+                   # nacked messages while waiting
+                   if self.resend : return self.publish_flush(wait)
+
+              elif self.pending :
+                   if wait or time.time() - self.pending_time >= self.interval :
+                      self.channel.tx_commit()
+                      self.pending = []
+              return True
+
+       except :
+              (stype, value, tb) = sys.exc_info()
+              self.logger.error("sr_amqp/publish_flush: %s, Value: %s" % (stype, value))
+              if self.hc.loop :
+                 self.logger.error("Sleeping 5 seconds ... and reconnecting")
+                 time.sleep(5)
+                 self.hc.reconnect()
+                 if self.hc.asleep : return False
+                 return self.publish_flush(wait)
+              else:
+                 lost = self.resend + self.pending + list(self.inflight.values())
+                 self.logger.error("could not publish %d messages" % len(lost))
+                 for msg in lost :
+                     self.logger.error("could not publish %s %s %s %s" % msg[0:4])
+                 self.resend   = []
+                 self.pending  = []
+                 self.inflight = collections.OrderedDict()
+                 return False
+
+   def publish_many(self,msgs):
+
+       # publish a list of (exchange_name,exchange_key,message,mheaders,mexp)
+       # with one commit, or one wait for all confirms
+
+       if self.mode == None :
+          ok = True
+          for msg in msgs :
+              ok = self.publish(*msg) and ok
+          return ok
+
+       batch      = self.batch
+       self.batch = max(batch,len(self.resend)+len(msgs))
+       self.resend.extend(msgs)
+       try    : return self.publish_flush()
+       finally: self.batch = batch
+
+   def publish_send(self,exchange_name,exchange_key,message,mheaders,mexp=0):
+
+       # the message is recorded first : if anything goes wrong, build publishes it again
+
+       msg = (exchange_name,exchange_key,message,mheaders,mexp)
+
+       if self.mode == 'confirm' :
+          self.seq += 1
+          self.inflight[self.seq] = msg
+       else :
+          if not self.pending : self.pending_time = time.time()
+          self.pending.append(msg)
+
+       if self.hc.use_pika :
+              if mexp :
+                 expms = '%s' % mexp
+                 properties = pika.BasicProperties(content_type='text/plain', delivery_mode=1, headers=mheaders,expiration=expms)
+              else:
+                 properties = pika.BasicProperties(content_type='text/plain', delivery_mode=1, headers=mheaders)
+              self.channel.basic_publish(exchange_name, exchange_key, message, properties, True )
+       else:
+              if self.hc.use_mem : message_class = sr_membroker.Message
+              else               : message_class = amqp.Message
+              if mexp :
+                 expms = '%s' % mexp
+                 amsg = message_class(message, content_type= 'text/plain',application_headers=mheaders,expiration=expms)
+              else:
+                 amsg = message_class(message, content_type= 'text/plain',application_headers=mheaders)
+              self.channel.basic_publish(amsg, exchange_name, exchange_key )
+
+       if self.mode == 'confirm' :
+          if len(self.inflight) >= self.window : self.wait_confirms(self.window-1)
+
+       elif len(self.pending) >= self.batch :
+          self.channel.tx_commit()
+          self.pending = []
+
+   def wait_confirms(self,inflight):
+       deadline = sr_deadline(self.iotime)
+       while len(self.inflight) > inflight :
+             if deadline.expired() :
+                raise Exception("%d messages not confirmed in %d sec" % (len(self.inflight),self.iotime))
+             self.hc.connection.process_data_events(time_limit=min(1,deadline.remaining()))
+
    def restore_clear(self):
        if self.restore_queue and self.restore_exchange :
           try   : self.channel.queue_unbind( self.restore_queue, self.restore_exchange, '#' )
@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+#
+# This file is part of sarracenia.
+# The sarracenia suite is Free and is proudly provided by the Government of Canada
+# Copyright (C) Her Majesty The Queen in Right of Canada, Environment Canada, 2008-2015
+#
+# Questions or bugs report: dps-client@ec.gc.ca
+# sarracenia repository: git://git.code.sf.net/p/metpx/git
+# Documentation: http://metpx.sourceforge.net/#SarraDocumentation
+#
+# sr_async_http.py : http/https downloads on asyncio streams (http_engine asyncio)
+#
+#  sr_http opens a url with urllib and reads it, the instance (or the thread)
+#  waiting on it until its socket times out.  Here a download is a coroutine : the event
+#  loop of the instance (sr_worker_loop) runs as many at once as messages in
+#  flight are allowed, each read with its own timeout (iotime).
+#
+#  async_http_transport.download does what sr_transport.download does :
+#  inflight file name while downloading then renamed, checksum computed on
+#  the fly, file attributes, report codes (201 downloaded, 499 failed).
+#  The local file work (open, write and checksum, close, rename, attributes)
+#  is done in the executor of the loop, so the loop only waits on sockets :
+#  a chunk is written while the next one is read.
+#
+#  The requests are HTTP/1.1, one connection each (Connection: close),
+#  redirections followed, basic authentication from the credentials.
+#  ssl contexts and proxies (http_proxy, https_proxy, no_proxy) are those of
+#  sr_http (http_pool) : http requests go to the proxy with the full url,
+#  https ones through a tunnel (CONNECT), which needs python 3.11 (start_tls).
+#
+########################################################################
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307  USA
+#
+#
+
+import asyncio,base64,os,sys,threading,time,urllib.parse
+
+try :
+         from sr_util            import *
+         from sr_http            import http_pool
+except :
+         from sarra.sr_util      import *
+         from sarra.sr_http      import http_pool
+
+# an http answer other than success
+
+class sr_async_http_error(Exception):
+
+    def __init__(self, code, reason ):
+        Exception.__init__(self, "Error code: %s, %s" % (code,reason))
+        self.code   = code
+        self.reason = reason
+
+#============================================================
+#
+# async_http_transport : sr_transport.download as a coroutine
+#
+#============================================================
+
+class async_http_transport(sr_transport):
+
+    def __init__(self) :
+        sr_transport.__init__(self)
+        self.scheme       = 'http'
+        self.redirect_max = 5
+        self.iotime       = None
+
+        # downloads at once, most at once, done
+
+        self.active       = 0
+        self.active_max   = 0
+        self.count        = 0
+
+        # set_local_file_attributes reads self.parent : one download at a time
+
+        self.attributes_lock = threading.Lock()
+
+    def close(self) :
+        pass
+
+    # generalized download... on the event loop
+    async def download( self, parent ):
+        self.logger = parent.logger
+        msg         = parent.msg
+
+        urlstr      = msg.baseurl + '/' + msg.relpath
+        remote_file = msg.relpath.split('/')[-1]
+        new_lock    = ''
+
+        # the current directory is the process' : local files with their directory
+
+        local       = msg.new_dir + os.sep
+        new_file    = msg.new_file
+
+        loop        = asyncio.get_event_loop()
+
+        self.active += 1
+        if self.active > self.active_max : self.active_max = self.active
+
+        try :
+                user, password = self.credentials(parent, msg.baseurl)
+
+                remote_offset = 0
+                length        = 0
+                if  msg.partflg == 'i':
+                    remote_offset = msg.offset
+                    length        = msg.length
+
+                self.logger.debug('Beginning fetch of %s into %s %d-%d' %
+                    (urlstr,new_file,msg.local_offset,msg.local_offset+msg.length-1))
+
+                if parent.inflight == None or msg.partflg == 'i' :
+                   new_lock = ''
+                elif parent.inflight == '.' :
+                   new_lock = local + '.' + new_file
+                elif parent.inflight[0] == '.' :
+                   new_lock = local + new_file + parent.inflight
+                elif parent.inflight[-1] == '/' :
+                   await loop.run_in_executor(None, self.local_mkdir, local+parent.inflight, parent.chmod_dir)
+                   new_lock = local + parent.inflight + new_file
+
+                target = new_lock
+                if target == '' : target = local + new_file
+
+                checksum, fpos = await self.get(parent, msg.sumalgo, urlstr, remote_file, target, \
+                                                remote_offset, msg.local_offset, length, user, password)
+
+                msg.onfly_checksum = checksum
+
+                await loop.run_in_executor(None, self.local_finish, parent, msg, new_lock, local+new_file)
+
+                # fix message if no partflg (means file size unknown until now)
+
+                if msg.partflg == None:
+                   msg.set_parts(partflg='1',chunksize=fpos)
+
+                self.count += 1
+                msg.report_publish(201,'Downloaded')
+
+                return True
+
+        except:
+                (stype, svalue, tb) = sys.exc_info()
+                msg.logger.error("Download failed %s. Type: %s, Value: %s" % (urlstr, stype ,svalue))
+                msg.report_publish(499,'%s download failed' % msg.url.scheme)
+                if new_lock != '' : await loop.run_in_executor(None, self.local_remove, new_lock)
+
+                return False
+
+        finally:
+                self.active -= 1
+
+    # set_iotime : bypass automated computation of iotime (as sr_proto)
+    def set_iotime(self,iotime) :
+        if iotime != None and iotime < 1 : iotime = 1
+        self.iotime = iotime
+
+    # user, password for the url (as sr_http)
+    def credentials(self, parent, baseurl ):
+
+        user     = None
+        password = None
+
+        ok, details = parent.credentials.get(baseurl)
+        if details :
+           url      = details.url
+           user     = url.username
+           password = url.password
+
+        if user     == '' : user     = None
+        if password == '' : password = None
+
+        return user, password
+
+    # get : the remote file into local_file, returns the checksum and the file size
+    async def get(self, parent, sumalgo, urlstr, remote_file, local_file, remote_offset, local_offset, length, user, password ):
+
+        iotime  = self.iotime
+        if iotime == None :
+           iotime = 30
+           if parent.timeout > iotime : iotime = int(parent.timeout)
+
+        bufsize   = parent.bufsize
+        bandwidth = sr_bandwidth_open(parent)
+
+        reader, writer, headers = await self.open(urlstr, remote_offset, length, user, password, iotime)
+
+        loop    = asyncio.get_event_loop()
+        dst     = None
+        writing = None
+
+        try :
+                dst = await loop.run_in_executor(None, self.local_write_open, local_file, local_offset)
+
+                if sumalgo : sumalgo.set_path(remote_file)
+
+                rw_length = 0
+
+                async for chunk in self.body(reader, headers, bufsize, iotime) :
+
+                      # one write at a time in the file, the next chunk read meanwhile
+
+                      if writing != None : await writing
+                      writing    = loop.run_in_executor(None, self.local_write, dst, sumalgo, chunk)
+                      rw_length += len(chunk)
+
+                      # throttle (sr_bandwidth) : sleeping lets the other downloads go on
+
+                      if bandwidth :
+                         wait = bandwidth.reserve(len(chunk), urlstr)
+                         if wait > 0 : await asyncio.sleep(wait)
+
+                if writing != None : await writing
+                writing = None
+
+                fpos = await loop.run_in_executor(None, self.local_write_close, dst)
+                dst  = None
+
+        finally:
+                writer.close()
+
+                # failed : the write in progress done before closing
+
+                if writing != None :
+                   try   : await writing
+                   except: pass
+                if dst != None : dst.close()
+
+        if length != 0 and rw_length != length :
+           self.logger.error("sr_async_http/get mismatched file length writing %s. Message said to expect %d bytes.  Got %d bytes." % (local_file,length,rw_length))
+
+        checksum = None
+        if sumalgo : checksum = sumalgo.get_value()
+
+        return checksum, fpos
+
+    # the local file work, in the executor of the loop
+
+    def local_finish(self, parent, msg, new_lock, local_file ):
+
+        if new_lock != '' :
+           if os.path.isfile(local_file) : os.remove(local_file)
+           os.rename(new_lock, local_file)
+
+        # fix permission (other downloads share this transport : parent set just before)
+
+        with self.attributes_lock :
+             self.parent = parent
+             self.set_local_file_attributes(local_file,msg)
+
+    def local_mkdir(self, path, mode ):
+        try :
+                os.mkdir(path)
+                os.chmod(path,mode)
+        except: pass
+
+    def local_remove(self, path ):
+        try   : os.remove(path)
+        except: pass
+
+    def local_write(self, dst, sumalgo, chunk ):
+        dst.write(chunk)
+        if sumalgo : sumalgo.update(chunk)
+
+    def local_write_open(self, local_file, local_offset ):
+
+        # local_file has to exists (as sr_proto local_write_open)
+
+        if not os.path.isfile(local_file) :
+           dst = open(local_file,'w')
+           dst.close()
+
+        dst = open(local_file,'r+b')
+        if local_offset != 0 : dst.seek(local_offset,0)
+
+        return dst
+
+    def local_write_close(self, dst ):
+
+        dst.flush()
+        os.fsync(dst)
+
+        fpos = dst.tell()
+        dst.truncate()
+        dst.close()
+
+        return fpos
+
+    # open : request sent, answer headers read ... redirections followed
+    async def open(self, urlstr, remote_offset, length, user, password, iotime ):
+
+        redirects = 0
+
+        while True :
+
+              url  = urllib.parse.urlparse(urlstr)
+              port = url.port
+              ctx  = None
+
+              if url.scheme == 'https' :
+                 if port == None : port = 443
+                 # https without user : as sr_http, no certificate verification
+                 ctx = http_pool.context(user != None)
+              elif port == None : port = 80
+
+              # through a proxy : connected to it, tls (if any) over the tunnel
+
+              proxy = http_pool.proxy(url.scheme, url.hostname)
+
+              if proxy == None :
+                 reader, writer = await asyncio.wait_for( \
+                                  asyncio.open_connection(url.hostname, port, ssl=ctx), iotime)
+              else :
+                 purl  = urllib.parse.urlparse(proxy)
+                 pport = purl.port
+                 if pport == None : pport = 443 if purl.scheme == 'https' else 80
+                 reader, writer = await asyncio.wait_for( \
+                                  asyncio.open_connection(purl.hostname, pport), iotime)
+
+              try :
+                      if proxy != None and ctx != None :
+                         await self.tunnel(reader, writer, proxy, url.hostname, port, ctx, iotime)
+
+                      path = urllib.parse.quote(url.path.replace('//','/'), safe="/%:@!$&'()*+,;=~")
+                      if path == ''  : path  = '/'
+                      if url.query   : path += '?' + url.query
+
+                      host = url.hostname
+                      if url.port != None : host += ':%d' % url.port
+
+                      if proxy != None and ctx == None : path = 'http://' + host + path
+
+                      request  = 'GET %s HTTP/1.1\r\n' % path
+                      request += 'Host: %s\r\n' % host
+                      request += 'User-Agent: sarracenia\r\n'
+                      request += 'Accept-Encoding: identity\r\n'
+                      request += 'Connection: close\r\n'
+
+                      if remote_offset != 0 :
+                         request += 'Range: bytes=%d-%d\r\n' % (remote_offset,remote_offset + length-1)
+
+                      if user != None :
+                         auth     = '%s:%s' % (user, password if password != None else '')
+                         request += 'Authorization: Basic %s\r\n' % base64.b64encode(auth.encode('utf-8')).decode('ascii')
+
+                      if proxy != None and ctx == None :
+                         auth = http_pool.proxy_authorization(proxy)
+                         if auth : request += 'Proxy-Authorization: %s\r\n' % auth
+
+                      writer.write( (request + '\r\n').encode('latin-1') )
+                      await asyncio.wait_for(writer.drain(), iotime)
+
+                      code, reason, headers = await self.read_headers(reader, iotime)
+
+              except:
+                      writer.close()
+                      raise
+
+              if code in [ 200, 206 ] : return reader, writer, headers
+
+              writer.close()
+
+              if code in [ 301, 302, 303, 307, 308 ] and 'location' in headers and redirects < self.redirect_max :
+                 redirects += 1
+                 urlstr     = urllib.parse.urljoin(urlstr, headers['location'])
+                 self.logger.debug("sr_async_http redirected to %s" % urlstr)
+                 continue
+
+              self.logger.error('Download failed %s ' % urlstr)
+              self.logger.error('Server couldn\'t fulfill the request. Error code: %s, %s' % (code, reason))
+              raise sr_async_http_error(code, reason)
+
+    # tunnel : https through a proxy, CONNECT then tls over the connection
+    async def tunnel(self, reader, writer, proxy, host, port, ctx, iotime ):
+
+        if not hasattr(writer,'start_tls') :
+           raise ConnectionError("https through proxy %s needs python 3.11 (or http_engine urllib)" % proxy)
+
+        request  = 'CONNECT %s:%d HTTP/1.1\r\n' % (host,port)
+        request += 'Host: %s:%d\r\n' % (host,port)
+
+        auth = http_pool.proxy_authorization(proxy)
+        if auth : request += 'Proxy-Authorization: %s\r\n' % auth
+
+        writer.write( (request + '\r\n').encode('latin-1') )
+        await asyncio.wait_for(writer.drain(), iotime)
+
+        code, reason, headers = await self.read_headers(reader, iotime)
+        if code != 200 :
+           raise ConnectionError("proxy %s tunnel to %s:%d refused : %s %s" % (proxy,host,port,code,reason))
+
+        await asyncio.wait_for(writer.start_tls(ctx, server_hostname=host), iotime)
+
+    # status line and headers (names in lower case)
+    async def read_headers(self, reader, iotime ):
+
+        line = await asyncio.wait_for(reader.readline(), iotime)
+        if not line : raise ConnectionError("connection closed by server")
+
+        status = line.decode('latin-1').strip().split(' ',2)
+        code   = int(status[1])
+        reason = status[2] if len(status) > 2 else ''
+
+        headers = {}
+        while True :
+              line = await asyncio.wait_for(reader.readline(), iotime)
+              line = line.decode('latin-1').strip()
+              if line == '' : break
+              name, sep, value = line.partition(':')
+              headers[name.strip().lower()] = value.strip()
+
+        return code, reason, headers
+
+    # the body, in chunks of at most bufsize
+    async def body(self, reader, headers, bufsize, iotime ):
+
+        # chunked transfer encoding
+
+        if 'chunked' in headers.get('transfer-encoding','').lower() :
+           while True :
+                 line = await asyncio.wait_for(reader.readline(), iotime)
+                 if not line : raise ConnectionError("connection closed by server")
+                 size = int(line.split(b';')[0].strip(),16)
+                 if size == 0 : break
+                 while size > 0 :
+                       chunk = await asyncio.wait_for(reader.readexactly(min(size,bufsize)), iotime)
+                       size -= len(chunk)
+                       yield chunk
+                 await asyncio.wait_for(reader.readline(), iotime)
+
+           # trailers
+           while True :
+                 line = await asyncio.wait_for(reader.readline(), iotime)
+                 if line.strip() == b'' : break
+           return
+
+        # content length given
+
+        if 'content-length' in headers :
+           remaining = int(headers['content-length'])
+           while remaining > 0 :
+                 chunk = await asyncio.wait_for(reader.read(min(remaining,bufsize)), iotime)
+                 if not chunk : raise ConnectionError("connection closed by server, %d bytes missing" % remaining)
+                 remaining -= len(chunk)
+                 yield chunk
+           return
+
+        # up to the end of the connection
+
+        while True :
+              chunk = await asyncio.wait_for(reader.read(bufsize), iotime)
+              if not chunk : break
+              yield chunk
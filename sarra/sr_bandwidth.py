@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+#
+# This file is part of sarracenia.
+# The sarracenia suite is Free and is proudly provided by the Government of Canada
+# Copyright (C) Her Majesty The Queen in Right of Canada, Environment Canada, 2008-2015
+#
+# Questions or bugs report: dps-client@ec.gc.ca
+# sarracenia repository: git://git.code.sf.net/p/metpx/git
+# Documentation: http://metpx.sourceforge.net/#SarraDocumentation
+#
+# sr_bandwidth.py : token buckets limiting the bandwidth of a configuration
+#
+#  kbytes_ps is the bandwidth of all the instances of a configuration
+#  together, downloads and sends, kbytes_ps_destination the bandwidth
+#  towards each destination (host:port).  Each transfer takes its bytes
+#  from the buckets (reserve) and waits for what is missing : a bucket
+#  refills at its rate, holds at most kbytes_burst (default: one second
+#  at its rate), and goes in debt, so small files are limited as well.
+#
+#  bucket_file : default ~/.cache/sarra/'pgm'/'cfg'/bandwidth.buckets
+#                MAGIC, number of slots, then slots of
+#                md5(destination) tokens(bytes, double) last(monotonic, double)
+#                slot 0 is the configuration's bucket.  mmap'ed by all
+#                instances, each update done under flock.  When there is no
+#                slot left, the one idle for the longest time is taken (a
+#                bucket idle long enough is full, as a new one).
+#
+#  Without fcntl (windows), the buckets are the process'.
+#
+########################################################################
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307  USA
+#
+#
+
+import mmap,os,struct,sys,threading,time
+import urllib.parse
+
+from hashlib import md5
+
+try    : import fcntl
+except : fcntl = None
+
+#============================================================
+# sr_bandwidth : the buckets of a configuration
+#============================================================
+
+class sr_bandwidth():
+
+    MAGIC  = b'SRBUCKET'
+    HEADER = struct.Struct('<8sI')
+    SLOT   = struct.Struct('<16sdd')
+    SLOTS  = 127
+    SIZE   = 16 + SLOTS * 32
+
+    def __init__(self, logger, kbytes_ps=0, kbytes_ps_destination=0, kbytes_burst=0, bucket_file=None ):
+
+        self.logger       = logger
+        self.rate         = kbytes_ps * 1024
+        self.rate_dest    = kbytes_ps_destination * 1024
+        self.burst        = kbytes_burst * 1024
+        self.bucket_file  = bucket_file
+
+        self.lock         = threading.Lock()
+        self.keys         = {}
+        self.fd           = None
+        self.buf          = None
+
+        # reserved, waits, seconds waited
+
+        self.bytes        = 0
+        self.waits        = 0
+        self.waited       = 0.0
+
+        self.open()
+
+    # capacity of a bucket at rate
+    def capacity(self, rate):
+        if self.burst : return self.burst
+        return rate
+
+    def close(self):
+        try   : self.buf.close()
+        except: pass
+        try   : os.close(self.fd)
+        except: pass
+        self.buf = None
+        self.fd  = None
+
+    # key : md5 of host:port of the destination (url or netloc)
+    def key(self, destination):
+
+        if destination in self.keys : return self.keys[destination]
+
+        name = destination
+        try :
+                url = urllib.parse.urlparse(destination)
+                if url.hostname :
+                   name = url.hostname
+                   if url.port : name += ':%d' % url.port
+        except: pass
+
+        key = md5(name.encode('utf-8')).digest()
+        self.keys[destination] = key
+
+        return key
+
+    # open : the bucket file, mmap'ed (created if needed), or the process' buckets
+    def open(self):
+
+        if self.bucket_file != None and fcntl != None :
+           try :
+                   self.fd = os.open(self.bucket_file, os.O_RDWR|os.O_CREAT, 0o600)
+           except:
+                   (stype, svalue, tb) = sys.exc_info()
+                   self.logger.warning("sr_bandwidth/open %s Type: %s, Value: %s" % (self.bucket_file, stype, svalue))
+                   self.logger.warning("bandwidth limited for this instance only")
+
+        if self.fd == None :
+           self.buf = bytearray(self.SIZE)
+           self.HEADER.pack_into(self.buf, 0, self.MAGIC, self.SLOTS)
+           return
+
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try :
+                if os.fstat(self.fd).st_size != self.SIZE or os.pread(self.fd,8,0) != self.MAGIC :
+                   self.logger.debug("sr_bandwidth new bucket file %s" % self.bucket_file)
+                   os.ftruncate(self.fd, 0)
+                   os.ftruncate(self.fd, self.SIZE)
+                   os.pwrite(self.fd, self.HEADER.pack(self.MAGIC, self.SLOTS), 0)
+                self.buf = mmap.mmap(self.fd, self.SIZE)
+        finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    # reserve : nbytes taken from the buckets, returns the seconds to wait for them
+    def reserve(self, nbytes, destination=None):
+
+        buckets = []
+        if self.rate : buckets.append( (0, None, self.rate) )
+        if self.rate_dest and destination : buckets.append( (None, self.key(destination), self.rate_dest) )
+
+        if not buckets : return 0
+
+        wait = 0.0
+
+        with self.lock :
+             if self.fd != None : fcntl.flock(self.fd, fcntl.LOCK_EX)
+             try :
+                     now = time.monotonic()
+                     for index, key, rate in buckets :
+                         if index == None : index = self.slot(key,now)
+                         wait = max(wait, self.take(index, key, rate, nbytes, now))
+             finally:
+                     if self.fd != None : fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+             self.bytes += nbytes
+             if wait > 0 :
+                self.waits  += 1
+                self.waited += wait
+
+        return wait
+
+    # slot : index of the slot of key, a free one or the one idle the longest
+    def slot(self, key, now):
+
+        start  = 1 + int.from_bytes(key[:4],'little') % (self.SLOTS - 1)
+        oldest = None
+
+        for i in range(self.SLOTS - 1) :
+            index = 1 + (start - 1 + i) % (self.SLOTS - 1)
+            skey, tokens, last = self.SLOT.unpack_from(self.buf, 16 + index * 32)
+            if skey == key or last == 0 : return index
+            if oldest == None or last < oldest[1] : oldest = (index, last)
+
+        return oldest[0]
+
+    # take : refill the bucket of slot index, take nbytes, seconds to wait if in debt
+    def take(self, index, key, rate, nbytes, now):
+
+        offset = 16 + index * 32
+        cap    = self.capacity(rate)
+
+        skey, tokens, last = self.SLOT.unpack_from(self.buf, offset)
+
+        # new bucket (or monotonic clock restarted : reboot) : full
+
+        if (key != None and skey != key) or last == 0 or last > now :
+           tokens = cap
+        else :
+           tokens = min(cap, tokens + (now - last) * rate)
+
+        tokens -= nbytes
+
+        self.SLOT.pack_into(self.buf, offset, key if key != None else bytes(16), tokens, now)
+
+        if tokens >= 0 : return 0
+
+        return -tokens / rate
+
+# =========================================
+# sr_bandwidth_open : one sr_bandwidth per bucket file in the process,
+#                     shared by the transfers of an instance (threads included)
+# =========================================
+
+sr_bandwidth_lock   = threading.Lock()
+sr_bandwidth_opened = {}
+
+def sr_bandwidth_open(parent):
+
+    kbytes_ps             = getattr(parent,'kbytes_ps',0)
+    kbytes_ps_destination = getattr(parent,'kbytes_ps_destination',0)
+    kbytes_burst          = getattr(parent,'kbytes_burst',0)
+
+    if not kbytes_ps and not kbytes_ps_destination : return None
+
+    bucket_file = None
+    if hasattr(parent,'user_cache_dir') and parent.user_cache_dir :
+       bucket_file = parent.user_cache_dir + os.sep + 'bandwidth.buckets'
+
+    index = (bucket_file, kbytes_ps, kbytes_ps_destination, kbytes_burst)
+
+    with sr_bandwidth_lock :
+         if not index in sr_bandwidth_opened :
+            sr_bandwidth_opened[index] = sr_bandwidth(parent.logger, kbytes_ps, kbytes_ps_destination, \
+                                                      kbytes_burst, bucket_file)
+         return sr_bandwidth_opened[index]
@@ -31,21 +31,61 @@
 #
 #
 
-import os,sys,time
+import mmap,os,sqlite3,struct,sys,time
 
 import urllib.parse
 
+from collections import OrderedDict
+
 
 #============================================================
 # sr_cache supports/uses :
 #
 # cache_file : default ~/.cache/sarra/'pgm'/'cfg'/recent_files_0001.cache
-#              each line in file is
-#              sum time path part
+#              cache_format text   : each line in file is
+#                                    sum time path part
+#              cache_format binary : MAGIC followed by blocks of n entries
+#                                    n,len(strings)        (BLOCK header)
+#                                    time1 ... timen       (n doubles, little endian)
+#                                    sum1\0path1\0part1\0 ... (strings, utf-8)
+#                                    so a block is decoded and split in one go.
+#              the format is detected when loading, and a cache found in
+#              the other format is converted to cache_format.
+#
+#              without cache_journal, an entry is written for every check.
+#              with cache_journal, only new entries are written, kept in
+#              pending and written together (one block in binary) when 
+#              cache_journal_batch entries are pending or cache_journal_interval
+#              has elapsed, then synced according to cache_journal_sync
+#              (none, flush to the os, fsync to disk). refreshed times reach
+#              the file at the next save (heartbeat).
+#              on load, the file is replayed; an incomplete last entry is dropped.
+#
+#              with cache_segments N, entries are appended to segment files
+#              recent_files_0001.cache.<seq> instead.  A new segment is started
+#              when the current one is older than caching/N, and a segment last
+#              written more than the caching interval ago only holds expired
+#              entries, so it is removed whole : the heartbeat never rewrites
+#              the cache.  In journal mode, an entry referenced again is written
+#              again when its last record is in an older segment.
+#              on load, all segments are replayed, then a new one is started.
 #
-# cache_dict : {}  
-#              cache_dict[sum] = [ (time1,[path1,part1]),(time2,[path2,part2])...]
+# cache_dict : OrderedDict()
+#              cache_dict[(sum,path,part)] = time, oldest reference first.
+#              sums are interned. every check moves the referenced entry
+#              to the end, so expired entries (and those to evict when
+#              cache_max_entries or cache_max_bytes is reached) are always
+#              at the front, and cleaning only visits those.
 #
+# ENTRY_OVERHEAD : approximate bytes used by an entry besides the characters
+#              of its strings (str headers, tuple, time float, dict slot
+#              and ordering links)
+#
+
+MAGIC = b'SRCACHE\x01'
+BLOCK = struct.Struct('<II')
+
+ENTRY_OVERHEAD = 350
 
 class sr_cache():
 
@@ -56,47 +96,74 @@ class sr_cache():
         self.logger        = parent.logger
 
         self.expire        = parent.caching
+        self.cache_format  = parent.cache_format
+        self.max_entries   = parent.cache_max_entries
+        self.max_bytes     = parent.cache_max_bytes
 
-        self.cache_dict    = {}
+        self.cache_dict    = OrderedDict()
         self.cache_file    = None
+        self.current_file  = None
         self.fp            = None
 
+        self.journal          = parent.cache_journal
+        self.journal_batch    = parent.cache_journal_batch
+        self.journal_interval = parent.cache_journal_interval
+        self.journal_sync     = parent.cache_journal_sync
+        self.pending          = []
+        self.last_flush       = time.time()
+
+        self.segments      = parent.cache_segments
+        self.segment_seq   = 0
+        self.segment_start = time.time()
+
         self.last_expire   = time.time()
         self.count         = 0
 
+        self.bytes         = 0
+        self.expired       = 0
+        self.evicted       = 0
+
     def check(self, key, path, part):
         self.logger.debug("sr_cache check")
 
-        qpath = urllib.parse.quote(path)
-        # set time and value
+        # set time and entry
         now   = time.time()
-        value = '%s*%s' % (path,part)
+        entry = (sys.intern(key),path,part)
+
+        # already there : refresh its time and position
+        # not there     : add it (new sum or sum with a different path/part)
+
+        present = entry in self.cache_dict
 
-        # new... add
-        if not key in self.cache_dict :
+        if present :
+           self.cache_dict.move_to_end(entry)
+
+           # journal : keep a record of the entry in the current segment
+
+           if self.segments and self.journal and self.cache_dict[entry] < self.segment_start :
+              self.pending.append((key,now,path,part))
+        else :
            self.logger.debug("new")
-           kdict = {}
-           kdict[value] = now
-           self.cache_dict[key] = kdict
-           self.fp.write("%s %f %s %s\n"%(key,now,qpath,part))
-           self.count += 1
-           return True
+           self.bytes += self.entry_size(entry)
 
-        # key (sum) in cache ... 
-        # if value "path part" already there update its time
-        # if value "path part" not there add it 
-        # this ends up to be the same code
+        self.cache_dict[entry] = now
+
+        # differ or newer, write to file (journal : only new, in batches)
+
+        if not self.journal :
+           self.write_entries(self.fp,[(key,now,path,part)])
+           self.count += 1
 
-        kdict   = self.cache_dict[key]
-        present = value in kdict
-        kdict[value] = now
+        else :
+           if not present :
+              self.pending.append((key,now,path,part))
+              self.count += 1
 
-        if not present : self.logger.debug("differ")
+           if len(self.pending) >= self.journal_batch or now - self.last_flush >= self.journal_interval :
+              self.flush()
 
-        # differ or newer, write to file
+        if not present : self.evict()
 
-        self.fp.write("%s %f %s %s\n"%(key,now,qpath,part))
-        self.count += 1
         return not present
 
     def check_msg(self, msg):
@@ -114,134 +181,256 @@ class sr_cache():
     def clean(self, fp = None, delpath = None):
         self.logger.debug("sr_cache clean")
 
-        # create refreshed dict
+        # drop expired entries : they are all at the front
 
-        now        = time.time()
-        new_dict   = {}
-        self.count = 0
+        now     = time.time()
+        oldest  = now - self.expire
+
+        while self.cache_dict :
+              entry, t = next(iter(self.cache_dict.items()))
+              if t >= oldest : break
+              self.remove(entry)
+              self.expired += 1
+
+        self.count = len(self.cache_dict)
 
-        if delpath != None:
-            qdelpath = urllib.parse.quote(delpath)
-        else:
-            qdelpath = None
+        if fp == None and delpath == None : return
 
-        # from  cache[sum] = [(time,[path,part]), ... ]
-        for key in self.cache_dict.keys() :
-            ndict = {}
-            kdict = self.cache_dict[key]
+        # write out (oldest first) or remove the remaining entries
 
-            for value in kdict :
-                # expired or keep
-                t   = kdict[value]
-                ttl = now - t
-                if ttl > self.expire : continue
+        entries = []
 
-                parts = value.split('*')
-                path  = parts[0]
-                qpath = urllib.parse.quote(path)
-                part  = parts[1]
+        for entry,t in list(self.cache_dict.items()) :
+            key,path,part = entry
 
-                if qpath == qdelpath  : continue
+            if path == delpath  :
+               self.remove(entry)
+               self.count -= 1
+               continue
 
-                ndict[value] = t
-                self.count  += 1
+            if fp : entries.append((key,t,path,part))
 
-                if fp : fp.write("%s %f %s %s\n"%(key,t,qpath,part))
+        if fp : self.write_entries(fp,entries)
 
-            if len(ndict) > 0 : new_dict[key] = ndict
+    def convert(self, cache_file, cache_format):
+        self.logger.debug("sr_cache convert %s to %s" % (cache_file,cache_format))
 
-        # set cleaned cache_dict
-        self.cache_dict = new_dict
+        # load the file whatever its format, save it back in cache_format
+
+        self.cache_format = cache_format
+        self.open(cache_file)
+        self.save()
+        self.close()
 
     def close(self, unlink=False):
         self.logger.debug("sr_cache close")
         try   :
+                self.write_entries(self.fp,self.pending)
+                self.pending = []
                 self.fp.flush()
                 self.fp.close()
         except: pass
         self.fp = None
 
-        if unlink:
-           try   : os.unlink(self.cache_file)
-           except: pass
+        if unlink: self.remove_files()
 
-        self.cache_dict = {}
-        self.count      = 0
+        self.cache_dict   = OrderedDict()
+        self.count        = 0
+        self.bytes        = 0
 
     def delete_path(self, delpath):
         self.logger.debug("sr_cache delete_path")
 
-        # close,remove file, open new empty file
-        self.fp.close()
-        if os.path.exists( self.cache_file ):
-            os.unlink( self.cache_file )
-        self.fp = open(self.cache_file,'w')
+        # rewrite the cache without delpath
+        self.rewrite(delpath)
 
-        # clean cache removing delpath
+    def flush(self):
 
-        self.clean(self.fp, delpath)
+        self.last_flush = time.time()
+
+        if self.pending :
+           self.write_entries(self.fp,self.pending)
+           self.pending = []
+
+        if self.journal_sync == 'none' : return
+
+        self.fp.flush()
+        if self.journal_sync == 'fsync' : os.fsync(self.fp.fileno())
 
     def free(self):
         self.logger.debug("sr_cache free")
-        self.cache_dict = {}
-        self.count      = 0
-        try   : os.unlink(self.cache_file)
+        self.cache_dict   = OrderedDict()
+        self.count        = 0
+        self.bytes        = 0
+        self.pending      = []
+        if self.fp : self.fp.close()
+        self.fp = None
+        self.remove_files()
+        self.open_current('w')
+
+    def entry_size(self, entry):
+        key,path,part = entry
+        return len(key) + len(path) + len(part or "") + ENTRY_OVERHEAD
+
+    def evict(self):
+
+        # over the limits : drop least recently referenced entries
+
+        while self.cache_dict and \
+              ( ( self.max_entries and len(self.cache_dict) > self.max_entries ) or \
+                ( self.max_bytes   and self.bytes           > self.max_bytes   ) ) :
+              entry = next(iter(self.cache_dict))
+              self.remove(entry)
+              self.evicted += 1
+
+    def file_format(self, path):
+        try   :
+                with open(path,'rb') as f :
+                     if f.read(len(MAGIC)) == MAGIC : return 'binary'
         except: pass
-        self.fp = open(self.cache_file,'w')
+        return 'text'
 
     def load(self):
         self.logger.debug("sr_cache load")
-        self.cache_dict = {}
-        self.count      = 0
+        self.cache_dict   = OrderedDict()
+        self.count        = 0
+        self.bytes        = 0
+        entries           = []
+
+        # the cache file and/or its segments, oldest first
 
-        # create file if not existing
-        if not os.path.isfile(self.cache_file) :
-           self.fp = open(self.cache_file,'w')
-           self.fp.close()
+        segments = self.segment_files()
+        if segments : self.segment_seq = segments[-1][0]
+
+        files = [ path for seq,path in segments ]
+        if os.path.isfile(self.cache_file) : files.insert(0,self.cache_file)
 
         # set time 
         now = time.time()
 
-        # open file (read/append)... 
         # read through
-        # keep open to append entries
 
-        self.fp = open(self.cache_file,'r+')
-        lineno=0
-        while True :
-              # read line, parse words
-              line  = self.fp.readline()
-              if not line : break
-              lineno += 1
+        formats = set()
+
+        for path in files :
+            file_format = self.file_format(path)
+            formats.add(file_format)
+
+            if file_format == 'binary' : entries.extend(self.load_binary(path,now))
+            else                       : entries.extend(self.load_text(path,now))
+
+        # add info in cache, oldest first, so the index stays time ordered
+
+        entries.sort(key=lambda e: e[0])
+
+        cache_dict = self.cache_dict
+
+        for ctime,key,path,part in entries :
+              entry = (sys.intern(key),path,part)
+              if entry in cache_dict : cache_dict.move_to_end(entry)
+              cache_dict[entry] = ctime
 
-              # words  = [ sum, time, path, part ]
-              try:
-                  words    = line.split()
-                  key      = words[0]
-                  ctime    = float(words[1])
-                  qpath     = words[2]
-                  path     = urllib.parse.unquote(qpath)
-                  part     = words[3]
-                  value    = '%s*%s' % (path,part)
+        self.bytes = sum([ self.entry_size(entry) for entry in cache_dict ])
 
-                  # skip expired entry
+        self.evict()
 
-                  ttl   = now - ctime
-                  if ttl > self.expire : continue
+        self.count = len(cache_dict)
 
-              except: # skip corrupted line.
-                  self.logger.error("sr_cache load corrupted line %d in %s" % ( lineno, self.cache_file) )
-                  continue
+        # files in the other format, or segments not matching cache_segments : rewrite
 
-              #  add info in cache
+        if formats - set([self.cache_format]) or \
+           ( segments and not self.segments ) or \
+           ( self.segments and os.path.isfile(self.cache_file) ) :
+           self.logger.info("sr_cache converting %s to cache_format %s cache_segments %d" % \
+                           (self.cache_file,self.cache_format,self.segments))
+           self.rewrite()
+           return
 
-              if key in self.cache_dict : kdict = self.cache_dict[key]
-              else:                       kdict = {}
+        # keep open to append entries (with segments, in a new one)
 
-              if not value in kdict     : self.count += 1
+        self.open_current('a')
 
-              kdict[value]         = ctime
-              self.cache_dict[key] = kdict
+    def load_binary(self, path, now):
+        entries = []
+
+        with open(path,'rb') as f :
+             size   = os.fstat(f.fileno()).st_size
+             offset = len(MAGIC)
+             if size <= offset : return entries
+
+             buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+             while offset + BLOCK.size <= size :
+                   n, slen = BLOCK.unpack_from(buf,offset)
+                   begin   = offset + BLOCK.size
+                   middle  = begin  + 8*n
+                   end     = middle + slen
+                   if end > size : break
+                   offset  = end
+
+                   times   = struct.unpack_from('<%dd' % n, buf, begin)
+                   strings = buf[middle:end].decode('utf-8','surrogateescape').split('\0')
+
+                   # skip expired entries
+
+                   oldest  = now - self.expire
+                   entries.extend([ e for e in zip(times,strings[0::3],strings[1::3],strings[2::3]) \
+                                      if e[0] >= oldest ])
+
+             buf.close()
+
+        # partially written block at the end : drop it so appends stay readable
+
+        if offset < size :
+           self.logger.error("sr_cache load truncated block at offset %d in %s" % ( offset, path) )
+           os.truncate(path,offset)
+
+        return entries
+
+    def load_text(self, path, now):
+        entries = []
+
+        # partially written line at the end : drop it so appends stay readable
+
+        with open(path,'rb+') as f :
+             size = f.seek(0,os.SEEK_END)
+             if size > 0 :
+                f.seek(max(0,size-4096))
+                tail = f.read()
+                last = tail.rfind(b'\n')
+                if not tail.endswith(b'\n') and ( last >= 0 or len(tail) == size ) :
+                   self.logger.error("sr_cache load truncated line at the end of %s" % path )
+                   f.truncate(size - len(tail) + last + 1)
+
+        with open(path,'r') as f :
+             lineno=0
+             while True :
+                   # read line, parse words
+                   line  = f.readline()
+                   if not line : break
+                   lineno += 1
+
+                   # words  = [ sum, time, path, part ]
+                   try:
+                       words    = line.split()
+                       key      = words[0]
+                       ctime    = float(words[1])
+                       qpath    = words[2]
+                       path     = urllib.parse.unquote(qpath)
+                       part     = words[3]
+
+                       # skip expired entry
+
+                       ttl   = now - ctime
+                       if ttl > self.expire : continue
+
+                   except: # skip corrupted line.
+                       self.logger.error("sr_cache load corrupted line %d in %s" % ( lineno, path) )
+                       continue
+
+                   entries.append((ctime,key,path,part))
+
+        return entries
 
 
     def open(self, cache_file = None):
@@ -254,21 +443,146 @@ class sr_cache():
 
         self.load()
 
+    def open_current(self, mode):
+
+        # without segments : the cache file
+
+        if not self.segments :
+           self.current_file = self.cache_file
+           self.fp           = self.open_file(mode)
+           return
+
+        # with segments : a new segment, after closing the current one
+
+        self.segment_close()
+
+        self.segment_seq  += 1
+        self.segment_start = time.time()
+        self.current_file  = self.cache_file + '.%d' % self.segment_seq
+        self.fp            = self.open_file('w')
+
+    def open_file(self, mode):
+
+        # binary files always begin with MAGIC
+
+        if self.cache_format != 'binary' : return open(self.current_file,mode)
+
+        fp = open(self.current_file,mode+'b')
+        if fp.tell() == 0 :
+           fp.write(MAGIC)
+           fp.flush()
+        return fp
+
+    def remove(self, entry):
+
+        del self.cache_dict[entry]
+        self.bytes -= self.entry_size(entry)
+
+    def remove_files(self):
+
+        for seq,path in [ (0,self.cache_file) ] + self.segment_files() :
+            try   : os.unlink(path)
+            except: pass
+
+    def rewrite(self, delpath = None):
+        self.logger.debug("sr_cache rewrite")
+
+        # close,remove files (pending entries are in cache_dict)
+        if self.fp : self.fp.close()
+        self.fp      = None
+        self.pending = []
+        self.remove_files()
+
+        # new empty file (or segment), write unexpired entries
+        self.open_current('w')
+        self.clean(self.fp, delpath)
+
     def save(self):
         self.logger.debug("sr_cache save")
 
-        # close,remove file
-        if self.fp : self.fp.close()
-        try   : 
-                os.unlink(self.cache_file)
+        # without segments : rewrite the unexpired entries
+
+        if not self.segments :
+           try   : self.rewrite()
+           except: pass
+           return
+
+        # with segments : expire in memory, start a new segment when due,
+        # remove the segments that only hold expired entries
+
+        self.clean()
+
+        try   :
+                self.write_entries(self.fp,self.pending)
+                self.pending = []
+                self.fp.flush()
+
+                if time.time() - self.segment_start >= self.expire / self.segments :
+                   self.open_current('w')
+
+                self.segment_drop()
         except: pass
 
-        # new empty file, write unexpired entries
-        try   : 
-                self.fp = open(self.cache_file,'w')
-                self.clean(self.fp)
+    def segment_close(self):
+
+        if self.fp == None : return
+
+        self.write_entries(self.fp,self.pending)
+        self.pending = []
+        self.fp.close()
+        self.fp      = None
+
+        # date the segment from its last use : entries referenced in it are not newer
+
+        try   : os.utime(self.current_file)
         except: pass
 
+    def segment_drop(self):
+
+        oldest = time.time() - self.expire
+
+        for seq,path in self.segment_files() :
+            if seq == self.segment_seq : continue
+            try   :
+                    if os.stat(path).st_mtime < oldest :
+                       self.logger.debug("sr_cache removing segment %s" % path)
+                       os.unlink(path)
+            except: pass
+
+    def segment_files(self):
+
+        # (seq,path) of the segments of cache_file, in seq order
+
+        dirname,basename = os.path.split(self.cache_file)
+        prefix = basename + '.'
+
+        try   : names = os.listdir(dirname or '.')
+        except: names = []
+
+        files = []
+        for name in names :
+            seq = name[len(prefix):]
+            if name.startswith(prefix) and seq.isdigit() :
+               files.append((int(seq),os.path.join(dirname,name)))
+
+        files.sort()
+        return files
+
+
+    def write_entries(self, fp, entries):
+
+        if self.cache_format != 'binary' :
+           for key,t,path,part in entries :
+               fp.write("%s %f %s %s\n"%(key,t,urllib.parse.quote(path),part))
+           return
+
+        if not entries : return
+
+        times   = struct.pack('<%dd' % len(entries), *[ e[1] for e in entries ])
+        strings = '\0'.join([ '%s\0%s\0%s' % (e[0],e[2],e[3]) for e in entries ])
+        strings = strings.encode('utf-8','surrogateescape')
+
+        fp.write(BLOCK.pack(len(entries),len(strings)) + times + strings)
 
     def check_expire(self):
         self.logger.debug("sr_cache check_expire")
@@ -278,3 +592,130 @@ class sr_cache():
            self.last_expire = now
            self.clean()
 
+
+#============================================================
+# sr_cache_sqlite : cache_backend sqlite
+#
+# same interface as sr_cache, but the cache is an sqlite database
+# shared by all instances of a configuration, so duplicates are
+# suppressed across instances.
+#
+# cache_file : default ~/.cache/sarra/'pgm'/'cfg'/recent_files.db
+#              table cache (sum, path, part, time) in WAL mode,
+#              indexed on time so expiry only visits expired rows.
+#
+# each check is one short write transaction (BEGIN IMMEDIATE),
+# so two instances checking the same entry cannot both find it new.
+#
+
+class sr_cache_sqlite(sr_cache):
+
+    def __init__(self, parent ):
+        sr_cache.__init__(self,parent)
+        self.db = None
+
+    def check(self, key, path, part):
+        self.logger.debug("sr_cache_sqlite check")
+
+        now = time.time()
+
+        self.db.execute('BEGIN IMMEDIATE')
+        try :
+                # present and not expired : refresh its time
+
+                cur = self.db.execute('UPDATE cache SET time=? WHERE sum=? AND path=? AND part=? AND time>=?', \
+                                      (now,key,path,part,now-self.expire))
+                present = cur.rowcount == 1
+
+                if not present :
+                   self.logger.debug("new")
+                   self.db.execute('INSERT OR REPLACE INTO cache VALUES (?,?,?,?)', (key,path,part,now))
+
+                self.db.execute('COMMIT')
+        except:
+                self.db.execute('ROLLBACK')
+                raise
+
+        if not present : self.count += 1
+
+        return not present
+
+    def clean(self, fp = None, delpath = None):
+        self.logger.debug("sr_cache_sqlite clean")
+
+        oldest = time.time() - self.expire
+
+        cur = self.db.execute('DELETE FROM cache WHERE time<?', (oldest,))
+        self.expired += cur.rowcount
+
+        if delpath != None :
+           self.db.execute('DELETE FROM cache WHERE path=?', (delpath,))
+
+        self.count = self.db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+        # over cache_max_entries : drop the oldest ones
+
+        if self.max_entries and self.count > self.max_entries :
+           cur = self.db.execute('DELETE FROM cache WHERE time <= ' + \
+                                 '(SELECT time FROM cache ORDER BY time LIMIT 1 OFFSET ?)', \
+                                 (self.count-self.max_entries-1,))
+           self.evicted += cur.rowcount
+           self.count   -= cur.rowcount
+
+    def close(self, unlink=False):
+        self.logger.debug("sr_cache_sqlite close")
+        try   : self.db.close()
+        except: pass
+        self.db = None
+
+        if unlink and self.cache_file :
+           for suffix in [ '', '-wal', '-shm' ] :
+               try   : os.unlink(self.cache_file + suffix)
+               except: pass
+
+        self.count = 0
+
+    def delete_path(self, delpath):
+        self.logger.debug("sr_cache_sqlite delete_path")
+        self.clean(delpath=delpath)
+
+    def free(self):
+        self.logger.debug("sr_cache_sqlite free")
+        self.db.execute('DELETE FROM cache')
+        self.count = 0
+
+    def load(self):
+        self.logger.debug("sr_cache_sqlite load")
+
+        # autocommit, transactions are explicit in check
+
+        self.db = sqlite3.connect(self.cache_file, timeout=60, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS cache ' + \
+                        '(sum TEXT, path TEXT, part TEXT, time REAL, PRIMARY KEY (sum,path,part)) WITHOUT ROWID')
+        self.db.execute('CREATE INDEX IF NOT EXISTS cache_time ON cache (time)')
+
+        self.clean()
+
+    def open(self, cache_file = None):
+
+        self.cache_file = cache_file
+
+        if cache_file == None :
+           self.cache_file = self.parent.user_cache_dir + os.sep + 'recent_files.db'
+
+        self.load()
+
+    def save(self):
+        self.logger.debug("sr_cache_sqlite save")
+
+        # entries are already on disk, just drop the expired ones
+
+        self.clean()
+
+# sr_cache_create : the cache of parent's cache_backend
+
+def sr_cache_create(parent):
+    if parent.cache_backend == 'sqlite' : return sr_cache_sqlite(parent)
+    return sr_cache(parent)
@@ -21,6 +21,12 @@ The API of a checksum class (in calling sequence order):
    set_path      -- identify the checksumming algorithm to be used by update.
    update        -- given this chunk of the file, update the checksum for the part
 
+   update_view   -- class attribute : True when update also takes a memoryview (of a buffer
+                    reused once update returns), False (default) for bytes only.
+   needs_data    -- class attribute : True (default) when update computes the checksum from
+                    the data, False when the value does not depend on it (file copies may then
+                    skip reading the data).
+
 The API allows for checksums to be calculated while transfer is in progress 
 rather than after the fact as a second pass through the data.  
 
@@ -34,6 +40,9 @@ class sr_checksum(object):
       """
       The default algorithm is to do a checksum of the entire contents of the file, which is called 'd'.
       """
+      update_view = False
+      needs_data  = True
+
       def __init__(self):
           self.value = None
 
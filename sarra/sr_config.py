@@ -54,10 +54,12 @@ from   paramiko import *
 try :
          from sr_checksum          import *
          from sr_credentials       import *
+         from sr_masks             import *
          from sr_util              import *
 except : 
          from sarra.sr_checksum    import *
          from sarra.sr_credentials import *
+         from sarra.sr_masks       import *
          from sarra.sr_util        import *
 
 if sys.hexversion > 0x03030000 :
@@ -573,6 +575,7 @@ class sr_config:
         #self.debug = True
         self.debug                = False
 
+        self.retry_backend        = 'file'
         self.retry_mode           = True
         self.retry_ttl            = None
 
@@ -586,9 +589,12 @@ class sr_config:
         self.report_daemons          = False
 
         self.bufsize              = self.chunksize_from_str('1M')
+        self.bufsize_max          = 0      # read_write chunks grow up to it, 0 : bufsize only
         self.timeout              = self.duration_from_str('5m',setting_units='s')
 
-        self.kbytes_ps            = 0
+        self.kbytes_ps            = 0      # all instances together (sr_bandwidth), 0 : unlimited
+        self.kbytes_ps_destination= 0      # towards each destination, 0 : unlimited
+        self.kbytes_burst         = 0      # bucket capacity, 0 : one second at its rate
 
         self.add_sumalgo_list     = []
         self.sumalgos             = {}
@@ -602,6 +608,7 @@ class sr_config:
         self.attempts             = 3   # number of times to attempt downloads.
         self.broker               = None
         self.bindings             = []
+        self.consume_push         = False
         self.exchange             = None
         self.exchange_suffix      = None
         self.exchanges            = [ 'xlog', 'xpublic', 'xreport', 'xwinnow' ]
@@ -615,11 +622,21 @@ class sr_config:
         self.reset                = False
         self.message_ttl          = None
         self.prefetch             = 25
+        self.prefetch_adaptive    = False
+        self.prefetch_min         = 1
+        self.prefetch_max         = 1000
+        self.ack_batch            = 1
+        self.ack_interval         = 1.0
+        self.post_batch           = 1
+        self.post_batch_interval  = 1.0
+        self.post_confirm_window  = 0
         self.max_queue_size       = 25000
         self.set_passwords        = True
 
         self.accept_unmatch       = None     # default changes depending on program
         self.masks                = []       # All the masks (accept and reject)
+        self.masks_matcher        = None     # masks compiled (sr_masks)
+        self.mask_cache           = 0        # urls (or directories) whose mask is remembered
         self.currentPattern       = None     # defaults to all
         self.currentDir           = os.getcwd()   # mask directory (if needed)
         self.currentFileOption    = None     # should implement metpx like stuff
@@ -639,6 +656,15 @@ class sr_config:
         # cache
         self.cache                = None
         self.caching              = False
+        self.cache_backend        = 'file'
+        self.cache_format         = 'text'
+        self.cache_journal        = False
+        self.cache_journal_batch  = 100
+        self.cache_journal_interval = 1.0
+        self.cache_journal_sync   = 'flush'
+        self.cache_max_bytes      = 0
+        self.cache_max_entries    = 0
+        self.cache_segments       = 0
         self.cache_stat           = False
 
         # save/restore
@@ -692,6 +718,8 @@ class sr_config:
 
         self.destination          = None
         self.discard              = False
+        self.download_threads     = 0      # downloads in threads (sr_worker), 0 or 1 : none
+        self.download_inflight_max= 0      # messages downloading at most, 0 : twice download_threads
 
         self.events               = 'create|delete|link|modify'
         self.event                = 'create|delete|modify'
@@ -701,6 +729,7 @@ class sr_config:
         self.force_polling        = False
 
         self.gateway_for          = []
+        self.http_engine          = 'urllib' # http(s) downloads : urllib (sr_http) or asyncio (sr_async_http)
         self.mirror               = False
 
         self.outlet               = 'post'
@@ -1021,23 +1050,36 @@ class sr_config:
  
     def isMatchingPattern(self, chaine, accept_unmatch = False): 
 
-        for mask in self.masks:
-            self.logger.debug( "isMatchingPattern: mask: %s" % str(mask) )
-            pattern, maskDir, maskFileOption, mask_regexp, accepting, mirror, strip, pstrip, flatten = mask
-            self.currentPattern    = pattern
-            self.currentDir        = maskDir
-            self.currentFileOption = maskFileOption
-            self.currentRegexp     = mask_regexp
-            self.mirror = mirror
-            self.strip = strip
-            self.pstrip = pstrip
-            self.flatten = flatten
-            if mask_regexp.match(chaine) :
-               if not accepting : return False
-               self.logger.debug( "isMatchingPattern: mask=%s strip=%s" % (str(mask), strip) )
-               return True
-
-        return accept_unmatch
+        # masks compiled on first use (sr_masks), again when they changed
+
+        if self.masks_matcher == None or self.masks_matcher.stale(self.masks,self.mask_cache) :
+           self.masks_matcher = sr_masks(self.masks,cache=self.mask_cache)
+
+        i = self.masks_matcher.lookup(chaine)
+
+        # as when trying every mask : no match leaves the last one current
+
+        if i < 0 :
+           if len(self.masks) == 0 : return accept_unmatch
+           mask = self.masks[-1]
+        else :
+           mask = self.masks[i]
+
+        pattern, maskDir, maskFileOption, mask_regexp, accepting, mirror, strip, pstrip, flatten = mask
+        self.currentPattern    = pattern
+        self.currentDir        = maskDir
+        self.currentFileOption = maskFileOption
+        self.currentRegexp     = mask_regexp
+        self.mirror = mirror
+        self.strip = strip
+        self.pstrip = pstrip
+        self.flatten = flatten
+
+        if i < 0 : return accept_unmatch
+
+        if not accepting : return False
+        self.logger.debug( "isMatchingPattern: mask=%s strip=%s" % (str(mask), strip) )
+        return True
 
     def isTrue(self,S):
         s = S.lower()
@@ -1456,6 +1498,17 @@ class sr_config:
                         self.accept_unmatch = self.isTrue(words[1])
                         n = 2
 
+                elif words0 == 'ack_batch': # See: sr_subscribe.1
+                     self.ack_batch = int(words1)
+                     if self.ack_batch < 1 :
+                        self.logger.error("ack_batch must be at least 1 (%s)" % words1 )
+                        needexit = True
+                     n = 2
+
+                elif words0 == 'ack_interval': # See: sr_subscribe.1
+                     self.ack_interval = self.duration_from_str(words1,'s')
+                     n = 2
+
                 elif words0 in [ 'a', 'action' ]:
                      self.action = words1
                      n = 2
@@ -1495,7 +1548,7 @@ class sr_config:
                      urlstr      = words1
                      ok, url     = self.validate_urlstr(urlstr)
                      self.broker = url
-                     if not ok or not url.scheme in ['amqp','amqps']:
+                     if not ok or not url.scheme in ['amqp','amqps','mem']:
                         self.logger.error("invalid broker URL (%s)" % urlstr)
                         needexit = True
                      n = 2
@@ -1512,6 +1565,10 @@ class sr_config:
                      self.bufsize = int(words[1])
                      n = 2
 
+                elif words0 == 'bufsize_max' :   # See: sr_subscribe.1
+                     self.bufsize_max = self.chunksize_from_str(words1)
+                     n = 2
+
                 elif words0 in [ 'caching', 'cache', 'no_duplicates', 'noduplicates', 'nd', 'suppress_duplicates', 'sd' ] : # See: sr_post.1 sr_watch.1
                      if (words1 is None) or words[0][0:1] == '-' : 
                         self.caching = 300
@@ -1531,6 +1588,58 @@ class sr_config:
                      #if self.caching: ####@
                      #   self.cache = sr_cache(self) ####@
 
+                elif words0 == 'cache_backend' : # See: sr_subscribe.1
+                     self.cache_backend = words1.lower()
+                     if not self.cache_backend in [ 'file', 'sqlite' ] :
+                        self.logger.error("cache_backend must be file or sqlite (%s)" % words1)
+                        needexit = True
+                     n = 2
+
+                elif words0 == 'cache_format' : # See: sr_subscribe.1
+                     self.cache_format = words1.lower()
+                     if not self.cache_format in [ 'text', 'binary' ] :
+                        self.logger.error("cache_format must be text or binary (%s)" % words1)
+                        needexit = True
+                     n = 2
+
+                elif words0 == 'cache_journal' : # See: sr_subscribe.1
+                     if (words1 is None) or words[0][0:1] == '-' : 
+                        self.cache_journal = True
+                        n = 1
+                     else :
+                        self.cache_journal = self.isTrue(words[1])
+                        n = 2
+
+                elif words0 == 'cache_journal_batch' : # See: sr_subscribe.1
+                     self.cache_journal_batch = int(words1)
+                     n = 2
+
+                elif words0 == 'cache_journal_interval' : # See: sr_subscribe.1
+                     self.cache_journal_interval = self.duration_from_str(words1,'s')
+                     n = 2
+
+                elif words0 == 'cache_journal_sync' : # See: sr_subscribe.1
+                     self.cache_journal_sync = words1.lower()
+                     if not self.cache_journal_sync in [ 'none', 'flush', 'fsync' ] :
+                        self.logger.error("cache_journal_sync must be none, flush or fsync (%s)" % words1)
+                        needexit = True
+                     n = 2
+
+                elif words0 == 'cache_max_bytes' : # See: sr_subscribe.1
+                     self.cache_max_bytes = self.chunksize_from_str(words1)
+                     n = 2
+
+                elif words0 == 'cache_max_entries' : # See: sr_subscribe.1
+                     self.cache_max_entries = int(words1)
+                     n = 2
+
+                elif words0 == 'cache_segments' : # See: sr_subscribe.1
+                     self.cache_segments = int(words1)
+                     if self.cache_segments < 0 :
+                        self.logger.error("cache_segments must be 0 or more (%s)" % words1)
+                        needexit = True
+                     n = 2
+
                 elif words0 == 'cache_stat'   : # FIXME! what is this?
                      if (words1 is None) or words[0][0:1] == '-' : 
                         self.cache_stat = True
@@ -1576,6 +1685,14 @@ class sr_config:
                              self.config(include)
                      n = 2
 
+                elif words0 == 'consume_push': # See: sr_subscribe.1
+                     if (words1 is None) or words[0][0:1] == '-' : 
+                        self.consume_push = True
+                        n = 1
+                     else :
+                        self.consume_push = self.isTrue(words[1])
+                        n = 2
+
                 elif words0 == 'debug': # See: sr_config.7
                      debug = self.debug
                      if (words1 is None) or words[0][0:1] == '-' : 
@@ -1663,6 +1780,17 @@ class sr_config:
                      ok = self.execfile("do_send",words1)
                      n = 2
 
+                elif words0 == 'download_inflight_max': # See: sr_subscribe.1
+                     self.download_inflight_max = int(words1)
+                     n = 2
+
+                elif words0 == 'download_threads': # See: sr_subscribe.1
+                     self.download_threads = int(words1)
+                     if self.download_threads < 0 :
+                        self.logger.error("download_threads must be 0 or more (%s)" % words1)
+                        needexit = True
+                     n = 2
+
                 elif words0 == 'durable'   : # See sr_config.7 ++
                      if (words1 is None) or words[0][0:1] == '-' : 
                         self.durable = True
@@ -1782,6 +1910,14 @@ class sr_config:
                      self.hostname = words[1] 
                      n = 2
 
+                elif words0 == 'http_engine': # See: sr_subscribe.1
+                     if not words1 in [ 'urllib', 'asyncio' ] :
+                        self.logger.error("http_engine must be urllib or asyncio (%s)" % words1)
+                        needexit = True
+                     else :
+                        self.http_engine = words1
+                     n = 2
+
                 elif words0 in ['inplace','in','assemble']: # See: sr_sarra.8, sr_post.1, sr_watch.1
                      if (words1 is None) or words[0][0:1] == '-' : 
                         self.inplace = True
@@ -1799,10 +1935,18 @@ class sr_config:
                      self.interface = words[1]
                      n = 2
 
+                elif words0 == 'kbytes_burst': # See: sr_subscribe.1
+                     self.kbytes_burst = int(words[1])
+                     n = 2
+
                 elif words0 == 'kbytes_ps': # See: sr_sender 
                      self.kbytes_ps = int(words[1])
                      n = 2
 
+                elif words0 == 'kbytes_ps_destination': # See: sr_subscribe.1
+                     self.kbytes_ps_destination = int(words[1])
+                     n = 2
+
                 elif words0 in ['lock','inflight']: # See: sr_config.7, sr_subscribe.1
                      if words0 in [ 'lock' ]: # FIXME: remove support in 2019.
                         self.logger.warning( "Deprecated option. Please use *inflight* instead of *lock*" )
@@ -1893,6 +2037,16 @@ class sr_config:
                         needexit = True
                      n = 2
 
+                elif words0 == 'mask_cache': # See: sr_config.7
+                     self.mask_cache = int(words1)
+                     if self.mask_cache < 0 :
+                        self.logger.error("mask_cache must be 0 (off) or more (%s)" % words1)
+                        needexit = True
+                     if self.mask_cache > 0 and not hasattr(self,'heartbeat_mask_cache_installed') :
+                        self.execfile("plugin",'hb_mask_cache')
+                        self.heartbeat_mask_cache_installed = True
+                     n = 2
+
                 elif words0 == 'max_queue_size':  # See: sr_audit.8 (sr_config also)
                      self.max_queue_size = int(words[1])
                      n = 2
@@ -2068,15 +2222,30 @@ class sr_config:
                      n = 2
 
 
+                elif words0 == 'post_batch': # See: sr_subscribe.1
+                     self.post_batch = int(words1)
+                     if self.post_batch < 1 :
+                        self.logger.error("post_batch must be at least 1 (%s)" % words1 )
+                        needexit = True
+                     n = 2
+
+                elif words0 == 'post_batch_interval': # See: sr_subscribe.1
+                     self.post_batch_interval = self.duration_from_str(words1,'s')
+                     n = 2
+
                 elif words0 in ['post_broker','pb'] : # See: sr_sarra,sender,shovel,winnow
                      urlstr      = words1
                      ok, url     = self.validate_urlstr(urlstr)
                      self.post_broker = url
-                     if not ok or not url.scheme in ['amqp','amqps']:
+                     if not ok or not url.scheme in ['amqp','amqps','mem']:
                         self.logger.error("invalid post_broker url (%s)" % urlstr)
                         needexit = True
                      n = 2
 
+                elif words0 == 'post_confirm_window': # See: sr_subscribe.1
+                     self.post_confirm_window = int(words1)
+                     n = 2
+
                 elif words0 in ['post_document_root','pdr']: # See: sr_sarra,sender,shovel,winnow
                      if sys.platform == 'win32':
                          self.post_document_root = words1.replace('\\','/')
@@ -2100,6 +2269,22 @@ class sr_config:
                      self.prefetch = int(words1)
                      n = 2
 
+                elif words0 == 'prefetch_adaptive': # See: sr_subscribe.1
+                     if (words1 is None) or words[0][0:1] == '-' : 
+                        self.prefetch_adaptive = True
+                        n = 1
+                     else :
+                        self.prefetch_adaptive = self.isTrue(words[1])
+                        n = 2
+
+                elif words0 == 'prefetch_max': # See: sr_subscribe.1
+                     self.prefetch_max = int(words1)
+                     n = 2
+
+                elif words0 == 'prefetch_min': # See: sr_subscribe.1
+                     self.prefetch_min = int(words1)
+                     n = 2
+
                 elif words0 in ['preserve_mode','pm'] : # See: sr_config.7
                      if (words1 is None) or words[0][0:1] == '-' : 
                         self.preserve_mode = True
@@ -2193,6 +2378,13 @@ class sr_config:
                         self.reset = self.isTrue(words[1])
                         n = 2
 
+                elif words0 == 'retry_backend' : # See: sr_subscribe.1
+                     self.retry_backend = words1.lower()
+                     if not self.retry_backend in [ 'file', 'sqlite' ] :
+                        self.logger.error("retry_backend must be file or sqlite (%s)" % words1)
+                        needexit = True
+                     n = 2
+
                 elif words0 in [ 'retry', 'retry_mode']:  # See: sr_consumer.1
                      if (words1 is None) or words[0][0:1] == '-' : 
                         self.retry_mode = True
@@ -56,8 +56,13 @@ class sr_consumer:
         self.broker         = parent.broker
 
         self.hc              = None
-        self.retry           = sr_retry(parent)
+        if parent.retry_backend == 'sqlite' : self.retry = sr_retry_sqlite(parent)
+        else                                : self.retry = sr_retry(parent)
         self.raw_msg         = None
+        self.notice          = sr_notice()
+        self.auto_ack        = True
+        self.idle            = time.sleep
+        self.consume_time    = None
         self.last_msg_failed = False
 
         reporting = self.isReporting()
@@ -101,6 +106,15 @@ class sr_consumer:
         if self.parent.prefetch > 0 :
             self.consumer.add_prefetch(self.parent.prefetch)
 
+        if self.parent.consume_push :
+            self.consumer.add_push()
+
+        if self.parent.ack_batch > 1 :
+            self.consumer.add_ack_batch(self.parent.ack_batch,self.parent.ack_interval)
+
+        if self.parent.prefetch_adaptive :
+            self.consumer.add_prefetch_adaptive(self.parent.prefetch_min,self.parent.prefetch_max,self.parent.nbr_instances)
+
         self.consumer.build()
 
         self.retry_msg = self.retry.message
@@ -128,6 +142,9 @@ class sr_consumer:
 
     def close(self):
         if self.hc :
+           # acknowledge what was processed, before the broker gives it again
+           try   : self.consumer.ack_flush()
+           except: pass
            self.hc.close()
            self.hc = None
         self.retry.close()
@@ -135,7 +152,15 @@ class sr_consumer:
     def consume(self):
 
         # acknowledge last message... we are done with it since asking for a new one
-        if self.raw_msg != None and not self.raw_msg.isRetry : self.consumer.ack(self.raw_msg)
+        # (retry messages do not come from the broker, msg_to_retry saved the others
+        #  in the retry process before they are acknowledged)
+        # (with download_threads, sr_worker acknowledges them, in order, when transferred)
+        if self.raw_msg != None and not self.raw_msg.isRetry and self.auto_ack : self.consumer.ack(self.raw_msg)
+
+        # adaptive prefetch : time spent on the last message
+
+        if self.consumer.adaptive and self.raw_msg != None and not self.raw_msg.isRetry :
+           self.consumer.prefetch_adapt(self.queue_name, time.time() - self.consume_time)
 
         # consume a new one
         self.raw_msg = self.consumer.consume(self.queue_name)
@@ -151,18 +176,47 @@ class sr_consumer:
 
         should_sleep = False
 
-        if   self.raw_msg == None                          : should_sleep = True
-        elif self.raw_msg.isRetry and self.last_msg_failed : should_sleep = True
+        # (a failing destination delays its own retries, see sr_retry backoff)
+
+        if self.raw_msg == None : should_sleep = True
 
         if should_sleep :
            #self.logger.debug("sleeping %f" % self.sleep_now)
-           time.sleep(self.sleep_now)
+
+           # nothing to do : acknowledge pending messages first
+
+           self.consumer.ack_flush()
+
+           # push mode : rather wait for a message from the broker, up to the same time
+
+           if self.consumer.push :
+              self.raw_msg = self.consumer.consume(self.queue_name,self.sleep_now)
+              if self.raw_msg != None : should_sleep = False
+           else :
+              self.idle(self.sleep_now)
+
+        if should_sleep :
            self.sleep_now = self.sleep_now * 2
            if self.sleep_now > self.sleep_max : 
                   self.sleep_now = self.sleep_max
 
         if self.raw_msg == None: return False, self.msg
 
+        self.consume_time = time.time()
+
+        # a v02 post is accepted or rejected on its compact view (sr_notice) :
+        # only an accepted message is fully parsed as a sr_message.
+        # pulses, retransmissions, older versions and malformed notices are parsed
+        # first, as before.
+
+        try :
+                 notice = self.notice.load(self.raw_msg)
+                 early  = notice.version == 'v02' and not notice.isPulse and notice.urlstr != None
+        except : early  = False
+
+        if early :
+           if not self.accept(notice,should_sleep) : return False,self.msg
+
         # make use it as a sr_message
         # dont bother with retry... 
 
@@ -183,6 +237,16 @@ class sr_consumer:
            self.parent.pulse_count += 1
            return True,self.msg
 
+        if not early and not self.accept(self.msg,should_sleep) : return False,self.msg
+
+        # note that it is a retry or not in sr_message
+
+        return True,self.msg
+
+    # count a message and apply accept/reject to it (a sr_notice or sr_message)
+
+    def accept(self,msg,should_sleep):
+
         # we have a message, reset timer (original or retry)
 
         if not should_sleep : self.sleep_now = self.sleep_min 
@@ -196,23 +260,21 @@ class sr_consumer:
         if self.use_pattern :
 
            # Adjust url to account for sundew extension if present, and files do not already include the names.
-           if urllib.parse.urlparse(self.msg.urlstr).path.count(":") < 1 and 'sundew_extension' in self.msg.headers.keys() :
-              urlstr=self.msg.urlstr + ':' + self.msg.headers[ 'sundew_extension' ]
+           if 'sundew_extension' in msg.headers.keys() and urllib.parse.urlparse(msg.urlstr).path.count(":") < 1 :
+              urlstr=msg.urlstr + ':' + msg.headers[ 'sundew_extension' ]
            else:
-              urlstr=self.msg.urlstr
+              urlstr=msg.urlstr
 
            self.logger.debug("sr_consumer, path being matched: %s " % ( urlstr )  ) 
 
-           if not self.parent.isMatchingPattern(self.msg.urlstr,self.accept_unmatch) :
+           if not self.parent.isMatchingPattern(msg.urlstr,self.accept_unmatch) :
               self.logger.debug("Rejected by accept/reject options")
-              return False,self.msg
+              return False
 
         elif not self.accept_unmatch :
-              return False,self.msg
-
-        # note that it is a retry or not in sr_message
+              return False
 
-        return True,self.msg
+        return True
 
     def get_message(self):
         self.logger.debug("sr_consumer get_message")
@@ -227,12 +289,8 @@ class sr_consumer:
     def isAlive(self):
         if not hasattr(self,'consumer') : return False
         if self.consumer.channel == None: return False
-        alarm_set(self.iotime)
-        try   : self.consumer.channel.basic_qos(0,self.consumer.prefetch,False)
-        except: 
-                alarm_cancel()
-                return False
-        alarm_cancel()
+        try   : self.hc.rpc(self.consumer.channel,self.iotime,'basic_qos',0,self.consumer.prefetch,False)
+        except: return False
         return True
 
     def isReporting(self):
@@ -268,6 +326,8 @@ class sr_consumer:
 
         if self.raw_msg == None : return
 
+        self.retry.dest_failed(self.raw_msg)
+
         if self.raw_msg.isRetry : self.retry.add_msg_to_state_file(self.raw_msg)
         else                    : self.retry.add_msg_to_new_file  (self.raw_msg)
 
@@ -278,6 +338,7 @@ class sr_consumer:
 
         if self.raw_msg == None or not self.raw_msg.isRetry : return
 
+        self.retry.dest_worked(self.raw_msg)
         self.retry.add_msg_to_state_file(self.raw_msg,done=True)
 
         self.logger.debug("confirmed removed from the retry process %s" % self.raw_msg.body)
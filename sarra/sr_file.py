@@ -33,7 +33,7 @@
 #
 #
 
-import os, stat, sys, time
+import errno, os, stat, sys, time
 
 try:
     from sr_util import *
@@ -133,6 +133,80 @@ class sr_file():
 
 
 
+# file_copy_range : length bytes of src (from its position) into dst (at its position)
+#
+# the kernel copies (copy_file_range, or sendfile) without the data going through
+# python, unless the checksum needs the data (d, s : not 0, n, N) : then it is read,
+# written and checksummed in bufsize chunks, as are the bytes the kernel did not copy.
+# Returns the bytes copied, less than length if src is shorter.
+
+kernel_copy_max = 0x40000000
+
+def file_copy_range(src, dst, length, bufsize, chk=None):
+
+    copied = 0
+
+    if not sum_needs_data(chk) :
+       dst.flush()
+       src_offset = src.tell()
+       dst_offset = dst.tell()
+
+       copied = file_copy_kernel(src.fileno(), dst.fileno(), src_offset, dst_offset, length)
+
+       src.seek(src_offset + copied)
+       dst.seek(dst_offset + copied)
+
+    if bufsize < 1 : bufsize = 1
+
+    while copied < length :
+          buf = src.read(min(bufsize, length - copied))
+          if not buf : break
+          dst.write(buf)
+          if chk : chk.update(buf)
+          copied += len(buf)
+
+    return copied
+
+# the kernel copy between file descriptors at these offsets, 0 if not supported
+
+def file_copy_kernel(fdin, fdout, src_offset, dst_offset, length):
+
+    unsupported = [ errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF ]
+
+    copied = 0
+
+    if hasattr(os,'copy_file_range') :
+       try :
+               while copied < length :
+                     n = os.copy_file_range(fdin, fdout, min(length-copied,kernel_copy_max), \
+                                            src_offset+copied, dst_offset+copied)
+                     if n == 0 : return copied
+                     copied += n
+               return copied
+       except OSError as e :
+               if copied > 0 or not e.errno in unsupported : raise
+
+    # sendfile writes where fdout is
+
+    if hasattr(os,'sendfile') :
+       try :
+               os.lseek(fdout, dst_offset, os.SEEK_SET)
+               while copied < length :
+                     n = os.sendfile(fdout, fdin, src_offset+copied, min(length-copied,kernel_copy_max))
+                     if n == 0 : break
+                     copied += n
+       except OSError as e :
+               if copied > 0 or not e.errno in unsupported : raise
+
+    return copied
+
+# a checksum computed from the data (needs_data class attribute, True unless
+# the algorithm says otherwise)
+
+def sum_needs_data(chk):
+    if chk == None : return False
+    return getattr(chk,'needs_data',True)
+
 # file_insert
 # called by file_process (general file:// processing)
 
@@ -187,13 +261,7 @@ def file_insert_part(parent,msg,part_file):
              if bufsize > msg.length : bufsize = msg.length
              if chk : chk.set_path(os.path.basename(msg.target_file))
 
-             i  = 0
-             while i < msg.length:
-                   buf = fp.read(bufsize)
-                   if not buf: break
-                   ft.write(buf)
-                   if chk : chk.update(buf)
-                   i  += len(buf)
+             i = file_copy_range(fp, ft, msg.length, bufsize, chk)
 
              if ft.tell() >= msg.filesize:
                  ft.truncate()
@@ -504,22 +572,7 @@ def file_write_length(req,msg,bufsize,filesize,parent):
     fp = open(msg.new_file,'r+b')
     if msg.local_offset != 0 : fp.seek(msg.local_offset,0)
 
-    nc = int(msg.length/bufsize)
-    r  =     msg.length%bufsize
-
-    # read/write bufsize "nc" times
-    i  = 0
-    while i < nc :
-          chunk = req.read(bufsize)
-          fp.write(chunk)
-          if chk : chk.update(chunk)
-          i = i + 1
-
-    # remaining
-    if r > 0 :
-       chunk = req.read(r)
-       fp.write(chunk)
-       if chk : chk.update(chunk)
+    file_copy_range(req, fp, msg.length, bufsize, chk)
 
     if fp.tell() >= msg.filesize:
        fp.truncate()
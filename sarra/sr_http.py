@@ -33,13 +33,158 @@
 #
 #
 
-import os, urllib.request, urllib.error, ssl, sys
+import base64, http.client, os, urllib.request, urllib.error, ssl, sys, threading
 
 try :
          from sr_util            import *
 except :
          from sarra.sr_util      import *
 
+#============================================================
+# sr_http_pool : keep-alive connections per (scheme, host, port)
+#
+# A connection whose answer was read to its end, and that the server
+# keeps open, goes back in the pool for the next get or ls of any sr_http
+# of the process (download threads included).  A connection the server
+# closed while idle is replaced, and the request sent again.  https
+# connections are kept apart whether certificates are verified or not
+# (verified with credentials, as before).
+#
+# Proxies are the ones urllib would use (http_proxy, https_proxy, no_proxy
+# in the environment) : http requests sent to the proxy with the full url,
+# https ones through a tunnel (CONNECT) the connection keeps.  Credentials
+# in the proxy url are sent as Proxy-Authorization.
+#
+# stats() : connections opened, requests on a reused connection, requests
+# sent again, connections idle (see plugin hb_http_pool).
+#============================================================
+
+class sr_http_pool():
+
+    def __init__(self, idle_max=8):
+        self.idle_max    = idle_max
+        self.idle        = {}
+        self.contexts    = {}
+        self.lock        = threading.Lock()
+
+        self.proxy_env   = None
+        self.proxies     = {}
+        self.bypass      = {}
+
+        self.connections = 0
+        self.reused      = 0
+        self.retries     = 0
+
+    # clear : idle connections closed
+    def clear(self):
+        with self.lock :
+             idle      = self.idle
+             self.idle = {}
+
+        for conns in idle.values() :
+            for conn in conns : conn.close()
+
+    # context : ssl context, certificates verified or not, made once
+    def context(self, verify):
+        with self.lock :
+             if not verify in self.contexts :
+                ctx = ssl.create_default_context()
+                if not verify :
+                   ctx.check_hostname = False
+                   ctx.verify_mode    = ssl.CERT_NONE
+                self.contexts[verify] = ctx
+             return self.contexts[verify]
+
+    # get : an idle connection for key (most recently used first) or a new one, reused or not
+    def get(self, key, timeout):
+        with self.lock :
+             conns = self.idle.get(key)
+             while conns :
+                   conn = conns.pop()
+                   if conn.sock == None : continue
+                   conn.sock.settimeout(timeout)
+                   self.reused += 1
+                   return conn, True
+             self.connections += 1
+
+        scheme, host, port, verify, proxy = key
+
+        if proxy != None :
+           purl  = urllib.parse.urlparse(proxy)
+           pport = purl.port
+           if pport == None : pport = 443 if purl.scheme == 'https' else 80
+
+        if proxy != None and scheme == 'https' :
+           conn = http.client.HTTPSConnection(purl.hostname, pport, timeout=timeout, context=self.context(verify))
+           auth = self.proxy_authorization(proxy)
+           conn.set_tunnel(host, port, headers={ 'Proxy-Authorization' : auth } if auth else None)
+        elif proxy != None :
+           conn = http.client.HTTPConnection(purl.hostname, pport, timeout=timeout)
+        elif scheme == 'https' :
+           conn = http.client.HTTPSConnection(host, port, timeout=timeout, context=self.context(verify))
+        else :
+           conn = http.client.HTTPConnection(host, port, timeout=timeout)
+
+        return conn, False
+
+    # proxy : the proxy url for scheme and host (environment, as urllib), None if none or bypassed
+    # (getproxies costs as much as a small request : read again when the proxy variables change)
+    def proxy(self, scheme, host):
+        env = tuple([ os.environ.get(name) for name in proxy_variables ])
+
+        with self.lock :
+             if env != self.proxy_env :
+                self.proxy_env = env
+                self.proxies   = urllib.request.getproxies()
+                self.bypass    = {}
+             proxy = self.proxies.get(scheme)
+
+        if not proxy : return None
+
+        bypass = self.bypass.get(host)
+        if bypass == None :
+           bypass = bool(urllib.request.proxy_bypass(host))
+           self.bypass[host] = bypass
+
+        if bypass : return None
+
+        if not '://' in proxy : proxy = 'http://' + proxy
+
+        return proxy
+
+    # proxy_authorization : Proxy-Authorization header value from the proxy url user, None without
+    def proxy_authorization(self, proxy):
+        purl = urllib.parse.urlparse(proxy)
+
+        if purl.username == None : return None
+
+        auth = '%s:%s' % (urllib.parse.unquote(purl.username), urllib.parse.unquote(purl.password or ''))
+
+        return 'Basic ' + base64.b64encode(auth.encode('utf-8')).decode('ascii')
+
+    # put : conn back in the pool if its response was read to its end, closed otherwise
+    def put(self, key, conn, response):
+
+        if response != None and response.isclosed() and not response.will_close and conn.sock != None :
+           with self.lock :
+                conns = self.idle.setdefault(key, [])
+                if len(conns) < self.idle_max :
+                   conns.append(conn)
+                   return
+
+        conn.close()
+
+    # stats
+    def stats(self):
+        with self.lock :
+             idle = sum(map(len, self.idle.values()))
+             return { 'connections' : self.connections, 'reused' : self.reused, \
+                      'retries' : self.retries, 'idle' : idle }
+
+proxy_variables = [ 'http_proxy', 'https_proxy', 'no_proxy', 'HTTP_PROXY', 'HTTPS_PROXY', 'NO_PROXY' ]
+
+http_pool = sr_http_pool()
+
 #============================================================
 # http protocol in sarracenia supports/uses :
 #
@@ -68,7 +213,7 @@ class sr_http(sr_proto):
         self.cwd  = os.path.dirname(path)
         self.path = path
 
-    # for compatibility... always new connection with http
+    # for compatibility... connections are taken from the pool (sr_http_pool) for each request
     def check_is_connected(self):
         self.logger.debug("sr_http check_is_connected")
 
@@ -81,6 +226,7 @@ class sr_http(sr_proto):
     # close
     def close(self):
         self.logger.debug("sr_http close")
+        self.release()
         self.init()
 
     # connect...
@@ -135,7 +281,8 @@ class sr_http(sr_proto):
 
         # read from self.http write to local_file
 
-        rw_length = self.read_writelocal(remote_file, self.http, local_file, local_offset, length)
+        try    : rw_length = self.read_writelocal(remote_file, self.http, local_file, local_offset, length)
+        finally: self.release()
 
         return True
 
@@ -145,6 +292,8 @@ class sr_http(sr_proto):
         self.logger.debug("sr_http init")
         self.connected   = False
         self.http        = None
+        self.http_conn   = None
+        self.http_key    = None
         self.details     = None
         self.seek        = True
 
@@ -174,13 +323,13 @@ class sr_http(sr_proto):
         try :
                  dbuf = None
                  while  True:
-                        alarm_set(self.iotime)
                         chunk = self.http.read(self.bufsize)
-                        alarm_cancel()
                         if not chunk: break
                         if dbuf : dbuf += chunk
                         else    : dbuf  = chunk
 
+                 self.release()
+
                  self.data = dbuf.decode('utf-8')
 
                  # invoke parent defined on_html_page ... if any
@@ -194,6 +343,7 @@ class sr_http(sr_proto):
                 (stype, svalue, tb) = sys.exc_info()
                 self.logger.warning("Unable to open %s" % self.urlstr)
                 self.logger.warning("sr_http/ls (Type: %s, Value: %s)" % (stype ,svalue))
+                self.release()
 
         return self.entries
 
@@ -201,6 +351,8 @@ class sr_http(sr_proto):
     def __open__(self, path, remote_offset=0, length=0):
         self.logger.debug( "sr_http open")
 
+        self.release()
+
         self.http      = None
         self.connected = False
         self.req       = None
@@ -213,71 +365,130 @@ class sr_http(sr_proto):
         if path.startswith('https://') and '//' in path[8:] :
            self.urlstr = 'https://' + path[8:].replace('//','/')
 
-        alarm_set(self.iotime)
+        # io timeout : the socket's (connection and every read), iotime seconds
 
         try:
-                # when credentials are needed.
-                if self.user != None :                          
-                   password_mgr = urllib.request.HTTPPasswordMgrWithDefaultRealm()
-                   password_mgr.add_password(None, self.urlstr,self.user,self.password)
-                   handler = urllib.request.HTTPBasicAuthHandler(password_mgr)
-            
-                   # create "opener" (OpenerDirector instance)
-                   opener = urllib.request.build_opener(handler)
-
-                   # use the opener to fetch a URL
-                   opener.open(self.urlstr)
-
-                   # Install the opener.
-                   urllib.request.install_opener(opener)
-
-                # Now all calls to get the request use our opener.
-                self.req = urllib.request.Request(self.urlstr)
+                headers = { 'User-Agent' : 'sarracenia' }
 
                 # set range in byte if needed
                 if remote_offset != 0 :
-                   str_range = 'bytes=%d-%d'%(remote_offset,remote_offset + length-1)
-                   self.req.headers['Range'] = str_range
+                   headers['Range'] = 'bytes=%d-%d'%(remote_offset,remote_offset + length-1)
 
-                # https without user : create/use an ssl context
-                ctx = None
-                if self.user == None and self.urlstr.startswith('https'):
-                   ctx = ssl.create_default_context()
-                   ctx.check_hostname = False
-                   ctx.verify_mode = ssl.CERT_NONE
+                # credentials sent with the request (basic authentication)
+                if self.user != None :
+                   auth = '%s:%s' % (self.user, self.password if self.password != None else '')
+                   headers['Authorization'] = 'Basic ' + base64.b64encode(auth.encode('utf-8')).decode('ascii')
 
                 # open... we are connected
-                if self.timeout == None :
-                   self.http = urllib.request.urlopen(self.req, context=ctx)
-                else :
-                   self.http = urllib.request.urlopen(self.req, timeout=self.timeout, context=ctx)
+                self.http = self.request(self.urlstr, headers)
 
                 self.connected = True
 
-                alarm_cancel()
-
                 return True
 
         except urllib.error.HTTPError as e:
                self.logger.error('Download failed %s ' % self.urlstr)
                self.logger.error('Server couldn\'t fulfill the request. Error code: %s, %s' % (e.code, e.reason))
-               alarm_cancel()
                raise
         except urllib.error.URLError as e:
                self.logger.error('Download failed %s ' % self.urlstr)
                self.logger.error('Failed to reach server. Reason: %s' % e.reason)
-               alarm_cancel()
                raise
         except:
                (stype, svalue, tb) = sys.exc_info()
                self.logger.warning("sr_http/__open__ (Type: %s, Value: %s)" % (stype ,svalue))
                self.logger.warning("Unable to open %s" % self.urlstr)
-               alarm_cancel()
                raise
 
-        alarm_cancel()
         return False
 
+    # release : the connection back in the pool (closed if the answer was not read to its end)
+    def release(self):
+
+        if self.http_conn != None :
+           http_pool.put(self.http_key, self.http_conn, self.http)
+
+        self.http_conn = None
+        self.http_key  = None
+
+    # request : GET urlstr on a pooled connection, redirections followed, the response
+    def request(self, urlstr, headers):
+
+        redirects = 0
+        origin    = None
+
+        while True :
+              url    = urllib.parse.urlparse(urlstr)
+              scheme = url.scheme.lower()
+              port   = url.port
+              if port == None : port = 443 if scheme == 'https' else 80
+
+              # https without user : certificates not verified
+
+              proxy  = http_pool.proxy(scheme, url.hostname)
+              key    = (scheme, url.hostname, port, scheme == 'https' and self.user != None, proxy)
+
+              # credentials only for where they were given
+
+              if origin == None : origin = key
+              if key[:3] != origin[:3] and 'Authorization' in headers :
+                 headers = dict(headers)
+                 del headers['Authorization']
+
+              path = urllib.parse.quote(url.path, safe="/%:@!$&'()*+,;=~")
+              if path == ''  : path  = '/'
+              if url.query   : path += '?' + url.query
+
+              # http through a proxy : the full url, proxy credentials with the request
+
+              send_headers = headers
+
+              if proxy != None and scheme == 'http' :
+                 host = url.hostname
+                 if ':' in host : host = '[%s]' % host
+                 path = 'http://%s:%d%s' % (host, port, path)
+                 auth = http_pool.proxy_authorization(proxy)
+                 if auth :
+                    send_headers = dict(headers)
+                    send_headers['Proxy-Authorization'] = auth
+
+              conn, response = self.send(key, path, send_headers)
+
+              if response.status in [ 301, 302, 303, 307, 308 ] and redirects < 5 and response.getheader('Location') :
+                 response.read()
+                 http_pool.put(key, conn, response)
+                 redirects += 1
+                 urlstr     = urllib.parse.urljoin(urlstr, response.getheader('Location'))
+                 self.logger.debug("sr_http redirected to %s" % urlstr)
+                 continue
+
+              if response.status >= 300 :
+                 response.read()
+                 http_pool.put(key, conn, response)
+                 raise urllib.error.HTTPError(urlstr, response.status, response.reason, response.headers, None)
+
+              self.http_key  = key
+              self.http_conn = conn
+
+              return response
+
+    # send : the request on a pooled connection, sent again if the server closed it while idle
+    def send(self, key, path, headers):
+
+        while True :
+              conn, reused = http_pool.get(key, self.iotime)
+              try :
+                      conn.request('GET', path, headers=headers)
+                      return conn, conn.getresponse()
+              except (ConnectionError, http.client.BadStatusLine) :
+                      conn.close()
+                      if not reused : raise
+                      self.logger.debug("sr_http idle connection closed by server, request sent again")
+                      with http_pool.lock : http_pool.retries += 1
+              except :
+                      conn.close()
+                      raise
+
 #============================================================
 #
 # http_transport inherited from sr_transport
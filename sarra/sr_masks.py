@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+#
+# This file is part of sarracenia.
+# The sarracenia suite is Free and is proudly provided by the Government of Canada
+# Copyright (C) Her Majesty The Queen in Right of Canada, Environment Canada, 2008-2015
+#
+# Questions or bugs report: dps-client@ec.gc.ca
+# sarracenia repository: git://git.code.sf.net/p/metpx/git
+# Documentation: http://metpx.sourceforge.net/#SarraDocumentation
+#
+# sr_masks.py : accept/reject masks compiled for sr_config.isMatchingPattern
+#
+#  isMatchingPattern tries the masks in order, the first one matching
+#  decides.  sr_masks gives the same answer without trying them all :
+#
+#  literal prefilter : most masks contain a string any url they match
+#     contains (.*/SACN4[0-9]_CWAO.* : '/SACN4').  Masks are indexed by the
+#     start of that string (key) : the substrings of a url give the masks
+#     that may match it, only those (and the masks without key) are tried,
+#     in order.
+#
+#  alternation : when too many masks have no key, consecutive masks are
+#     joined as (mask0)|(mask1)|...  The regexp engine tries alternatives
+#     in order : the first mask matching is the one whose group closes last
+#     (lastindex), mapped back to the mask.  A mask that cannot be joined
+#     (back references, named groups, conditionals, inline flags) is
+#     matched alone, in its place.
+#
+#  cache (mask_cache option) : the mask found for a url is kept, least
+#     recently used evicted.  When every mask ends with a directory
+#     (.*/radar/.*) the file name cannot change the outcome : the cache
+#     is keyed on the directory of the url, so a feed sending many files
+#     to a few directories hits it.
+#
+########################################################################
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307  USA
+#
+#
+
+import collections,re
+
+# what prevents a mask from being a group among others
+
+not_joinable = re.compile(r'\\[0-9]|\(\?P=|\(\?\(|\(\?[aiLmsux]')
+
+# longest string of characters present in whatever pattern matches
+# (top level characters only, not repeated 0 times, not in a group or a set)
+
+def required_literal(pattern):
+
+    if not_joinable.search(pattern) : return ''
+
+    best  = ''
+    run   = ''
+    depth = 0
+    i     = 0
+    n     = len(pattern)
+
+    while i < n :
+          c   = pattern[i]
+          lit = None
+          i  += 1
+
+          if   c == '\\' :
+               if i < n and pattern[i] in 'xuUN01234567' : return ''
+               if i < n and not pattern[i].isalnum() and depth == 0 : lit = pattern[i]
+               i += 1
+          elif c == '[' :
+               if pattern[i:i+1] == '^' : i += 1
+               if pattern[i:i+1] == ']' : i += 1
+               while i < n and pattern[i] != ']' :
+                     if pattern[i] == '\\' : i += 1
+                     i += 1
+               i += 1
+          elif c == '(' : depth += 1
+          elif c == ')' : depth -= 1
+          elif c == '|' :
+               if depth == 0 : return ''
+          elif depth == 0 and not c in '.^$*+?{}' : lit = c
+
+          q = pattern[i:i+1]
+          if lit != None and q in [ '*', '?', '{' ] : lit = None
+
+          if lit == None :
+             run = ''
+             continue
+
+          run += lit
+          if len(run) > len(best) : best = run
+          if q == '+' : run = ''
+
+    return best
+
+# a mask matching a url (or not) whatever its file name : it matches
+# anything, or ends with a / at top level (anything after is optional for
+# a match at the start of the url), without looking ahead or alternatives
+
+def directory_only(pattern):
+
+    if pattern in [ '', '.*' ] : return True
+
+    if pattern.endswith('/.*') : pattern = pattern[:-2]
+
+    if not pattern.endswith('/') or '|' in pattern or '(?' in pattern : return False
+
+    return True
+
+class sr_masks():
+
+    def __init__(self, masks, chunk=256, keylen=8, cache=0 ):
+
+        # masks as in sr_config : (pattern, maskDir, maskFileOption, mask_regexp, accepting, ...)
+
+        self.masks    = masks
+        self.count    = len(masks)
+        self.chunk    = chunk
+
+        # cache : key (url or directory) -> mask index, least recently used first
+
+        self.cache_size     = cache
+        self.cache          = collections.OrderedDict()
+        self.hits           = 0
+        self.misses         = 0
+        self.evicted        = 0
+        self.directory_only = len(masks) > 0
+
+        for mask in masks :
+            if not directory_only(mask[3].pattern) :
+               self.directory_only = False
+               break
+
+        # literal prefilter : keyed[key] = mask indices, keys of lengths
+        # always : indices of masks without a key
+
+        self.keyed    = {}
+        self.lengths  = []
+        self.always   = []
+
+        for i,mask in enumerate(masks):
+            key = required_literal(mask[3].pattern)[:keylen]
+            if len(key) < 3 :
+               self.always.append(i)
+               continue
+            if not key in self.keyed : self.keyed[key] = []
+            self.keyed[key].append(i)
+            if not len(key) in self.lengths : self.lengths.append(len(key))
+
+        self.prefilter = len(self.keyed) > 0 and len(self.always) <= self.count // 4
+        if self.prefilter : return
+
+        # segments : (regexp, groups, index)
+        #   joined masks : groups[lastindex] is the mask index
+        #   single mask  : groups is None, index is the mask index
+
+        self.segments = []
+
+        joined = []
+        for i,mask in enumerate(masks):
+            regexp = mask[3]
+            if regexp.groupindex or not_joinable.search(regexp.pattern) :
+               self.join(joined)
+               joined = []
+               self.segments.append( (regexp,None,i) )
+               continue
+            joined.append(i)
+            if len(joined) >= self.chunk :
+               self.join(joined)
+               joined = []
+
+        self.join(joined)
+
+    def join(self,joined):
+
+        if len(joined) == 0 : return
+
+        if len(joined) == 1 :
+           i = joined[0]
+           self.segments.append( (self.masks[i][3],None,i) )
+           return
+
+        groups   = [ None ]
+        patterns = []
+        for i in joined :
+            regexp = self.masks[i][3]
+            patterns.append( '(' + regexp.pattern + ')' )
+            groups.append(i)
+            groups.extend( [ i ] * regexp.groups )
+
+        try :
+                regexp = re.compile( '|'.join(patterns) )
+        except :
+                for i in joined : self.segments.append( (self.masks[i][3],None,i) )
+                return
+
+        self.segments.append( (regexp,groups,joined[0]) )
+
+    # index of the first mask matching chaine, -1 if none
+
+    def match(self, chaine):
+
+        if self.prefilter :
+           found = []
+           for n in self.lengths :
+               for j in range(len(chaine)-n+1) :
+                   f = self.keyed.get(chaine[j:j+n])
+                   if f : found.extend(f)
+
+           candidates = self.always
+           if found : candidates = sorted(set(found).union(self.always))
+
+           for i in candidates :
+               if self.masks[i][3].match(chaine) : return i
+
+           return -1
+
+        for regexp, groups, index in self.segments :
+            m = regexp.match(chaine)
+            if m == None   : continue
+            if groups == None : return index
+            return groups[m.lastindex]
+
+        return -1
+
+    # match, through the cache when there is one
+
+    def lookup(self, chaine):
+
+        if self.cache_size <= 0 : return self.match(chaine)
+
+        key = chaine
+        if self.directory_only :
+           j = chaine.rfind('/')
+           if j >= 0 : key = chaine[:j+1]
+
+        i = self.cache.get(key)
+        if i != None :
+           self.hits += 1
+           self.cache.move_to_end(key)
+           return i
+
+        self.misses += 1
+
+        i = self.match(key)
+        self.cache[key] = i
+
+        if len(self.cache) > self.cache_size :
+           self.cache.popitem(last=False)
+           self.evicted += 1
+
+        return i
+
+    # the masks changed since compiled (sr_config options, plugins)
+
+    def stale(self, masks, cache=0):
+        return masks is not self.masks or len(masks) != self.count or cache != self.cache_size
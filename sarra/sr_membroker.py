@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+#
+# This file is part of sarracenia.
+# The sarracenia suite is Free and is proudly provided by the Government of Canada
+# Copyright (C) Her Majesty The Queen in Right of Canada, Environment Canada, 2008-2015
+#
+# Questions or bugs report: dps-client@ec.gc.ca
+# sarracenia repository: git://git.code.sf.net/p/metpx/git
+# Documentation: http://metpx.sourceforge.net/#SarraDocumentation
+#
+# sr_membroker.py : an in process AMQP broker stand-in
+#
+#  Used by sr_amqp.HostConnect for broker urls with the mem scheme
+#  (ex.: mem://bench/) to run components, benchmarks and unit tests
+#  without a RabbitMQ.  It offers the part of the amqplib (client_0_8)
+#  interface that sr_amqp uses : topic exchanges, queues, bindings,
+#  basic_get/consume/ack/publish, qos and transactions.
+#
+#  Differences with a real broker :
+#    - the broker lives in the process : only its threads share it
+#    - exchanges exist as soon as something is bound or published to them
+#    - permissions, durability, queue expiry are not implemented
+#
+########################################################################
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307  USA
+#
+#
+
+import collections, re, threading, time
+
+# all brokers of the process, by (host,vhost)
+
+brokers = {}
+brokers_lock = threading.Lock()
+
+def get_broker(host,vhost='/'):
+    with brokers_lock :
+         key = (host,vhost)
+         if not key in brokers : brokers[key] = Broker(host,vhost)
+         return brokers[key]
+
+def reset():
+    with brokers_lock :
+         brokers.clear()
+
+def copy_properties(properties):
+
+    # the message is kept as sent : its headers dict may be changed afterward
+
+    properties = dict(properties)
+    properties['application_headers'] = dict(properties.get('application_headers') or {})
+    return properties
+
+def topic_regexp(key):
+
+    # AMQP topic : words separated by '.',  * matches one word, # zero or more
+    # (consecutive # match what one does : merged)
+
+    words = []
+    for word in key.split('.') :
+        if   word == '#' and words and words[-1] == None : continue
+        if   word == '*' : words.append(r'[^.]*')
+        elif word == '#' : words.append(None)
+        else             : words.append(re.escape(word))
+
+    regexp = ''
+    for i,word in enumerate(words) :
+        if word == None :
+           if   len(words) == 1   : regexp += r'.*'
+           elif i == 0            : regexp += r'(.*\.)?'
+           else                   : regexp  = regexp[:-2] + r'(\..*)?\.'
+           continue
+        regexp += word + r'\.'
+
+    if regexp.endswith(r'\.') : regexp = regexp[:-2]
+
+    return re.compile( '^' + regexp + '$' )
+
+# ==========
+# Message : as amqplib's
+# ==========
+
+class Message:
+
+   def __init__(self, body='', **properties):
+       self.body          = body
+       self.properties    = properties
+       self.delivery_info = {}
+       self.delivery_tag  = None
+
+       if not 'application_headers' in self.properties :
+          self.properties['application_headers'] = {}
+
+# ==========
+# Broker : exchanges and queues of one vhost
+# ==========
+
+class Broker:
+
+   def __init__(self,host,vhost):
+       self.host      = host
+       self.vhost     = vhost
+       self.lock      = threading.Condition()
+       self.exchanges = {}
+       self.queues    = {}
+       self.count     = 0
+
+   def exchange(self,name):
+       if not name in self.exchanges : self.exchanges[name] = Exchange(name)
+       return self.exchanges[name]
+
+   def publish(self,exchange_name,routing_key,msg):
+       if exchange_name == '' :
+          queues = [ self.queues[routing_key] ] if routing_key in self.queues else []
+       else :
+          queues = self.exchange(exchange_name).route(routing_key)
+
+       if not queues : return
+
+       properties = copy_properties(msg.properties)
+       ttl        = properties.get('expiration',None)
+       for queue in queues :
+           queue.put(exchange_name,routing_key,msg.body,properties,ttl)
+
+       self.lock.notify_all()
+
+# ==========
+# Exchange : topic
+# ==========
+
+class Exchange:
+
+   def __init__(self,name):
+       self.name     = name
+       self.bindings = collections.OrderedDict()
+
+   def bind(self,queue,key):
+       self.bindings[(queue.name,key)] = (topic_regexp(key),queue)
+
+   def route(self,routing_key):
+       queues = []
+       for regexp,queue in self.bindings.values() :
+           if queue in queues : continue
+           if regexp.match(routing_key) : queues.append(queue)
+       return queues
+
+   def unbind(self,queue_name,key):
+       self.bindings.pop((queue_name,key),None)
+
+   def unbind_queue(self,queue_name):
+       for k in [ k for k in self.bindings if k[0] == queue_name ] :
+           del self.bindings[k]
+
+# ==========
+# Queue
+# ==========
+
+class Queue:
+
+   def __init__(self,name,arguments):
+       self.name      = name
+       self.messages  = collections.deque()
+       self.consumers = collections.OrderedDict()
+       self.ttl       = None
+
+       if arguments and 'x-message-ttl' in arguments :
+          self.ttl = int(arguments['x-message-ttl'])
+
+   def get(self):
+
+       # messages expired (queue x-message-ttl or message expiration) are dropped
+
+       now = time.time()
+       while self.messages :
+             item = self.messages.popleft()
+             if item[4] == None or item[4] > now : return item
+       return None
+
+   def put(self,exchange_name,routing_key,body,properties,ttl):
+       expire = None
+       if ttl       != None : expire = time.time() + int(ttl)/1000.0
+       if self.ttl  != None :
+          qexpire = time.time() + self.ttl/1000.0
+          if expire == None or qexpire < expire : expire = qexpire
+
+       self.messages.append( (exchange_name,routing_key,body,properties,expire,False) )
+       self.dispatch()
+
+   def requeue(self,items):
+       for item in reversed(items) :
+           self.messages.appendleft( item[0:5] + (True,) )
+       self.dispatch()
+
+   def dispatch(self):
+
+       # push to consumers, in turn, within their prefetch
+
+       while self.messages and self.consumers :
+             pushed = False
+             for tag,channel in list(self.consumers.items()) :
+                 if not channel.can_push() : continue
+                 item = self.get()
+                 if item == None : return
+                 channel.push(self,tag,item)
+                 pushed = True
+                 # round robin
+                 self.consumers.move_to_end(tag)
+                 break
+             if not pushed : return
+
+# ==========
+# Connection : as amqplib's
+# ==========
+
+class Connection:
+
+   def __init__(self, host='localhost', userid=None, password=None, virtual_host='/', ssl=False, **kwargs):
+       self.broker   = get_broker(host,virtual_host)
+       self.channels = []
+       self.next_id  = 1
+
+   def channel(self):
+       channel = Channel(self,self.next_id)
+       self.next_id += 1
+       self.channels.append(channel)
+       return channel
+
+   def close(self):
+       for channel in list(self.channels) :
+           channel.close()
+
+# ==========
+# Channel : as amqplib's
+# ==========
+
+class Channel:
+
+   def __init__(self,connection,channel_id):
+       self.connection   = connection
+       self.broker       = connection.broker
+       self.lock         = self.broker.lock
+       self.channel_id   = channel_id
+       self.is_open      = True
+
+       self.prefetch     = 0
+       self.last_tag     = 0
+       self.unacked      = collections.OrderedDict()
+
+       self.consumers    = {}
+       self.inbox        = collections.deque()
+
+       self.tx           = False
+       self.tx_messages  = []
+
+   def check(self):
+       if not self.is_open : raise Exception("channel %d is closed" % self.channel_id)
+
+   # =========
+   # exchanges, queues, bindings
+   # =========
+
+   def exchange_declare(self, exchange, type='topic', passive=False, durable=True, auto_delete=False, **kwargs):
+       self.check()
+       with self.lock :
+            self.broker.exchange(exchange)
+
+   def exchange_delete(self, exchange, **kwargs):
+       self.check()
+       with self.lock :
+            self.broker.exchanges.pop(exchange,None)
+
+   def queue_declare(self, queue='', passive=False, durable=False, exclusive=False, auto_delete=True, nowait=False, arguments=None, **kwargs):
+       self.check()
+       with self.lock :
+            if queue == '' :
+               self.broker.count += 1
+               queue = 'amq.gen-%d' % self.broker.count
+            if not queue in self.broker.queues :
+               if passive : raise Exception("NOT_FOUND - no queue '%s'" % queue)
+               self.broker.queues[queue] = Queue(queue,arguments)
+            q = self.broker.queues[queue]
+            return queue, len(q.messages), len(q.consumers)
+
+   def queue_bind(self, queue, exchange, routing_key='', **kwargs):
+       self.check()
+       with self.lock :
+            if not queue in self.broker.queues : raise Exception("NOT_FOUND - no queue '%s'" % queue)
+            self.broker.exchange(exchange).bind(self.broker.queues[queue],routing_key)
+
+   def queue_unbind(self, queue, exchange, routing_key='', **kwargs):
+       self.check()
+       with self.lock :
+            if exchange in self.broker.exchanges :
+               self.broker.exchanges[exchange].unbind(queue,routing_key)
+
+   def queue_delete(self, queue='', **kwargs):
+       self.check()
+       with self.lock :
+            if not queue in self.broker.queues : raise Exception("NOT_FOUND - no queue '%s'" % queue)
+            q = self.broker.queues.pop(queue)
+            for exchange in self.broker.exchanges.values() :
+                exchange.unbind_queue(queue)
+            return len(q.messages)
+
+   # =========
+   # consuming
+   # =========
+
+   def basic_qos(self, prefetch_size, prefetch_count, a_global):
+       self.check()
+       with self.lock :
+            self.prefetch = prefetch_count
+            # room for more deliveries
+            for q, callback in list(self.consumers.values()) : q.dispatch()
+
+   def basic_get(self, queue='', no_ack=False):
+       self.check()
+       with self.lock :
+            if not queue in self.broker.queues : raise Exception("NOT_FOUND - no queue '%s'" % queue)
+            q    = self.broker.queues[queue]
+            item = q.get()
+            if item == None : return None
+            return self.deliver(q,item)
+
+   def basic_consume(self, queue='', consumer_tag='', no_local=False, no_ack=False, exclusive=False, nowait=False, callback=None, **kwargs):
+       self.check()
+       with self.lock :
+            if not queue in self.broker.queues : raise Exception("NOT_FOUND - no queue '%s'" % queue)
+            if consumer_tag == '' :
+               self.broker.count += 1
+               consumer_tag = 'amq.ctag-%d' % self.broker.count
+            q = self.broker.queues[queue]
+            self.consumers[consumer_tag] = (q,callback)
+            q.consumers[consumer_tag]    = self
+            q.dispatch()
+            return consumer_tag
+
+   def basic_cancel(self, consumer_tag, nowait=False):
+       with self.lock :
+            if not consumer_tag in self.consumers : return
+            q, callback = self.consumers.pop(consumer_tag)
+            q.consumers.pop(consumer_tag,None)
+
+   def can_push(self):
+       return self.prefetch <= 0 or len(self.unacked) < self.prefetch
+
+   def push(self,q,tag,item):
+       self.inbox.append( (tag,self.deliver(q,item)) )
+
+   def deliver(self,q,item):
+       exchange_name, routing_key, body, properties, expire, redelivered = item
+
+       self.last_tag += 1
+       self.unacked[self.last_tag] = (q,item)
+
+       msg = Message(body, **copy_properties(properties))
+       msg.delivery_tag  = self.last_tag
+       msg.delivery_info = { 'exchange'     : exchange_name,
+                             'routing_key'  : routing_key,
+                             'delivery_tag' : self.last_tag,
+                             'redelivered'  : redelivered }
+       return msg
+
+   def wait(self, timeout=None):
+
+       # call the consumer callback for the deliveries pushed to this channel
+       # (waiting up to timeout seconds for one)
+
+       self.check()
+       with self.lock :
+            if not self.inbox and timeout != 0 :
+               self.lock.wait_for(lambda: len(self.inbox) > 0 or not self.is_open, timeout)
+            deliveries = list(self.inbox)
+            self.inbox.clear()
+
+       for tag,msg in deliveries :
+           if tag in self.consumers :
+              q, callback = self.consumers[tag]
+              if callback : callback(msg)
+
+   def basic_ack(self, delivery_tag, multiple=False):
+       self.check()
+       with self.lock :
+            if multiple :
+               tags = [ t for t in self.unacked if t <= delivery_tag ]
+            else :
+               tags = [ delivery_tag ] if delivery_tag in self.unacked else []
+
+            queues = set()
+            for t in tags :
+                q, item = self.unacked.pop(t)
+                queues.add(q)
+
+            # room for more deliveries
+            for q in queues : q.dispatch()
+
+   def basic_recover(self, requeue=True):
+       self.check()
+       with self.lock :
+            self.requeue_unacked()
+
+   def requeue_unacked(self):
+
+       # messages pushed but not yet seen by the consumer are not acknowledged either
+
+       self.inbox.clear()
+
+       byqueue = collections.OrderedDict()
+       for q, item in self.unacked.values() :
+           byqueue.setdefault(q,[]).append(item)
+       self.unacked.clear()
+
+       for q, items in byqueue.items() :
+           if q.name in self.broker.queues : q.requeue(items)
+
+   def basic_reject(self, delivery_tag, requeue=True):
+       self.check()
+       with self.lock :
+            if not delivery_tag in self.unacked : return
+            q, item = self.unacked.pop(delivery_tag)
+            if requeue : q.requeue([item])
+
+   # =========
+   # publishing
+   # =========
+
+   def basic_publish(self, msg, exchange='', routing_key='', mandatory=False, immediate=False):
+       self.check()
+       if self.tx :
+          self.tx_messages.append( (exchange,routing_key,msg) )
+          return
+       with self.lock :
+            self.broker.publish(exchange,routing_key,msg)
+
+   def tx_select(self):
+       self.check()
+       self.tx = True
+
+   def tx_commit(self):
+       self.check()
+       with self.lock :
+            for exchange, routing_key, msg in self.tx_messages :
+                self.broker.publish(exchange,routing_key,msg)
+       self.tx_messages = []
+
+   def tx_rollback(self):
+       self.check()
+       self.tx_messages = []
+
+   # =========
+   # closing : what was not acknowledged goes back to its queue
+   # =========
+
+   def close(self):
+       if not self.is_open : return
+
+       with self.lock :
+            self.is_open     = False
+            self.tx_messages = []
+
+            for tag in list(self.consumers) :
+                q, callback = self.consumers.pop(tag)
+                q.consumers.pop(tag,None)
+
+            self.requeue_unacked()
+            self.lock.notify_all()
+
+       if self in self.connection.channels : self.connection.channels.remove(self)
@@ -82,6 +82,12 @@ class sr_message():
         self.isPulse       = False
         self.isRetry       = False
 
+        # publish_start/publish_end : messages kept and published together
+
+        self.publish_depth = 0
+        self.publish_list  = []
+        self.publish_max   = 1000
+
         # important working attributes set to None at startup
         
         self.baseurl       = None
@@ -371,6 +377,8 @@ class sr_message():
         if self.pub_exchange != None : self.exchange = self.pub_exchange
 
         for h in self.headers:
+           # an utf8 character is at most 4 bytes : short values need no encoding
+           if len(self.headers[h]) < amqp_ss_maxlen // 4 : continue
            if len(self.headers[h].encode("utf8")) >= amqp_ss_maxlen:
 
                 # strings in utf, and if names have special characters, the length
@@ -408,7 +416,12 @@ class sr_message():
         else:
            suffix=""
 
-        if self.publisher != None :
+        if self.publisher != None and self.publish_depth > 0 :
+           self.publish_list.append( (self.exchange+suffix,self.topic,self.notice,self.headers.copy(),self.message_ttl) )
+           ok = True
+           if len(self.publish_list) >= self.publish_max : ok = self.publish_many()
+
+        elif self.publisher != None :
            ok = self.publisher.publish(self.exchange+suffix,self.topic,self.notice,self.headers,self.message_ttl)
 
         self.set_hdrstr()
@@ -426,6 +439,26 @@ class sr_message():
 
         return ok
 
+    def publish_end(self):
+        self.publish_depth -= 1
+        if self.publish_depth > 0 : return True
+        return self.publish_many()
+
+    def publish_many(self):
+        if not self.publish_list : return True
+
+        count = len(self.publish_list)
+        ok    = self.publisher.publish_many(self.publish_list)
+        self.publish_list = []
+
+        if ok : self.logger.debug("Published %d messages" % count)
+        else  : self.logger.error("Could not publish %d messages" % count)
+
+        return ok
+
+    def publish_start(self):
+        self.publish_depth += 1
+
     def set_exchange(self,name):
         self.exchange = name
 
@@ -859,3 +892,112 @@ class sr_message():
                  return False,'incorrect extension',None,None,None
 
         return True,'ok',self.suffix,self.partstr,self.sumstr
+
+# sr_notice : compact view of an amqp message (raw_message from sr_amqp)
+#
+# sr_message.from_amqplib parses everything a message carries.  The consumer
+# only needs the topic and the url to accept or reject it : the other fields
+# are computed when first asked for, so a rejected message costs a split of
+# its notice.  One instance is reused (load) for every message consumed.
+
+class sr_notice():
+
+    __slots__ = ( 'raw_msg', 'exchange', 'topic', 'headers', 'notice', 'isRetry', \
+                  '_token', '_url', '_relpath', '_parts', '_sum', '_hdrstr' )
+
+    def __init__(self,raw_msg=None):
+        self.raw_msg = None
+        if raw_msg != None : self.load(raw_msg)
+
+    def load(self,raw_msg):
+        self.raw_msg  = raw_msg
+        self.exchange = raw_msg.delivery_info['exchange']
+        self.topic    = raw_msg.delivery_info['routing_key']
+        self.headers  = raw_msg.properties['application_headers']
+        self.notice   = raw_msg.body
+        self.isRetry  = raw_msg.isRetry
+
+        if type(self.notice) == bytes: self.notice = self.notice.decode("utf-8")
+
+        self._token   = None
+        self._url     = None
+        self._relpath = None
+        self._parts   = None
+        self._sum     = None
+        self._hdrstr  = None
+
+        return self
+
+    @property
+    def isPulse(self):
+        return self.topic.startswith('v02.pulse')
+
+    @property
+    def version(self):
+        return self.topic.split('.',1)[0]
+
+    # notice : 'time baseurl relpath ...'
+
+    @property
+    def token(self):
+        if self._token == None : self._token = self.notice.split(' ')
+        return self._token
+
+    @property
+    def time(self):
+        return self.token[0]
+
+    @property
+    def baseurl(self):
+        return self.token[1]
+
+    @property
+    def urlstr(self):
+        return self.token[1] + self.token[2]
+
+    @property
+    def relpath(self):
+        if self._relpath == None :
+           self._relpath = self.token[2].replace('%20',' ').replace('%23','#')
+        return self._relpath
+
+    @property
+    def url(self):
+        if self._url == None : self._url = urllib.parse.urlparse(self.urlstr)
+        return self._url
+
+    # headers
+
+    @property
+    def partstr(self):
+        if self.headers and 'parts' in self.headers : return self.headers['parts']
+        return None
+
+    @property
+    def sumstr(self):
+        if self.headers and 'sum' in self.headers : return self.headers['sum']
+        return None
+
+    @property
+    def parts(self):
+        # (partflg,chunksize,block_count,remainder,current_block) as in sr_message.set_parts_str
+        if self._parts == None and self.partstr != None :
+           token = self.partstr.split(',')
+           if token[0] in [ '0', '1' ] : self._parts = ( token[0], int(token[1]), 1, 0, 0 )
+           else : self._parts = ( token[0], int(token[1]), int(token[2]), int(token[3]), int(token[4]) )
+        return self._parts
+
+    @property
+    def sum(self):
+        # (sumflg,checksum) as in sr_message.set_sum_str
+        if self._sum == None and self.sumstr != None :
+           self._sum = tuple(self.sumstr.split(',',1))
+        return self._sum
+
+    @property
+    def hdrstr(self):
+        if self._hdrstr == None :
+           self._hdrstr = ''
+           for h in sorted(self.headers):
+               self._hdrstr += '%s=%s ' % (h, self.headers[h])
+        return self._hdrstr
@@ -498,12 +498,17 @@ class sr_poll(sr_post):
  
         n = 0
 
-        for idx,remote_file in enumerate(filelst) :
-            desc = desclst[remote_file]
-            ssiz = desc.split()[4]
+        self.msg.publish_start()
 
-            ok = self.poll_file_post(ssiz,destDir,remote_file)
-            if ok : n += 1
+        try :
+                for idx,remote_file in enumerate(filelst) :
+                    desc = desclst[remote_file]
+                    ssiz = desc.split()[4]
+
+                    ok = self.poll_file_post(ssiz,destDir,remote_file)
+                    if ok : n += 1
+        finally :
+                self.msg.publish_end()
 
         return n
 
@@ -599,7 +604,7 @@ class sr_poll(sr_post):
 
         # caching
         if self.caching :
-           self.cache      = sr_cache(self)
+           self.cache = sr_cache_create(self)
            self.cache_stat = True
            if self.reset:
               self.cache.close(unlink=True)
@@ -645,6 +650,8 @@ class sr_poll(sr_post):
 
                       #  do poll stuff
                       ok = self.__do_poll__()
+                      if not self.publisher.publish_flush() :
+                         self.logger.error("sr_poll : messages not published")
 
                       #  check if sleep is to short
                       poll_time = time.time() - now
@@ -137,6 +137,8 @@ class sr_post(sr_instances):
            if not plugin(self): break
 
         if self.post_hc :
+           if not self.publisher.publish_flush() :
+              self.logger.error("%s close : messages not published" % self.program_name)
            self.post_hc.close()
            self.post_hc = None
 
@@ -179,6 +181,8 @@ class sr_post(sr_instances):
         self.post_hc.connect()
 
         self.publisher = Publisher(self.post_hc)
+        self.publisher.add_batch(self.post_batch,self.post_batch_interval)
+        self.publisher.add_confirm_window(self.post_confirm_window)
         self.publisher.build()
 
         self.logger.info("Output AMQP broker(%s) user(%s) vhost(%s)" % \
@@ -636,77 +640,84 @@ class sr_post(sr_instances):
             #blocks = [8, 3, 1, 2, 9, 6, 0, 7, 4, 5] # Testing
             self.logger.info('Sending partitions in the following order: '+str(blocks))
 
-        for i in blocks: 
+        # parts are published together
 
-              # setting sumalgo for that part
+        self.msg.publish_start()
 
-              sumflg = self.sumflg
+        try :
+                for i in blocks: 
 
-              if sumflg[:2] == 'z,' and len(sumflg) > 2 :
-                 sumstr = sumflg
+                      # setting sumalgo for that part
 
-              else:
-                 sumflg = self.sumflg
-                 if not self.sumflg[0] in ['0','d','n','s','z' ]: sumflg = 'd'
-                 self.set_sumalgo(sumflg)
-                 sumalgo = self.sumalgo
-                 sumalgo.set_path(path)
+                      sumflg = self.sumflg
+
+                      if sumflg[:2] == 'z,' and len(sumflg) > 2 :
+                         sumstr = sumflg
 
-              # compute block stuff
+                      else:
+                         sumflg = self.sumflg
+                         if not self.sumflg[0] in ['0','d','n','s','z' ]: sumflg = 'd'
+                         self.set_sumalgo(sumflg)
+                         sumalgo = self.sumalgo
+                         sumalgo.set_path(path)
 
-              current_block = i
+                      # compute block stuff
 
-              offset = current_block * chunksize
-              length = chunksize
+                      current_block = i
 
-              last   = current_block == block_count-1
-              if last and remainder > 0 :
-                 length = remainder
+                      offset = current_block * chunksize
+                      length = chunksize
 
-              # set partstr
+                      last   = current_block == block_count-1
+                      if last and remainder > 0 :
+                         length = remainder
 
-              partstr = 'i,%d,%d,%d,%d' %\
-                        (chunksize,block_count,remainder,current_block)
+                      # set partstr
 
-              # compute checksum if needed
+                      partstr = 'i,%d,%d,%d,%d' %\
+                                (chunksize,block_count,remainder,current_block)
 
-              if not self.sumflg in ['0','n','z'] :
-                 bufsize = self.bufsize
-                 if length < bufsize : bufsize = length
+                      # compute checksum if needed
 
-                 fp = open(path,'rb')
-                 if offset != 0 : fp.seek(offset,0)
-                 t  = 0
-                 while t<length :
-                       buf = fp.read(bufsize)
-                       if not buf: break
-                       sumalgo.update(buf)
-                       t  += len(buf)
-                 fp.close()
+                      if not self.sumflg in ['0','n','z'] :
+                         bufsize = self.bufsize
+                         if length < bufsize : bufsize = length
 
-                 checksum = sumalgo.get_value()
-                 sumstr   = '%s,%s' % (sumflg,checksum)
+                         fp = open(path,'rb')
+                         if offset != 0 : fp.seek(offset,0)
+                         t  = 0
+                         while t<length :
+                               buf = fp.read(bufsize)
+                               if not buf: break
+                               sumalgo.update(buf)
+                               t  += len(buf)
+                         fp.close()
 
-              # caching
+                         checksum = sumalgo.get_value()
+                         sumstr   = '%s,%s' % (sumflg,checksum)
 
-              if self.caching :
-                 new_post = self.cache.check(str(sumstr),self.post_relpath,partstr)
-                 if new_post : self.logger.info("caching %s (%s)"% (path,partstr) )
-                 else        :
-                               self.logger.debug("already posted %s (%s)"%(path,partstr) )
-                               continue
+                      # caching
 
-              # complete  message
+                      if self.caching :
+                         new_post = self.cache.check(str(sumstr),self.post_relpath,partstr)
+                         if new_post : self.logger.info("caching %s (%s)"% (path,partstr) )
+                         else        :
+                                       self.logger.debug("already posted %s (%s)"%(path,partstr) )
+                                       continue
 
-              self.msg.headers['parts'] = partstr
-              self.msg.headers['sum']   = sumstr
+                      # complete  message
 
-              # post message
+                      self.msg.headers['parts'] = partstr
+                      self.msg.headers['sum']   = sumstr
 
-              ok = self.__on_post__()
-              if not ok:
-                self.logger.error('Something went wrong while posting: %s' %self.msg.notice[2])
+                      # post message
 
+                      ok = self.__on_post__()
+                      if not ok:
+                        self.logger.error('Something went wrong while posting: %s' %self.msg.notice[2])
+        finally :
+                if not self.msg.publish_end():
+                   self.logger.error('Something went wrong while posting parts of: %s' % path)
 
         return True
 
@@ -1242,6 +1253,8 @@ class sr_post(sr_instances):
         last_time = time.time()
         while True:
              self.wakeup()
+             if not self.publisher.publish_flush() :
+                self.logger.error("watch_loop : messages not published")
              now = time.time()
              elapse = now - last_time
              if elapse < self.sleep : time.sleep(self.sleep-elapse)
@@ -1388,7 +1401,7 @@ class sr_post(sr_instances):
 
         # caching
         if self.caching :
-           self.cache      = sr_cache(self)
+           self.cache = sr_cache_create(self)
            self.cache_stat = True
            if self.reset:
               self.cache.close(unlink=True)
@@ -1403,24 +1416,31 @@ class sr_post(sr_instances):
         for plugin in self.on_start_list:
            if not plugin(self): break
 
-        for d in self.postpath :
-            self.logger.debug("postpath = %s" % d)
-            if pbd and not d.startswith(pbd) : d = pbd + '/' + d
+        # when posting once, all posts are published together
 
-            if self.sleep > 0 : 
-               self.watch_dir(d)
-               continue
-
-            if   os.path.isdir(d) :
-                 self.walk(d)
-            elif os.path.islink(d):
-                 self.post1file(d,None)
-            elif os.path.isfile(d):
-                 self.post1file(d,os.stat(d))
-            else: 
-                 self.logger.error("could not post %s (exists %s)" % (d,os.path.exists(d)) )
+        if self.sleep <= 0 : self.msg.publish_start()
 
-        if self.sleep > 0: self.watch_loop()
+        try :
+                for d in self.postpath :
+                    self.logger.debug("postpath = %s" % d)
+                    if pbd and not d.startswith(pbd) : d = pbd + '/' + d
+
+                    if self.sleep > 0 : 
+                       self.watch_dir(d)
+                       continue
+
+                    if   os.path.isdir(d) :
+                         self.walk(d)
+                    elif os.path.islink(d):
+                         self.post1file(d,None)
+                    elif os.path.isfile(d):
+                         self.post1file(d,os.stat(d))
+                    else: 
+                         self.logger.error("could not post %s (exists %s)" % (d,os.path.exists(d)) )
+
+                if self.sleep > 0: self.watch_loop()
+        finally :
+                if self.sleep <= 0 : self.msg.publish_end()
 
         self.close()
 
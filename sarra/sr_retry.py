@@ -30,7 +30,9 @@
 #  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307  USA
 #
 
-import os,json,sys,time
+import heapq,os,json,sqlite3,sys,time
+
+import urllib.parse
 
 try :
          from sr_config          import *
@@ -50,6 +52,19 @@ class sr_retry:
 
         self.retry_ttl  = self.parent.retry_ttl
 
+        # per destination backoff : dest -> [ delay, next eligible time ]
+        # a destination failing is retried after 1 sec, doubling up to 5 min.
+
+        self.backoff     = {}
+        self.backoff_min = 1
+        self.backoff_max = 300
+
+        # sender : all messages go to the configured destination, kept from here
+        # (downloads set parent.destination to the baseurl of each message)
+
+        self.destination = None
+        if parent.program_name == 'sr_sender' : self.destination = parent.destination
+
         # message to work with
 
         self.message    = raw_message(self.logger)
@@ -83,6 +98,10 @@ class sr_retry:
     def close(self):
         try   : self.heart_fp.close()
         except: pass
+        try   :
+                os.fsync(self.held_fp)
+                self.held_fp.close()
+        except: pass
         try   :
                 os.fsync(self.new_fp)
                 self.new_fp.close()
@@ -94,6 +113,7 @@ class sr_retry:
                 self.state_fp.close()
         except: pass
         self.heart_fp = None
+        self.held_fp  = None
         self.new_fp   = None
         self.retry_fp = None
         self.state_fp = None
@@ -126,6 +146,42 @@ class sr_retry:
 
         return json_line
 
+    def dest_failed(self,message):
+        dest = self.msg_dest(message)
+        now  = time.time()
+
+        if not dest in self.backoff :
+           self.backoff[dest] = [ self.backoff_min, now + self.backoff_min ]
+           self.logger.info("sr_retry %s failing, its retries delayed %d sec" % (dest,self.backoff_min))
+           return
+
+        # failed again once eligible : wait twice as long
+
+        delay, eligible = self.backoff[dest]
+        if now < eligible : return
+
+        delay = min(2*delay, self.backoff_max)
+        self.backoff[dest] = [ delay, now + delay ]
+        self.logger.info("sr_retry %s failing, its retries delayed %d sec" % (dest,delay))
+
+    def dest_worked(self,message):
+        if not self.backoff : return
+
+        dest = self.msg_dest(message)
+        if dest in self.backoff :
+           del self.backoff[dest]
+           self.logger.info("sr_retry %s working again" % dest)
+
+    def dests_blocked(self):
+
+        # destinations not eligible yet, and when the first one will be
+
+        now      = time.time()
+        blocked  = [ dest for dest,(delay,eligible) in self.backoff.items() if now < eligible ]
+        eligible = min([ self.backoff[dest][1] for dest in blocked ] + [ now ])
+
+        return blocked, eligible
+
     def get(self):
         ok = False
 
@@ -135,6 +191,12 @@ class sr_retry:
         return message
 
     def get_retry(self):
+
+        # a message held back whose destination is eligible now
+
+        message = self.held_get()
+        if message : return True,message
+
         self.retry_fp, message = self.msg_get_from_file(self.retry_fp, self.retry_path)
 
         # FIXME MG as discussed with Peter
@@ -154,11 +216,52 @@ class sr_retry:
            #self.logger.error("MG invalid %s" % message.body)
            return False,None
 
+        # destination backing off : hold it until the destination is eligible
+
+        if self.backoff and self.msg_dest(message) in self.dests_blocked()[0] :
+           self.hold(message)
+           return False,None
+
         #self.logger.error("MG return %s" % message.body)
         message.isRetry = True
 
         return True,message
 
+    def held_get(self):
+
+        # the first message held whose destination is eligible, if any
+
+        now = time.time()
+
+        while self.held and self.held[0][0] <= now :
+              eligible, seq, line = heapq.heappop(self.held)
+
+              message = self.msgFromJSON(line)
+              if message == None or not self.is_valid(message) : continue
+
+              # failed again meanwhile : held until its new eligible time
+
+              dest = self.msg_dest(message)
+              if dest in self.backoff and now < self.backoff[dest][1] :
+                 heapq.heappush(self.held, (self.backoff[dest][1], seq, line))
+                 continue
+
+              message.isRetry = True
+              return message
+
+        return None
+
+    def hold(self,message):
+
+        # in the held file (back in the retries at the heartbeat, or after a crash)
+        # and in memory, by the time its destination is eligible
+
+        self.held_fp = self.msg_append_to_file(self.held_fp,self.held_path,message)
+
+        eligible = self.backoff[self.msg_dest(message)][1]
+        heapq.heappush(self.held, (eligible, self.held_seq, self.msgToJSON(message)))
+        self.held_seq += 1
+
     def init(self):
 
         # retry messages
@@ -179,18 +282,22 @@ class sr_retry:
         self.state_work = self.state_path        + '.work'
         self.state_fp   = None
 
+        # messages held back while their destination backs off,
+        # ordered by (eligible time, order held)
+
+        self.held_path  = self.parent.retry_path + '.held'
+        self.held_work  = self.held_path         + '.work'
+        self.held_fp    = None
+        self.held       = []
+        self.held_seq   = 0
+
         # working file at heartbeat
 
         self.heart_path = self.parent.retry_path + '.heart'
         self.heart_fp   = None
 
     def in_cache(self,message):
-        relpath = '/'.join(message.body.split()[1:])
-        sumstr  = message.properties['application_headers']['sum']
-        partstr = relpath
-        if 'parts' in message.properties['application_headers'] :
-            partstr = message.properties['application_headers']['parts']
-        cache_key = relpath + ' ' + sumstr + ' ' + partstr
+        cache_key = self.msg_key(message)
         if cache_key in self.retry_cache : return True
         self.retry_cache[cache_key] = True
         return False
@@ -237,6 +344,27 @@ class sr_retry:
 
         return True
 
+    def msg_dest(self,message):
+
+        # sender : all messages go to the destination
+        # others : the remote server messages come from
+
+        if self.destination : return self.destination
+
+        notice = message.body
+        if type(notice) == bytes: notice = notice.decode("utf-8")
+
+        url = urllib.parse.urlparse(notice.split()[1])
+        return url.scheme + '://' + url.netloc
+
+    def msg_key(self,message):
+        relpath = '/'.join(message.body.split()[1:])
+        sumstr  = message.properties['application_headers']['sum']
+        partstr = relpath
+        if 'parts' in message.properties['application_headers'] :
+            partstr = message.properties['application_headers']['parts']
+        return relpath + ' ' + sumstr + ' ' + partstr
+
     def msg_append_to_file(self,fp,path,message,done=False):
         if fp == None :
            present = os.path.isfile(path)
@@ -322,6 +450,17 @@ class sr_retry:
                     fp = open(self.new_work,'w')
                     fp.close()
 
+             # held messages go back in the retries (held again if still backing off)
+
+             if not os.path.isfile(self.held_work):
+                if os.path.isfile(self.held_path) : 
+                    os.rename(self.held_path,self.held_work)
+                else:
+                    fp = open(self.held_work,'w')
+                    fp.close()
+
+             self.held = []
+
              # state to heart
 
              #self.logger.debug("MG DEBUG has state %s" % os.path.isfile(self.state_path))
@@ -347,6 +486,20 @@ class sr_retry:
 
              #self.logger.debug("MG DEBUG took %d out of the %d state" % (N,i))
 
+             # held to heart (after state : those retried since are there)
+
+             fp   = None
+             while True:
+                   fp, message = self.msg_get_from_file(fp, self.held_work)
+                   if not message : break
+                   if self.in_cache(message): continue
+                   if not self.is_valid(message): continue
+
+                   self.heart_fp = self.msg_append_to_file(self.heart_fp,self.heart_path,message)
+                   N = N + 1
+             try   : fp.close()
+             except: pass
+
              # remaining of retry to heart
      
              #self.logger.debug("MG DEBUG has retry %s" % os.path.isfile(self.retry_path))
@@ -428,11 +581,29 @@ class sr_retry:
         except: pass
         try   : os.unlink(self.new_work)
         except: pass
+        try   : os.unlink(self.held_work)
+        except: pass
 
         self.last_body = None
         elapse         = time.time()-now
         self.logger.info("sr_retry on_heartbeat elapse %f" % elapse)
 
+        self.on_heartbeat_backoff()
+
+    def on_heartbeat_backoff(self):
+
+        # forget destinations eligible for a long time (their retries are gone)
+
+        now = time.time()
+
+        for dest in list(self.backoff.keys()) :
+            delay, eligible = self.backoff[dest]
+            if now - eligible > self.backoff_max : del self.backoff[dest]
+
+        if self.backoff :
+           self.logger.info("sr_retry backing off %s" % \
+                            ', '.join([ '%s (%d sec)' % (dest,delay) for dest,(delay,eligible) in self.backoff.items() ]))
+
     def on_start(self,parent):
         self.logger.info("sr_retry on_start")
         
@@ -448,3 +619,236 @@ class sr_retry:
            new_age = os.stat(self.new_path)[stat.ST_MTIME]
            if retry_age > new_age : os.unlink(self.new_path)
 
+        if os.path.isfile(self.held_path):
+           held_age = os.stat(self.held_path)[stat.ST_MTIME]
+           if retry_age > held_age : os.unlink(self.held_path)
+
+
+
+#============================================================
+# sr_retry_sqlite : retry_backend sqlite
+#
+# same interface as sr_retry, but the retries are kept in an sqlite
+# database (retry_path + '.db') instead of the JSON-lines files :
+#
+# table retry (seq, key, time, msg)
+#       seq  : order in which messages are retried (a message that
+#              fails again goes to the end)
+#       key  : relpath sum parts, unique, so a message is there once
+#       dest : destination (see msg_dest) for per destination backoff
+#       time : message time, indexed, for retry_ttl expiry
+#       msg  : message as a JSON line (msgToJSON)
+#
+# adding, requeuing or marking a message done is one indexed statement.
+# a pass over the retries goes from the first seq to the last seq present
+# when the database is opened or at the heartbeat; messages added during
+# the pass wait for the next one.
+# at the heartbeat, only expired messages are deleted, nothing is rewritten.
+# messages of destinations backing off are skipped (they stay in place),
+# and when only those are left, get() returns None until one is eligible.
+#
+# existing retry files are imported into the database the first time.
+#
+
+class sr_retry_sqlite(sr_retry):
+
+    def __init__(self, parent ):
+        self.db = None
+        sr_retry.__init__(self,parent)
+
+    def add_msg_to_state_file(self,message,done=False):
+
+        # done : out of the retries
+        if done :
+           self.connect()
+           self.db.execute('DELETE FROM retry WHERE key=?', (self.msg_key(message),))
+           return
+
+        # failed again : at the end of the retries
+        self.msg_put(message)
+
+    def add_msg_to_new_file(self,message):
+        self.msg_put(message)
+
+    def cleanup(self):
+        self.close()
+
+        for suffix in [ '', '-wal', '-shm' ] :
+            try   : os.unlink(self.parent.retry_path + '.db' + suffix)
+            except: pass
+
+        sr_retry.cleanup(self)
+
+    def close(self):
+        try   : self.db.close()
+        except: pass
+        self.db = None
+
+    def connect(self):
+        if self.db != None : return
+
+        # autocommit : every statement is its own transaction
+
+        self.db = sqlite3.connect(self.db_path, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS retry ' + \
+                        '(seq INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT UNIQUE, dest TEXT, time REAL, msg TEXT)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS retry_time ON retry (time)')
+
+        self.migrate()
+
+        # retries left by a previous run : retried now, not after the first heartbeat
+
+        self.new_pass()
+
+    def dest_worked(self,message):
+        sr_retry.dest_worked(self,message)
+        self.idle_until = 0
+
+    def get(self):
+        self.connect()
+
+        # only destinations backing off left in this pass : nothing to do before one is eligible
+
+        if time.time() < self.idle_until : return None
+
+        while True :
+              blocked, eligible = self.dests_blocked()
+
+              # a destination eligible again : its messages skipped in this pass are behind
+              # (the others behind were deleted when done, or requeued after end_seq)
+
+              if set(self.last_blocked) - set(blocked) : self.last_seq = 0
+              self.last_blocked = blocked
+
+              row = self.next_retry(blocked)
+              if row == None :
+                 self.idle_until = eligible
+                 return None
+
+              seq, line     = row
+              self.last_seq = seq
+
+              message = self.msgFromJSON(line)
+
+              # corrupted or expired : out of the retries
+
+              if message == None or not self.is_valid(message) :
+                 self.db.execute('DELETE FROM retry WHERE seq=?', (seq,))
+                 continue
+
+              message.isRetry = True
+              return message
+
+    def init(self):
+        sr_retry.init(self)
+
+        self.db_path      = self.parent.retry_path + '.db'
+        self.last_seq     = 0
+        self.end_seq      = 0
+        self.idle_until   = 0
+        self.last_blocked = []
+
+    def migrate(self):
+
+        # retry files left by retry_backend file : import them, the way
+        # on_heartbeat merges them (latest state first, retry then new, first one kept)
+        # the heart file is only a partial copy of the work files
+
+        try   : os.unlink(self.heart_path)
+        except: pass
+
+        paths = [ self.state_path, self.state_work, self.held_work, self.held_path, \
+                  self.retry_work, self.retry_path, self.new_work, self.new_path ]
+        paths = [ path for path in paths if os.path.isfile(path) ]
+        if not paths : return
+
+        self.retry_cache = {}
+        N = 0
+
+        for path in paths :
+            fp = None
+            while True:
+                  fp, message = self.msg_get_from_file(fp, path)
+                  if not message : break
+                  if self.in_cache(message): continue
+                  if not self.is_valid(message): continue
+                  self.msg_put(message)
+                  N = N + 1
+
+        for path in paths :
+            try   : os.unlink(path)
+            except: pass
+
+        self.retry_cache = {}
+        self.logger.info("sr_retry_sqlite imported %d messages from retry files into %s" % (N,self.db_path))
+
+    def msg_put(self,message):
+        self.connect()
+
+        try:
+           line     = self.msgToJSON(message)
+           msg_time = timestr2flt(message.body.split()[0])
+           self.db.execute('INSERT OR REPLACE INTO retry (key,dest,time,msg) VALUES (?,?,?,?)', \
+                           (self.msg_key(message),self.msg_dest(message),msg_time,line))
+        except:
+           self.logger.error("failed to add message to retry database: %s" % message.body )
+
+    def new_pass(self):
+
+        # a pass over the messages present now
+
+        self.last_seq   = 0
+        self.idle_until = 0
+        self.end_seq    = self.db.execute('SELECT IFNULL(MAX(seq),0) FROM retry').fetchone()[0]
+
+    def next_retry(self, blocked=[]):
+
+        # (seq,msg) of the next message in the current pass, not for a blocked destination
+
+        sql = 'SELECT seq,msg FROM retry WHERE seq>? AND seq<=?'
+        if blocked : sql += ' AND dest NOT IN (%s)' % ','.join('?'*len(blocked))
+        sql += ' ORDER BY seq LIMIT 1'
+
+        return self.db.execute(sql, [self.last_seq,self.end_seq] + blocked).fetchone()
+
+    def on_heartbeat(self,parent):
+        self.logger.info("sr_retry_sqlite on_heartbeat")
+
+        now = time.time()
+
+        try:
+             self.connect()
+
+             # drop expired messages
+
+             if self.retry_ttl and self.retry_ttl > 0 :
+                cur = self.db.execute('DELETE FROM retry WHERE time<?', (now - self.retry_ttl/1000,))
+                if cur.rowcount > 0 : self.logger.info("expired messages skipped %d" % cur.rowcount)
+
+             # finish retry pass before starting a new one
+
+             if self.next_retry(self.dests_blocked()[0]) != None :
+                self.logger.info("sr_retry_sqlite resuming with retry pass")
+
+             else :
+                N = self.db.execute('SELECT COUNT(*) FROM retry').fetchone()[0]
+                self.new_pass()
+
+                if N == 0 : self.logger.info("No retry in list")
+                else      : self.logger.info("Number of messages in retry list %d" % N)
+
+        except:
+                self.logger.error("on_heartbeat something went wrong")
+                (stype, svalue, tb) = sys.exc_info()
+                self.logger.error("Type: %s, Value: %s,  ..." % (stype, svalue))
+
+        elapse = time.time()-now
+        self.logger.info("sr_retry_sqlite on_heartbeat elapse %f" % elapse)
+
+        self.on_heartbeat_backoff()
+
+    def on_start(self,parent):
+        self.logger.info("sr_retry_sqlite on_start")
+        self.connect()
@@ -99,11 +99,9 @@ class sr_sftp(sr_proto):
     # cd
     def cd(self, path):
         self.logger.debug("sr_sftp cd %s" % path)
-        alarm_set(self.iotime)
         self.sftp.chdir(self.originalDir)
         self.sftp.chdir(path)
         self.pwd = path
-        alarm_cancel()
 
     # cd forced
     def cd_forced(self,perm,path) :
@@ -111,14 +109,11 @@ class sr_sftp(sr_proto):
 
         # try to go directly to path
 
-        alarm_set(self.iotime)
         self.sftp.chdir(self.originalDir)
         try   :
                 self.sftp.chdir(path)
-                alarm_cancel()
                 return
         except: pass
-        alarm_cancel()
 
         # need to create subdir
 
@@ -129,17 +124,13 @@ class sr_sftp(sr_proto):
             if d == ''   : continue
             # try to go directly to subdir
             try   :
-                    alarm_set(self.iotime)
                     self.sftp.chdir(d)
-                    alarm_cancel()
                     continue
             except: pass
 
             # create and go to subdir
-            alarm_set(self.iotime)
             self.sftp.mkdir(d,self.parent.chmod_dir)
             self.sftp.chdir(d)
-            alarm_cancel()
 
     def check_is_connected(self):
         self.logger.debug("sr_sftp check_is_connected")
@@ -158,9 +149,7 @@ class sr_sftp(sr_proto):
 
         # really connected, getcwd would not work, send_ignore would not work... so chdir used
         try    :
-                 alarm_set(self.iotime)
                  self.sftp.chdir(self.originalDir)
-                 alarm_cancel()
         except :
                  self.close()
                  return False
@@ -170,9 +159,7 @@ class sr_sftp(sr_proto):
     # chmod
     def chmod(self,perm,path):
         self.logger.debug("sr_sftp chmod %s %s" % ( "{0:o}".format(perm),path))
-        alarm_set(self.iotime)
         self.sftp.chmod(path,perm)
-        alarm_cancel()
 
     # close
     def close(self):
@@ -183,12 +170,10 @@ class sr_sftp(sr_proto):
 
         self.init()
 
-        alarm_set(self.iotime)
         try   : old_sftp.close()
         except: pass
         try   : old_ssh.close()
         except: pass
-        alarm_cancel()
 
     # connect...
     def connect(self):
@@ -202,7 +187,9 @@ class sr_sftp(sr_proto):
 
         if not self.credentials() : return False
 
-        alarm_set(self.iotime)
+        # io timeout : the sockets' (connection, banner, authentication, then
+        # the channel for every sftp command and file), iotime seconds
+
         try:
 
                 logger = logging.getLogger('paramiko')
@@ -213,19 +200,19 @@ class sr_sftp(sr_proto):
                 if self.password:
                    self.ssh.connect(self.host,self.port,self.user,self.password, \
                                     pkey=None,key_filename=self.ssh_keyfile,\
-                                    timeout=self.timeout,allow_agent=False,look_for_keys=False)
+                                    timeout=self.iotime,banner_timeout=self.iotime,auth_timeout=self.iotime,\
+                                    allow_agent=False,look_for_keys=False)
                 else:
                    self.ssh.connect(self.host,self.port,self.user,self.password, \
                                     pkey=None,key_filename=self.ssh_keyfile,\
-                                    timeout=self.timeout)
+                                    timeout=self.iotime,banner_timeout=self.iotime,auth_timeout=self.iotime)
                 #if ssh_keyfile != None :
                 #  key=DSSKey.from_private_key_file(ssh_keyfile,password=None)
 
                 sftp = self.ssh.open_sftp()
-                if self.timeout != None :
-                   self.logger.debug("sr_sftp connect setting timeout %f" % self.timeout)
-                   channel = sftp.get_channel()
-                   channel.settimeout(self.timeout)
+                self.logger.debug("sr_sftp connect setting timeout %d" % self.iotime)
+                channel = sftp.get_channel()
+                channel.settimeout(self.iotime)
 
                 sftp.chdir('.')
                 self.originalDir = sftp.getcwd()
@@ -238,14 +225,12 @@ class sr_sftp(sr_proto):
                 if os.path.isfile(self.file_index_cache): self.load_file_index()
                 else: self.init_file_index()
 
-                #alarm_cancel()
                 return True
 
         except:
             (stype, svalue, tb) = sys.exc_info()
             self.logger.error("Unable to connect to %s (user:%s). Type: %s, Value: %s" % (self.host,self.user, stype,svalue))
 
-        alarm_cancel()
         return False
 
     # credentials...
@@ -301,12 +286,10 @@ class sr_sftp(sr_proto):
     def delete(self, path):
         self.logger.debug("sr_sftp rm %s" % path)
 
-        alarm_set(self.iotime)
         # check if the file is there... if not we are done,no error
         try   :
                 s = self.sftp.lstat(path)
         except: 
-                alarm_cancel()
                 return
 
         # proceed with file/link removal
@@ -319,14 +302,10 @@ class sr_sftp(sr_proto):
            self.logger.debug("sr_sftp rmdir %s" % path)
            self.sftp.rmdir(path)
 
-        alarm_cancel()
-
     # symlink
     def symlink(self, link, path):
         self.logger.debug("sr_sftp symlink %s %s" % (link, path) )
-        alarm_set(self.iotime)
         self.sftp.symlink(link, path)
-        alarm_cancel()
 
     # get 
     def get(self, remote_file, local_file, remote_offset=0, local_offset=0, length=0 ) :
@@ -334,11 +313,9 @@ class sr_sftp(sr_proto):
 
         # read : remote file open, seek if needed
 
-        alarm_set(2*self.iotime)
         rfp = self.sftp.file(remote_file,'rb',self.bufsize)
         if remote_offset != 0 : rfp.seek(remote_offset,0)
         rfp.settimeout(1.0*self.iotime)
-        alarm_cancel()
 
         # read from rfp and write to local_file
 
@@ -346,15 +323,11 @@ class sr_sftp(sr_proto):
 
         # close
 
-        alarm_set(self.iotime)
         rfp.close()
-        alarm_cancel()
 
     # getcwd
     def getcwd(self):
-        alarm_set(self.iotime)
         cwd =  self.sftp.getcwd()
-        alarm_cancel()
         return cwd
 
     # init
@@ -375,20 +348,16 @@ class sr_sftp(sr_proto):
         self.logger.debug("sr_sftp listdir(): %s" % dir_fils)
         if dir_fils:
             dir_attr = self.sftp.listdir_attr()
-            alarm_cancel()
             for index in range(len(dir_fils)):
                 attr = dir_attr[index]
                 line = attr.__str__()
                 fil = dir_fils[index]
                 self.ls_file_index(fil,line)
-        else:
-            alarm_cancel()
         if hasattr(self,'file_index'): self.write_file_index()
 
     # load_file_index
     def load_file_index(self):
         self.logger.debug("sr_sftp load_file_index")
-        alarm_cancel()
         try:
             with open(self.file_index_cache,'r') as fp:
                 index = int(fp.read())
@@ -400,10 +369,7 @@ class sr_sftp(sr_proto):
     def ls(self):
         self.logger.debug("sr_sftp ls")
         self.entries  = {}
-        # iotime is at least 30 secs, say we wait for max 5 mins
-        alarm_set( 10 * self.iotime )
         dir_attr = self.sftp.listdir_attr()
-        alarm_cancel()
         for index in range(len(dir_attr)):
             attr = dir_attr[index]
             line = attr.__str__()
@@ -456,9 +422,7 @@ class sr_sftp(sr_proto):
     # mkdir
     def mkdir(self, remote_dir):
         self.logger.debug("sr_sftp mkdir %s" % remote_dir)
-        alarm_set(self.iotime)
         self.sftp.mkdir(remote_dir,self.parent.chmod_dir)
-        alarm_cancel()
 
     # put
     def put(self, local_file, remote_file, local_offset=0, remote_offset=0, length=0 ):
@@ -466,8 +430,6 @@ class sr_sftp(sr_proto):
 
         # simple file
 
-        alarm_set(2*self.iotime)
-
         if length == 0 :
            rfp = self.sftp.file(remote_file,'wb',self.bufsize)
            rfp.settimeout(1.0*self.iotime)
@@ -483,45 +445,35 @@ class sr_sftp(sr_proto):
            rfp.settimeout(1.0*self.iotime)
            if remote_offset != 0 : rfp.seek(remote_offset,0)
 
-        alarm_cancel()
-
         # read from local_file and write to rfp
 
         rw_length = self.readlocal_write( local_file, local_offset, length, rfp )
 
         # no sparse file... truncate where we are at
 
-        alarm_set(self.iotime)
         self.fpos = remote_offset + rw_length
         if length != 0 : rfp.truncate(self.fpos)
 
         # close
 
         rfp.close()
-        alarm_cancel()
 
     # rename
     def rename(self,remote_old,remote_new) :
         self.logger.debug("sr_sftp rename %s %s" % (remote_old,remote_new))
         try    : self.delete(remote_new)
         except : pass
-        alarm_set(self.iotime)
         self.sftp.rename(remote_old,remote_new)
-        alarm_cancel()
 
     # rmdir
     def rmdir(self,path) :
         self.logger.debug("sr_sftp rmdir %s " % path)
-        alarm_set(self.iotime)
         self.sftp.rmdir(path)
-        alarm_cancel()
 
     # utime
     def utime(self,path,tup) :
         self.logger.debug("sr_sftp utime %s %s " % (path,tup))
-        alarm_set(self.iotime)
         self.sftp.utime(path,tup)
-        alarm_cancel()
 
     # write_file_index
     def write_file_index(self):
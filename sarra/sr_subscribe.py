@@ -42,9 +42,10 @@
 #
 #============================================================
 
-import json,os,sys,time
+import copy,json,os,sys,time
 
 try :    
+         from sr_async_http      import *
          from sr_cache           import *
          from sr_consumer        import *
          from sr_file            import *
@@ -53,7 +54,9 @@ try :
          from sr_instances       import *
          from sr_message         import *
          from sr_util            import *
+         from sr_worker          import *
 except : 
+         from sarra.sr_async_http import *
          from sarra.sr_cache     import *
          from sarra.sr_consumer  import *
          from sarra.sr_file      import *
@@ -62,6 +65,7 @@ except :
          from sarra.sr_instances import *
          from sarra.sr_message   import *
          from sarra.sr_util      import *
+         from sarra.sr_worker    import *
 
 class sr_subscribe(sr_instances):
 
@@ -148,6 +152,9 @@ class sr_subscribe(sr_instances):
         if self.retry_mode :
            self.execfile("plugin",'hb_retry')
 
+        if self.prefetch_adaptive :
+           self.execfile("plugin",'hb_prefetch')
+
         # caching
 
         if not self.caching and self.program_name == 'sr_winnow' :
@@ -155,7 +162,7 @@ class sr_subscribe(sr_instances):
            sys.exit(1)
 
         if self.caching :
-           self.cache      = sr_cache(self)
+           self.cache = sr_cache_create(self)
            self.cache_stat = True
            if not self.heartbeat_cache_installed :
               self.execfile("on_heartbeat",'hb_cache')
@@ -167,6 +174,12 @@ class sr_subscribe(sr_instances):
         for plugin in self.on_stop_list:
            if not plugin(self): break
 
+        # downloads in flight : complete, then acknowledged
+
+        if hasattr(self,'downloads') and self.downloads :
+           self.downloads.close()
+           self.downloads = None
+
         self.consumer.close()
 
         if self.post_broker :
@@ -192,6 +205,8 @@ class sr_subscribe(sr_instances):
 
         self.msg = sr_message(self)
 
+        self.downloads = None
+
         # =============
         # consumer  queue_name : let consumer takes care of it
         # =============
@@ -259,6 +274,8 @@ class sr_subscribe(sr_instances):
            # publisher
 
            self.publisher = Publisher(self.post_hc)
+           self.publisher.add_batch(self.post_batch,self.post_batch_interval)
+           self.publisher.add_confirm_window(self.post_confirm_window)
            self.publisher.build()
            self.msg.publisher = self.publisher
            if self.post_exchange :
@@ -266,10 +283,73 @@ class sr_subscribe(sr_instances):
            self.msg.post_exchange_split = self.post_exchange_split
            self.logger.info("Output AMQP exchange(%s)" % self.post_exchange )
 
+           # batched publishing : messages are acknowledged in batches too,
+           # once what they produced is commited or confirmed
+
+           if self.post_batch > 1 or self.post_confirm_window > 0 :
+              consumer = self.consumer.consumer
+              consumer.add_ack_batch(max(consumer.ack_batch,self.post_batch,self.post_confirm_window), \
+                                     min(self.ack_interval,self.post_batch_interval))
+              consumer.add_before_ack(self.publisher.publish_flush)
+
            # amqp resources
 
            self.declare_exchanges()
 
+        # =============
+        # download_threads : a thread per download, each with its own transports
+        # http_engine asyncio : http(s) downloads as coroutines on an event loop
+        # the consumer leaves acknowledgements to sr_worker, and waits on it when idle
+        # =============
+
+        asyncio_http = self.http_engine == 'asyncio'
+
+        if self.download_threads > 1 or asyncio_http :
+
+           nthreads = self.download_threads
+           if nthreads < 2 : nthreads = 0
+
+           views = []
+           for i in range(nthreads) :
+               views.append(self.download_view(i+1))
+
+           inflight_max = self.download_inflight_max
+           if inflight_max <= 0 : inflight_max = 2 * nthreads
+           if inflight_max <= 0 : inflight_max = 64
+
+           if asyncio_http :
+              self.http_async = async_http_transport()
+              self.loop_view  = self.download_view(nthreads+1)
+              self.downloads  = sr_worker_loop(self.logger, views, inflight_max, \
+                                               self.download_task, self.download_completed, self.download_ack, \
+                                               self.download_coroutine, self.download_in_loop)
+           else :
+              self.downloads  = sr_worker_pool(self.logger, views, inflight_max, \
+                                               self.download_task, self.download_completed, self.download_ack)
+
+           self.consumer.auto_ack = False
+           self.consumer.idle     = self.downloads.wait
+
+           # push mode waits on the broker : not too long, downloads complete meanwhile
+
+           if self.consumer.consumer.push : self.consumer.sleep_max = 1
+
+           self.logger.info("%d download threads, http_engine %s, at most %d messages in flight" % \
+                           (nthreads,self.http_engine,self.downloads.inflight_max))
+           if self.prefetch <= self.downloads.inflight_max :
+              self.logger.warning("prefetch %d limits the messages in flight below download_inflight_max %d" % \
+                                 (self.prefetch,self.downloads.inflight_max))
+
+    # a copy of this instance for downloads outside the main loop, with its own transports
+
+    def download_view(self,worker):
+
+        view = copy.copy(self)
+        for link in [ 'ftp_link', 'http_link', 'sftp_link' ] :
+            if link in view.__dict__ : del view.__dict__[link]
+        view.download_worker = worker
+
+        return view
 
     def __do_download__(self):
 
@@ -1271,6 +1351,8 @@ class sr_subscribe(sr_instances):
         # attempt downloads
         #=================================
 
+        ok = True
+
         if need_download :
 
            self.msg.onfly_checksum = None
@@ -1279,21 +1361,44 @@ class sr_subscribe(sr_instances):
 
            if self.msg.sumflg[0] == '0' : self.msg.sumalgo = None
 
-           # N attempts to download
+           # download_threads : a thread downloads it, the rest is done when it completes
+
+           if self.downloads != None and self.download_in_thread() :
+              self.download_submit(oldname)
+              return True
+
+           ok = self.download_attempts()
+
+        return self.download_finish(need_download,ok,oldname)
+
+    # N attempts to download
+
+    def download_attempts(self):
+
+        ok = False
+        i  = 1
+        while i <= self.attempts :
+              # it is confusing to see in log for the same product
+              # Download failed on one line than... 
+              # downloaded on next line
+              # so insert a warning about subsequent  attempts
+              if i != 1 : self.logger.warning("attempt %d" % i)
 
-           i  = 1
-           while i <= self.attempts :
-                 # it is confusing to see in log for the same product
-                 # Download failed on one line than... 
-                 # downloaded on next line
-                 # so insert a warning about subsequent  attempts
-                 if i != 1 : self.logger.warning("attempt %d" % i)
+              ok = self.__do_download__()
+              if ok : break
+              # dont force on retry 
+              if self.msg.isRetry : break
+              i = i + 1
 
-                 ok = self.__do_download__()
-                 if ok : break
-                 # dont force on retry 
-                 if self.msg.isRetry : break
-                 i = i + 1
+        return ok
+
+    #=================================
+    # after the download (or none needed) : plugins, publish
+    #=================================
+
+    def download_finish(self,need_download,ok,oldname):
+
+        if need_download :
 
            # could not download ...
 
@@ -1447,6 +1552,108 @@ class sr_subscribe(sr_instances):
         if self.msg.isRetry: self.consumer.msg_worked()
         return True
 
+    #=================================
+    # download_threads : downloads in threads (sr_worker)
+    #=================================
+
+    # a transfer of a whole file over the network, nothing else to do meanwhile
+
+    def download_in_thread(self):
+
+        if self.do_task_list != [ self.doit_download ] : return False
+        if self.msg.partflg != '1'                      : return False
+
+        scheme = self.msg.url.scheme
+        if scheme in self.do_downloads                  : return False
+
+        if scheme in [ 'http', 'https' ] and self.http_engine == 'asyncio' and \
+           not scheme in self.do_gets : return True
+
+        if self.download_threads < 2                    : return False
+
+        return scheme in [ 'http', 'https', 'ftp', 'ftps', 'sftp' ]
+
+    # the thread works on a copy of the message : reports published on completion
+
+    def download_submit(self,oldname):
+
+        msg         = copy.copy(self.msg)
+        msg.headers = self.msg.headers.copy()
+        if msg.sumalgo : msg.sumalgo = copy.copy(msg.sumalgo)
+
+        publisher = msg.report_publisher
+        if publisher != None : msg.report_publisher = sr_worker_reports()
+
+        key = msg.new_dir + '/' + msg.new_file
+
+        self.downloads.submit(self.consumer.raw_msg, msg, (oldname,publisher), key)
+
+    # in a thread : view is its copy of this instance
+
+    def download_task(self,view,job):
+
+        view.msg       = job.msg
+        job.msg.parent = view
+
+        return view.download_attempts()
+
+    # http_engine asyncio : the http(s) downloads go to the event loop
+
+    def download_in_loop(self,job):
+        scheme = job.msg.url.scheme
+        return self.http_engine == 'asyncio' and scheme in [ 'http', 'https' ] and not scheme in self.do_gets
+
+    # on the event loop : download_attempts, as a coroutine
+    # each download has its own copy of the loop view (parent.msg for plugins)
+
+    async def download_coroutine(self,job):
+
+        view           = copy.copy(self.loop_view)
+        view.msg       = job.msg
+        job.msg.parent = view
+
+        ok = False
+        i  = 1
+        while i <= self.attempts :
+              if i != 1 : self.logger.warning("attempt %d" % i)
+              ok = await self.http_async.download(view)
+              if ok : break
+              if job.msg.isRetry : break
+              i = i + 1
+
+        return ok
+
+    # back in the main thread : the rest of doit_download for that message
+
+    def download_completed(self,job):
+
+        msg     = self.msg
+        raw_msg = self.consumer.raw_msg
+
+        oldname, publisher = job.data
+
+        self.msg              = job.msg
+        self.msg.parent       = self
+        self.consumer.raw_msg = job.raw_msg
+
+        try :
+                if publisher != None :
+                   self.msg.report_publisher.replay(publisher)
+                   self.msg.report_publisher = publisher
+
+                self.download_finish(True,job.ok,oldname)
+        except:
+                if self.retry_mode : self.consumer.msg_to_retry()
+                (stype, svalue, tb) = sys.exc_info()
+                if self.debug : self.LOG_TRACE(tb)
+                self.logger.error("%s/download_completed Type: %s, Value: %s" % (self.program_name, stype, svalue))
+
+        self.msg              = msg
+        self.consumer.raw_msg = raw_msg
+
+    def download_ack(self,raw_msg):
+        self.consumer.consumer.ack(raw_msg)
+
     def LOG_TRACE(self,tb):
         import io, traceback
 
@@ -1489,17 +1696,21 @@ class sr_subscribe(sr_instances):
         # restore each message
 
         count = 0
-        with open(self.save_path,"r") as fp :
-             for json_line in fp:
-
-                 count += 1
-                 self.msg.exchange = 'save'
-                 self.msg.topic, self.msg.headers, self.msg.notice = json.loads(json_line)
-                 self.msg.from_amqplib()
-                 self.msg.isRetry  = False
-                 self.logger.info("%s restoring message %d of %d: topic: %s" %
-                                 (self.program_name,  count,total, self.msg.topic) )
-                 ok = self.process_message()
+        self.msg.publish_start()
+        try :
+                with open(self.save_path,"r") as fp :
+                     for json_line in fp:
+
+                         count += 1
+                         self.msg.exchange = 'save'
+                         self.msg.topic, self.msg.headers, self.msg.notice = json.loads(json_line)
+                         self.msg.from_amqplib()
+                         self.msg.isRetry  = False
+                         self.logger.info("%s restoring message %d of %d: topic: %s" %
+                                         (self.program_name,  count,total, self.msg.topic) )
+                         ok = self.process_message()
+        finally :
+                if not self.msg.publish_end() : count = 0
 
         if count >= total:
            self.logger.info("%s restore complete deleting save file: %s " % ( self.program_name, self.save_path ) )
@@ -1584,6 +1795,7 @@ class sr_subscribe(sr_instances):
 
                       #  consume message
                       ok, self.msg = self.consumer.consume()
+                      if self.downloads : self.downloads.consumed(self.consumer.raw_msg)
                       if not ok : continue
 
                       #  pulse message, go on to the next
@@ -1879,7 +2091,7 @@ class sr_subscribe(sr_instances):
            self.declare_exchanges()
 
         if self.caching :
-           self.cache = sr_cache(self)
+           self.cache = sr_cache_create(self)
            self.cache.open()
 
         self.close()
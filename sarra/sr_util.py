@@ -37,21 +37,70 @@ from hashlib import sha512
 
 import sys
 import calendar,datetime
-import os,random,signal,stat,sys,time
+import io,os,random,signal,stat,sys,threading,time
 import urllib
 import urllib.parse
 
+try :
+         from sr_bandwidth       import *
+except :
+         from sarra.sr_bandwidth import *
+
 #============================================================
-# sigalarm
+# io timeouts
 #============================================================
 
 class TimeoutException(Exception):
     """timeout exception"""
     pass
 
+# sr_deadline : an io time limit on the monotonic clock
+#
+#  No signal : usable from any thread (sr_worker download threads included).
+#  Sockets are given what remains (settimeout) and raise socket.timeout when
+#  nothing came in time, check() raises TimeoutException once the deadline is
+#  past, start() sets it again (seconds from now) when the io made progress.
+#  With seconds None or 0, no deadline : remaining() is None (blocking sockets).
+
+class sr_deadline():
+
+    def __init__(self, seconds=None):
+        self.seconds = seconds
+        self.start()
+
+    # check : TimeoutException if the deadline is past
+    def check(self, what='io'):
+        if self.expired() :
+           raise TimeoutException("%s timed out (%s sec)" % (what,self.seconds))
+
+    # expired
+    def expired(self):
+        return self.expires != None and time.monotonic() >= self.expires
+
+    # remaining : seconds left, None without deadline (never 0 : a non blocking socket)
+    def remaining(self):
+        if self.expires == None : return None
+        return max(self.expires - time.monotonic(), 0.001)
+
+    # settimeout : sock waits at most what remains
+    def settimeout(self, sock):
+        sock.settimeout(self.remaining())
+
+    # start : the deadline, seconds from now
+    def start(self, seconds=None):
+        if seconds != None : self.seconds = seconds
+        self.expires = None
+        if self.seconds : self.expires = time.monotonic() + self.seconds
+
+# signal alarms : kept for plugins, sarracenia itself uses sr_deadline and socket timeouts
+# signals are for the main thread only : elsewhere these do nothing
+
+def alarm_thread():
+    return sys.platform != 'win32' and threading.current_thread() is threading.main_thread()
+
 # alarm_cancel
 def alarm_cancel():
-    if sys.platform != 'win32' :
+    if alarm_thread() :
         signal.alarm(0)
 
 # alarm_raise
@@ -60,7 +109,7 @@ def alarm_raise(n, f):
 
 # alarm_set
 def alarm_set(time):
-    if sys.platform != 'win32' :
+    if alarm_thread() :
         signal.signal(signal.SIGALRM, alarm_raise)
         signal.alarm(time)
 
@@ -108,21 +157,25 @@ class sr_proto():
     def init(self):
         #self.logger.debug("sr_proto init")
 
-        self.sumalgo   = None
-        self.checksum  = None
-        self.fpos      = 0
+        self.sumalgo     = None
+        self.checksum    = None
+        self.fpos        = 0
+
+        self.bufsize     = self.parent.bufsize
+        self.bufsize_max = 0
+        self.rw_view     = None
+        self.kbytes_ps   = self.parent.kbytes_ps
+        self.bandwidth   = sr_bandwidth_open(self.parent)
+        self.timeout     = self.parent.timeout
 
-        self.bufsize   = self.parent.bufsize
-        self.kbytes_ps = self.parent.kbytes_ps
-        self.bytes_ps  = self.kbytes_ps * 1024
-        self.tbytes    = 0
-        self.tbegin    = time.time()
-        self.timeout   = self.parent.timeout
+        if hasattr(self.parent,'bufsize_max') : self.bufsize_max = self.parent.bufsize_max
 
-        self.iotime    = 30
+        self.iotime      = 30
 
         if self.timeout > self.iotime: self.iotime = int(self.timeout)
 
+        self.deadline    = sr_deadline(self.iotime)
+
         self.logger.debug("iotime %d" % self.iotime)
 
     # local_read_close
@@ -193,64 +246,82 @@ class sr_proto():
         return dst
 
     # read_write
+    #
+    # chunks are read into a buffer kept from one transfer to the next (readinto),
+    # when src is a python io object (files, urllib http responses) and the sum
+    # algorithm takes a memoryview (update_view), read otherwise.
+    # The io timeout is a deadline (sr_deadline) : each chunk comes within iotime
+    # seconds, sockets given their own timeout by the protocols.  With bufsize_max
+    # above bufsize (readinto, no throttling), a chunk read whole makes the next
+    # one twice bigger, up to bufsize_max.  Throttling : each chunk taken from the
+    # bandwidth buckets (kbytes_ps, kbytes_ps_destination : sr_bandwidth).
+
     def read_write(self, src, dst, length=0):
         #self.logger.debug("sr_proto read_write")
 
-        # reset speed
-
         rw_length     = 0
-        self.tbytes   = 0.0
-        self.tbegin   = time.time()
+
+        readinto      = isinstance(src, io.IOBase) and hasattr(src,'readinto')
+        if self.sumalgo and not getattr(self.sumalgo,'update_view',False) : readinto = False
+        writeview     = isinstance(dst, io.IOBase)
+
+        # bigger chunks for python io objects only (paramiko files slow down)
+
+        bufsize       = self.bufsize
+        bufsize_max   = self.bufsize
+        if self.bufsize_max > bufsize and readinto and not self.bandwidth : bufsize_max = self.bufsize_max
+
+        view          = None
+        if readinto   : view = self.rw_buffer(bufsize)
+
+        deadline      = self.deadline
+        deadline.start()
 
         # length = 0, transfer entire remote file to local file
+        # otherwise exact length to be transfered
+
+        while length == 0 or rw_length < length :
+
+              n = bufsize
+              if length != 0 and length - rw_length < n : n = length - rw_length
+
+              if readinto :
+                 count = src.readinto(view[:n])
+                 chunk = view[:count]
+              else :
+                 chunk = src.read(n)
+                 count = len(chunk)
+
+              deadline.check('read')
+
+              if not count : break
+
+              if writeview or not readinto : dst.write(chunk)
+              else                         : dst.write(bytes(chunk))
+
+              rw_length += count
 
-        if length == 0 :
-           while True :
-                 if self.iotime: alarm_set(self.iotime)
-                 chunk = src.read(self.bufsize)
-                 if chunk :
-                    dst.write(chunk)
-                    rw_length += len(chunk)
-                 alarm_cancel()
-                 if not chunk : break
-                 if self.sumalgo  : self.sumalgo.update(chunk)
-                 if self.kbytes_ps: self.throttle(chunk)
-           return rw_length
-
-        # exact length to be transfered
-
-        nc = int(length/self.bufsize)
-        r  = length%self.bufsize
-
-        # read/write bufsize "nc" times
-
-        i  = 0
-        while i < nc :
-              if self.iotime : alarm_set(self.iotime)
-              chunk = src.read(self.bufsize)
-              if chunk :
-                 rw_length += len(chunk)
-                 dst.write(chunk)
-              alarm_cancel()
-              if not chunk : break
               if self.sumalgo  : self.sumalgo.update(chunk)
-              if self.kbytes_ps: self.throttle(chunk)
-              i = i + 1
+              if self.bandwidth: self.throttle(chunk)
 
-        # remaining
+              deadline.start()
 
-        if r > 0 :
-           if self.iotime : alarm_set(self.iotime)
-           chunk = src.read(r)
-           if chunk :
-              rw_length += len(chunk)
-              dst.write(chunk)
-           alarm_cancel()
-           if self.sumalgo  : self.sumalgo.update(chunk)
-           if self.kbytes_ps: self.throttle(chunk)
+              # whole chunk read : a bigger one next
+
+              if count == bufsize and bufsize < bufsize_max :
+                 bufsize = min(2*bufsize,bufsize_max)
+                 if readinto : view = self.rw_buffer(bufsize)
 
         return rw_length
 
+    # rw_buffer : the read_write buffer, at least size bytes, kept for the next transfers
+    def rw_buffer(self, size):
+
+        if self.rw_view == None or len(self.rw_view) < size :
+           self.rw_view = memoryview(bytearray(size))
+
+        return self.rw_view
+
     # read_writelocal
     def read_writelocal(self, src_path, src, local_file, local_offset=0, length=0):
         #self.logger.debug("sr_proto read_writelocal")
@@ -303,44 +374,39 @@ class sr_proto():
         self.logger.debug("sr_proto set_iotime %s" % iotime)
         if iotime < 1 : iotime = 1
         self.iotime = iotime
+        self.deadline.start(iotime)
 
     # set_sumalgo
     def set_sumalgo(self,sumalgo) :
         #self.logger.debug("sr_proto set_sumalgo %s" % sumalgo)
         self.sumalgo = sumalgo
 
-    # throttle
+    # throttle : buf taken from the bandwidth buckets (sr_bandwidth), waiting for it if in debt
     def throttle(self,buf) :
-        self.logger.debug("sr_proto throttle")
-        self.tbytes = self.tbytes + len(buf)
-        span  = self.tbytes / self.bytes_ps
-        rspan = time.time() - self.tbegin
-        if span > rspan :
-           stime = span-rspan
-           time.sleep(span-rspan)
-
-    # write_chunk
+        wait = self.bandwidth.reserve(len(buf), getattr(self.parent,'destination',None))
+        if wait > 0 :
+           self.logger.debug("sr_proto throttle %f" % wait)
+           time.sleep(wait)
+
+    # write_chunk  (each chunk within iotime seconds of the previous one, as in read_write)
     def write_chunk(self,chunk):
+        self.deadline.check('chunk')
         if self.chunk_iow : self.chunk_iow.write(chunk)
         self.rw_length += len(chunk)
-        alarm_cancel()
         if self.sumalgo  : self.sumalgo.update(chunk)
-        if self.kbytes_ps: self.throttle(chunk)
-        if self.iotime   : alarm_set(self.iotime)
+        if self.bandwidth: self.throttle(chunk)
+        self.deadline.start()
 
     # write_chunk_end
     def write_chunk_end(self):
-        alarm_cancel()
         self.chunk_iow = None
         return self.rw_length
 
     # write_chunk_init
     def write_chunk_init(self,proto):
         self.chunk_iow = proto
-        self.tbytes    = 0.0
-        self.tbegin    = time.time()
         self.rw_length = 0
-        if self.iotime : alarm_set(self.iotime)
+        self.deadline.start()
 
 # =========================================
 # sr_transport : one place for upload/download common stuff
@@ -379,11 +445,18 @@ class sr_transport():
         new_dir     = msg.new_dir
         new_file    = msg.new_file
 
-        try:    curdir = os.getcwd()
-        except: curdir = None
+        # in a download thread (sr_worker) : the current directory is the process'
+        # so local files are given with their directory instead
 
-        if curdir != new_dir:
-           os.chdir(new_dir)
+        local = ''
+        if hasattr(parent,'download_worker') and parent.download_worker :
+           local = new_dir + os.sep
+        else :
+           try:    curdir = os.getcwd()
+           except: curdir = None
+
+           if curdir != new_dir:
+              os.chdir(new_dir)
 
         try :
                 parent.destination = msg.baseurl
@@ -429,35 +502,35 @@ class sr_transport():
                 proto.set_sumalgo(msg.sumalgo)
 
                 if parent.inflight == None or msg.partflg == 'i' :
-                   self.get(remote_file,new_file,remote_offset,msg.local_offset,msg.length)
+                   self.get(remote_file,local+new_file,remote_offset,msg.local_offset,msg.length)
 
                 elif parent.inflight == '.' :
-                   new_lock = '.' + new_file
+                   new_lock = local + '.' + new_file
                    self.get(remote_file,new_lock,remote_offset,msg.local_offset,msg.length)
-                   if os.path.isfile(new_file) : os.remove(new_file)
-                   os.rename(new_lock, new_file)
+                   if os.path.isfile(local+new_file) : os.remove(local+new_file)
+                   os.rename(new_lock, local+new_file)
                       
                 elif parent.inflight[0] == '.' :
-                   new_lock  = new_file + parent.inflight
+                   new_lock  = local + new_file + parent.inflight
                    self.get(remote_file,new_lock,remote_offset,msg.local_offset,msg.length)
-                   if os.path.isfile(new_file) : os.remove(new_file)
-                   os.rename(new_lock, new_file)
+                   if os.path.isfile(local+new_file) : os.remove(local+new_file)
+                   os.rename(new_lock, local+new_file)
 
                 elif parent.inflight[-1] == '/' :
                    try :  
-                          os.mkdir(parent.inflight)
-                          os.chmod(parent.inflight,parent.chmod_dir)
+                          os.mkdir(local+parent.inflight)
+                          os.chmod(local+parent.inflight,parent.chmod_dir)
                    except:pass
-                   new_lock  = parent.inflight + new_file
+                   new_lock  = local + parent.inflight + new_file
                    self.get(remote_file,new_lock,remote_offset,msg.local_offset,msg.length)
-                   if os.path.isfile(new_file) : os.remove(new_file)
-                   os.rename(new_lock, new_file)
+                   if os.path.isfile(local+new_file) : os.remove(local+new_file)
+                   os.rename(new_lock, local+new_file)
 
                 msg.onfly_checksum = proto.checksum
 
                 # fix permission 
 
-                self.set_local_file_attributes(new_file,msg)
+                self.set_local_file_attributes(local+new_file,msg)
 
                 # fix message if no partflg (means file size unknown until now)
 
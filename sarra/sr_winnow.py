@@ -57,10 +57,10 @@ class sr_winnow(sr_subscribe):
            self.post_exchange = 'xs_%s' % self.post_broker.username + self.post_exchange_suffix
 
         # we cannot have more than one instance since we 
-        # need to work with a single cache.
+        # need to work with a single cache... unless it is shared.
 
-        if self.nbr_instances != 1 :
-           self.logger.error("Only one instance allowed... set to 1")
+        if self.nbr_instances != 1 and self.cache_backend != 'sqlite' :
+           self.logger.error("Only one instance allowed (unless cache_backend sqlite)... set to 1")
            os._exit(1)
 
         # post_exchange must be provided
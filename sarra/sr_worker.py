@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+#
+# This file is part of sarracenia.
+# The sarracenia suite is Free and is proudly provided by the Government of Canada
+# Copyright (C) Her Majesty The Queen in Right of Canada, Environment Canada, 2008-2015
+#
+# Questions or bugs report: dps-client@ec.gc.ca
+# sarracenia repository: git://git.code.sf.net/p/metpx/git
+# Documentation: http://metpx.sourceforge.net/#SarraDocumentation
+#
+# sr_worker.py : threads working on messages while the instance keeps consuming
+#
+#  Used by sr_subscribe (download_threads option) : the main loop consumes and
+#  processes messages as usual, but hands the transfers to a pool of threads.
+#  What follows a transfer (plugins, posting, retry, acknowledgement) is done
+#  by the main thread when it completes (consumed, wait, close), so only the
+#  transfer itself runs concurrently.
+#
+#  sr_worker_loop adds an asyncio event loop (its own thread) : the jobs it
+#  accepts are coroutines, as many at once as inflight_max allows, the
+#  others go to the threads (if any).
+#
+#  Messages consumed are acknowledged in the order received, once processed
+#  or transferred : acknowledging one (ack_batch) acknowledges all before it.
+#
+########################################################################
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307  USA
+#
+#
+
+import asyncio,collections,queue,sys,threading,time
+
+# a message consumed, and what a thread does with it
+
+class sr_worker_job():
+
+    def __init__(self, raw_msg ):
+        self.raw_msg   = raw_msg
+        self.msg       = None      # the message the thread works on (a copy)
+        self.data      = None      # whatever the caller needs on completion
+        self.key       = None      # one job at a time per key (target file)
+        self.ok        = None
+        self.submitted = False
+        self.done      = False
+
+# reports published from a thread : kept, published on completion
+
+class sr_worker_reports():
+
+    def __init__(self):
+        self.reports = []
+
+    def publish(self, exchange, topic, notice, headers ):
+        self.reports.append( (exchange, topic, notice, headers.copy()) )
+        return True
+
+    def replay(self, publisher ):
+        for exchange, topic, notice, headers in self.reports :
+            publisher.publish(exchange, topic, notice, headers)
+        self.reports = []
+
+class sr_worker_pool():
+
+    def __init__(self, logger, views, inflight_max, task, completed, ack ):
+
+        # views     : one per thread, what task gets as parent (copies of the instance)
+        # task      : task(view,job) in a thread, returns ok
+        # completed : completed(job) in the main thread
+        # ack       : ack(raw_msg) in the main thread
+
+        self.logger       = logger
+        self.task         = task
+        self.completed    = completed
+        self.ack          = ack
+        self.inflight_max = max(inflight_max,len(views))
+        self.inflight     = 0
+        self.keys         = {}
+
+        self.jobs         = queue.Queue()
+        self.results      = queue.Queue()
+
+        # messages consumed, acknowledged in that order
+
+        self.order        = collections.deque()
+        self.current      = None
+
+        self.threads      = []
+        for view in views :
+            thread = threading.Thread(target=self.work, args=(view,))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    # thread loop
+
+    def work(self, view):
+
+        while True :
+              job = self.jobs.get()
+              if job == None : return
+
+              try :
+                      job.ok = self.task(view,job)
+              except:
+                      (stype, svalue, tb) = sys.exc_info()
+                      self.logger.error("sr_worker/work Type: %s, Value: %s" % (stype, svalue))
+                      job.ok = False
+
+              self.results.put(job)
+
+    # main thread : a message was consumed (None when nothing came)
+    # the previous one is processed, unless a thread has it.
+    # jobs done meanwhile are completed here, without waiting : on a busy
+    # feed the consumer is never idle (wait) and acks would pile up behind them.
+
+    def consumed(self, raw_msg ):
+
+        if self.current != None and not self.current.submitted :
+           self.current.done = True
+
+        self.current = None
+
+        if raw_msg != None and not raw_msg.isRetry :
+           self.current = sr_worker_job(raw_msg)
+           self.order.append(self.current)
+
+        if self.inflight > 0 : self.wait(0)
+        else                 : self.release()
+
+    # main thread : hand the message to a thread, waits while too many are in flight,
+    # or while another job has the same key
+
+    def submit(self, raw_msg, msg, data=None, key=None ):
+
+        job = None
+        if self.current != None and self.current.raw_msg is raw_msg : job = self.current
+        else : job = sr_worker_job(raw_msg)
+
+        job.msg       = msg
+        job.data      = data
+        job.key       = key
+        job.submitted = True
+
+        while self.inflight >= self.inflight_max or (key != None and key in self.keys) :
+              self.wait(1)
+
+        if key != None : self.keys[key] = job
+        self.inflight += 1
+        self.dispatch(job)
+
+        return job
+
+    # to a thread
+
+    def dispatch(self, job ):
+        self.jobs.put(job)
+
+    # main thread : complete the jobs done, waiting up to timeout for one when none are
+
+    def wait(self, timeout=0 ):
+
+        if self.inflight == 0 :
+           if timeout > 0 : time.sleep(timeout)
+           return 0
+
+        count = 0
+        try :
+                job = self.results.get(timeout=timeout) if timeout > 0 else self.results.get_nowait()
+                while True :
+                      self.complete(job)
+                      count += 1
+                      job = self.results.get_nowait()
+        except queue.Empty : pass
+
+        self.release()
+
+        return count
+
+    def complete(self, job ):
+
+        self.inflight -= 1
+        if job.key != None and self.keys.get(job.key) is job : del self.keys[job.key]
+
+        try :
+                self.completed(job)
+        except:
+                (stype, svalue, tb) = sys.exc_info()
+                self.logger.error("sr_worker/complete Type: %s, Value: %s" % (stype, svalue))
+
+        job.done = True
+
+    # acknowledge, in order, the messages done with
+
+    def release(self):
+
+        while len(self.order) > 0 and self.order[0].done :
+              job = self.order.popleft()
+              try :
+                      self.ack(job.raw_msg)
+              except:
+                      (stype, svalue, tb) = sys.exc_info()
+                      self.logger.error("sr_worker/release Type: %s, Value: %s" % (stype, svalue))
+
+    # main thread : complete everything in flight, stop the threads
+
+    def close(self):
+
+        self.consumed(None)
+
+        while self.inflight > 0 : self.wait(1)
+
+        for thread in self.threads : self.jobs.put(None)
+        for thread in self.threads : thread.join()
+
+        self.threads = []
+
+# an event loop, in its own thread, runs the jobs accepted as coroutines
+
+class sr_worker_loop(sr_worker_pool):
+
+    def __init__(self, logger, views, inflight_max, task, completed, ack, coroutine, accepts ):
+
+        # coroutine : coroutine(job) on the loop, returns ok
+        # accepts   : accepts(job) in the main thread, True for a coroutine, False for a thread
+
+        sr_worker_pool.__init__(self, logger, views, inflight_max, task, completed, ack)
+
+        self.coroutine   = coroutine
+        self.accepts     = accepts
+
+        self.loop        = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever)
+        self.loop_thread.daemon = True
+        self.loop_thread.start()
+
+    def dispatch(self, job ):
+
+        if not self.accepts(job) :
+           sr_worker_pool.dispatch(self,job)
+           return
+
+        asyncio.run_coroutine_threadsafe(self.run(job), self.loop)
+
+    # on the loop
+
+    async def run(self, job ):
+
+        try :
+                job.ok = await self.coroutine(job)
+        except:
+                (stype, svalue, tb) = sys.exc_info()
+                self.logger.error("sr_worker/run Type: %s, Value: %s" % (stype, svalue))
+                job.ok = False
+
+        self.results.put(job)
+
+    def close(self):
+
+        sr_worker_pool.close(self)
+
+        if self.loop_thread == None : return
+
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
+        self.loop.close()
+
+        self.loop_thread = None
@@ -16,6 +16,8 @@ class checksum_0(sr_checksum):
       Trivial minimalist checksumming algorithm, returns 0 for any file.
       """
 
+      needs_data = False
+
       def get_value(self):
           return '%.4d' % random.randint(0,9999)
 
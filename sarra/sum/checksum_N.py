@@ -18,6 +18,8 @@ class checksum_N(sr_checksum):
       Still put a test below... Use with care
       """
 
+      needs_data = False
+
       def registered_as(self):
           return 'N'
 
@@ -16,6 +16,8 @@ class checksum_d(sr_checksum):
       The default algorithm is to do a checksum of the entire contents of the file, which is called 'd'.
       """
 
+      update_view = True
+
       def get_value(self):
           return self.filehash.hexdigest()
 
@@ -26,8 +28,8 @@ class checksum_d(sr_checksum):
           self.filehash = md5()
 
       def update(self,chunk):
-          if type(chunk) == bytes : self.filehash.update(chunk)
-          else                    : self.filehash.update(bytes(chunk,'utf-8'))
+          if type(chunk) == str : self.filehash.update(bytes(chunk,'utf-8'))
+          else                  : self.filehash.update(chunk)
 
 
 self.add_sumalgo=checksum_d()
@@ -19,6 +19,8 @@ class checksum_n(sr_checksum):
       product, which is generally the same from all the processing chains.  
       """
 
+      needs_data = False
+
       def registered_as(self):
           return 'n'
 
@@ -251,7 +251,7 @@ nbr_fail=0
 
 count_of_checks=$((${count_of_checks}+1))
 
-for t in sr_util sr_credentials sr_config sr_cache sr_retry sr_consumer sr_http sr_sftp sr_instances sr_pattern_match; do
+for t in sr_util sr_credentials sr_config sr_cache sr_retry sr_amqp sr_consumer sr_http sr_sftp sr_instances sr_pattern_match sr_worker sr_async_http sr_file sr_bandwidth sr_http_pool; do
     echo "======= Testing :"${t}  >>  ${testdocroot}/unit_tests.log
     nbr_test=$(( ${nbr_test}+1 ))
       ${TESTDIR}/unit_tests/${t}_unit_test.py >> ${testdocroot}/unit_tests.log 2>&1
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+try    :
+         from sr_bandwidth      import *
+         from sr_util           import *
+except :
+         from sarra.sr_bandwidth import *
+         from sarra.sr_util     import *
+
+import io, multiprocessing, shutil, tempfile
+
+# ===================================
+# self_test
+# ===================================
+
+class test_logger:
+      def silence(self,str):
+          pass
+      def __init__(self):
+          self.debug   = self.silence
+          self.error   = print
+          self.info    = self.silence
+          self.warning = print
+
+class parent_stub:
+      def __init__(self,cache_dir,kbytes_ps,kbytes_ps_destination=0,kbytes_burst=0):
+          self.logger                = test_logger()
+          self.user_cache_dir        = cache_dir
+          self.bufsize               = 10240
+          self.kbytes_ps             = kbytes_ps
+          self.kbytes_ps_destination = kbytes_ps_destination
+          self.kbytes_burst          = kbytes_burst
+          self.timeout               = 0
+          self.destination           = 'sftp://user@dest1.example.com/'
+
+# an instance : its own buckets object on the file, 250 KB in chunks of 10 KB
+
+def instance(bucket_file):
+    bw = sr_bandwidth(test_logger(), 500, 0, 50, bucket_file)
+    for i in range(25) :
+        time.sleep(bw.reserve(10240))
+    bw.close()
+
+def self_test():
+
+    failed = False
+
+    tmpdir = tempfile.mkdtemp()
+    logger = test_logger()
+
+    # process' buckets : the burst goes at once, then the rate
+
+    bw = sr_bandwidth(logger, 100)
+    w1 = bw.reserve(100*1024)
+    w2 = bw.reserve(50*1024)
+
+    if w1 != 0 or not 0.45 < w2 <= 0.5 or bw.waits != 1 :
+       print("test 01: sr_bandwidth reserve waits %f %f" % (w1,w2))
+       failed = True
+
+    # buckets per destination, the configuration's not limited
+
+    bw = sr_bandwidth(logger, 0, 100, 0, tmpdir + os.sep + 'dest.buckets')
+    w  = [ bw.reserve(100*1024, 'http://dest1.example.com/'), bw.reserve(100*1024, 'ftp://dest2.example.com:2121/'), \
+           bw.reserve(50*1024, 'https://dest1.example.com/other/path'), bw.reserve(50*1024) ]
+
+    if w[0] != 0 or w[1] != 0 or not 0.45 < w[2] <= 0.5 or w[3] != 0 :
+       print("test 02: sr_bandwidth per destination waits %s" % w)
+       failed = True
+
+    # more destinations than slots : the one idle the longest is taken
+
+    for i in range(sr_bandwidth.SLOTS + 10) :
+        bw.reserve(1, 'host%d' % i)
+
+    index = bw.slot(bw.key('dest1.example.com'), time.monotonic())
+    skey, tokens, last = bw.SLOT.unpack_from(bw.buf, 16 + index * 32)
+    if skey == bw.key('dest1.example.com') or last == 0 :
+       print("test 03: sr_bandwidth slot reused %d" % index)
+       failed = True
+    bw.close()
+
+    # the bucket file shared by the instances of a configuration
+
+    bucket_file = tmpdir + os.sep + 'bandwidth.buckets'
+    start = time.time()
+    procs = [ multiprocessing.Process(target=instance, args=(bucket_file,)) for i in range(3) ]
+    for p in procs : p.start()
+    for p in procs : p.join()
+    elapse = time.time() - start
+
+    # 750 KB, 50 KB burst, at 500 KB/s : 1.4 sec (each alone 0.4)
+
+    if not 1.2 < elapse < 2.5 :
+       print("test 04: sr_bandwidth 3 instances sharing a bucket in %f sec" % elapse)
+       failed = True
+
+    # sr_bandwidth_open : one per configuration in a process, none without limits
+
+    parent = parent_stub(tmpdir, 100)
+    if sr_bandwidth_open(parent) != sr_bandwidth_open(parent_stub(tmpdir, 100)) or \
+       sr_bandwidth_open(parent_stub(tmpdir, 0)) != None :
+       print("test 05: sr_bandwidth_open")
+       failed = True
+
+    # sr_proto throttle : small files limited together (per file, none would wait)
+
+    data  = os.urandom(20*1024)
+    proto = sr_proto(parent_stub(tmpdir, 100, 0, 20))
+    start = time.time()
+    for i in range(10) :
+        proto.read_writelocal('src', io.BytesIO(data), tmpdir + os.sep + 'dst')
+    elapse = time.time() - start
+
+    # 200 KB, 20 KB burst, at 100 KB/s : 1.8 sec
+
+    if not 1.6 < elapse < 2.5 or open(tmpdir + os.sep + 'dst','rb').read() != data :
+       print("test 06: sr_proto throttle 10 small files in %f sec" % elapse)
+       failed = True
+
+    shutil.rmtree(tmpdir)
+
+    if not failed :
+                    print("sr_bandwidth.py TEST PASSED")
+    else :
+                    print("sr_bandwidth.py TEST FAILED")
+                    sys.exit(1)
+
+# ===================================
+# MAIN
+# ===================================
+
+def main():
+
+    try:    self_test()
+    except:
+            (stype, svalue, tb) = sys.exc_info()
+            print("%s, Value: %s" % (stype, svalue))
+            print("sr_bandwidth.py TEST FAILED")
+            sys.exit(1)
+
+    sys.exit(0)
+
+# =========================================
+# direct invocation : self testing
+# =========================================
+
+if __name__=="__main__":
+   main()
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-import tempfile
+import multiprocessing, tempfile
 
 try :
          from sr_cache        import *
@@ -22,6 +22,45 @@ class test_logger:
           self.info    = self.silence
           self.warning = print
 
+# a configuration with caching 1 and the given cache options
+
+def test_config(logger, **options):
+    cfg        = sr_config(config=None,args=['test','--debug','False'])
+    cfg.logger = logger
+    cfg.config_name = "test"
+    cfg.debug  = False
+    cfg.defaults()
+    cfg.debug  = False
+    cfg.general()
+    cfg.option( "caching 1".split() )
+    for option, value in options.items() : setattr(cfg,option,value)
+    return cfg
+
+# an instance checking the same sums as the others in a shared sqlite cache
+
+def sqlite_instance(dbpath, n, results):
+    cache = sr_cache_sqlite(test_config(test_logger()))
+    cache.open(dbpath)
+    new   = 0
+    for i in range(n) :
+        if cache.check('key%d'%i,'file%d'%i,'part%d'%i) : new += 1
+    cache.close()
+    results.put(new)
+
+# an instance journaling 25 new entries in groups of 10, crashing in the
+# middle of a write : the last 5 are still pending, a torn record ends the file
+
+def journal_instance(path, cache_format, sync):
+    cache = sr_cache(test_config(test_logger(),caching=60,cache_format=cache_format,cache_journal=True, \
+                     cache_journal_batch=10,cache_journal_interval=3600,cache_journal_sync=sync))
+    cache.open(path)
+    for i in range(25) : cache.check('key%d'%i,'file%d'%i,'part%d'%i)
+
+    with open(path,'ab') as f :
+         if cache_format == 'binary' : f.write(BLOCK.pack(3,60) + b'key25\0file25')
+         else                        : f.write(b'key25 1500000000.000000 fil')
+    os._exit(0)
+
 def self_test():
 
     failed = False
@@ -129,8 +168,10 @@ def self_test():
     # delete one
     cache.delete_path('file8')
 
-    if len(cache.cache_dict) != 9 :
-       logger.error("test 06: expecting 9 entries...got %d" % len(cache.cache_dict))
+    # entries are (sum,path,part) : 9 sums left, 4 parts each
+    nsums = len(set([ entry[0] for entry in cache.cache_dict ]))
+    if nsums != 9 or len(cache.cache_dict) != 36 :
+       logger.error("test 06: expecting 9 sums in 36 entries...got %d in %d" % (nsums,len(cache.cache_dict)))
        failed = True
 
     # expire and clean
@@ -158,6 +199,290 @@ def self_test():
        logger.error("test 10: cache file should have been deleted")
        failed = True
 
+    # least recently referenced first : a refresh moves the entry to the end
+
+    cache = sr_cache(test_config(logger))
+    cache.open(tmppath)
+    cache.check('keyA','fileA','partA')
+    cache.check('keyB','fileB','partB')
+    time.sleep(0.6)
+    cache.check('keyA','fileA','partA')
+    cache.check('keyC','fileC','partC')
+
+    order = [ entry[0] for entry in cache.cache_dict ]
+    times = list(cache.cache_dict.values())
+    if order != [ 'keyB', 'keyA', 'keyC' ] or times != sorted(times) :
+       logger.error("test 11: expecting keyB keyA keyC in time order...got %s" % order)
+       failed = True
+
+    # clean after the refresh : only keyB expired, the refreshed keyA is kept
+
+    time.sleep(0.6)
+    cache.clean()
+    order = [ entry[0] for entry in cache.cache_dict ]
+    if order != [ 'keyA', 'keyC' ] or cache.expired != 1 or cache.count != 2 :
+       logger.error("test 12: expecting keyA keyC, 1 expired...got %s, %d expired" % (order,cache.expired))
+       failed = True
+
+    cache.close(unlink=True)
+
+    # text cache converted to cache_format binary when loaded
+
+    cache = sr_cache(test_config(logger))
+    cache.open(tmppath)
+    for i in range(3) : cache.check('key%d'%i,'dir %d/file%d'%(i,i),'part%d'%i)
+    text_times = dict(cache.cache_dict)
+    cache.close()
+
+    cache = sr_cache(test_config(logger,cache_format='binary'))
+    cache.open(tmppath)
+    magic = open(tmppath,'rb').read(len(MAGIC))
+    same  = list(cache.cache_dict) == list(text_times) and \
+            all([ abs(cache.cache_dict[e] - t) < 1e-5 for e,t in text_times.items() ])
+    if magic != MAGIC or not same :
+       logger.error("test 13: expecting text cache converted to binary...got %s, %d entries" % (magic,len(cache.cache_dict)))
+       failed = True
+
+    # binary cache reloaded : same entries, same times (spaces in paths kept)
+
+    cache.check('key3','dir 3/file3','part3')
+    binary_times = dict(cache.cache_dict)
+    cache.close()
+
+    cache = sr_cache(test_config(logger,cache_format='binary'))
+    cache.open(tmppath)
+    if dict(cache.cache_dict) != binary_times :
+       logger.error("test 14: expecting 4 entries reloaded from binary...got %d" % len(cache.cache_dict))
+       failed = True
+    cache.close()
+
+    # partially written block at the end : dropped on load, appends stay readable
+
+    size = os.stat(tmppath).st_size
+    with open(tmppath,'ab') as f : f.write(BLOCK.pack(5,200) + b'\0' * 30)
+
+    quiet       = test_logger()
+    quiet.error = quiet.silence
+
+    cache = sr_cache(test_config(quiet,cache_format='binary'))
+    cache.open(tmppath)
+    truncated = os.stat(tmppath).st_size == size
+    cache.check('key4','dir 4/file4','part4')
+    cache.close()
+
+    cache = sr_cache(test_config(logger,cache_format='binary'))
+    cache.open(tmppath)
+    if not truncated or len(cache.cache_dict) != 5 :
+       logger.error("test 15: expecting truncated block dropped, 5 entries...got %s, %d" % (truncated,len(cache.cache_dict)))
+       failed = True
+
+    # and converted back to text
+
+    cache.close()
+    cache.convert(tmppath,'text')
+    cache = sr_cache(test_config(logger))
+    cache.open(tmppath)
+    if open(tmppath,'rb').read(len(MAGIC)) == MAGIC or len(cache.cache_dict) != 5 :
+       logger.error("test 16: expecting binary cache converted to text...got %d entries" % len(cache.cache_dict))
+       failed = True
+    cache.close(unlink=True)
+
+    # cache_max_entries : the least recently referenced entries are evicted
+
+    cache = sr_cache(test_config(logger,cache_max_entries=5))
+    cache.open(tmppath)
+    for i in range(8) : cache.check('key%d'%i,'file%d'%i,'part%d'%i)
+    cache.check('key3','file3','part3')
+    cache.check('key8','file8','part8')
+
+    keys = [ entry[0] for entry in cache.cache_dict ]
+    if keys != [ 'key5', 'key6', 'key7', 'key3', 'key8' ] or cache.evicted != 4 or cache.expired != 0 :
+       logger.error("test 17: cache_max_entries expecting key5-7 key3 key8, 4 evicted...got %s, %d evicted" % (keys,cache.evicted))
+       failed = True
+
+    # a reload with a lower limit keeps the most recent entries
+    # (evicted entries stay in the file until it is saved : 9 loaded)
+
+    cache.close()
+    cache = sr_cache(test_config(logger,cache_max_entries=2))
+    cache.open(tmppath)
+    keys = [ entry[0] for entry in cache.cache_dict ]
+    if keys != [ 'key3', 'key8' ] or cache.evicted != 7 :
+       logger.error("test 18: cache_max_entries on load expecting key3 key8, 7 evicted...got %s, %d evicted" % (keys,cache.evicted))
+       failed = True
+    cache.close(unlink=True)
+
+    # cache_max_bytes : the estimated size stays under the limit
+
+    entry_bytes = len('key0') + len('file0') + len('part0') + ENTRY_OVERHEAD
+    cache = sr_cache(test_config(logger,cache_max_bytes=3*entry_bytes))
+    cache.open(tmppath)
+    for i in range(10) : cache.check('key%d'%i,'file%d'%i,'part%d'%i)
+
+    keys  = [ entry[0] for entry in cache.cache_dict ]
+    total = sum([ cache.entry_size(entry) for entry in cache.cache_dict ])
+    if keys != [ 'key7', 'key8', 'key9' ] or cache.bytes != total or cache.bytes > 3*entry_bytes or cache.evicted != 7 :
+       logger.error("test 19: cache_max_bytes expecting key7-9, %d bytes, 7 evicted...got %s, %d bytes, %d evicted" % \
+                   (3*entry_bytes,keys,cache.bytes,cache.evicted))
+       failed = True
+
+    # expired and evicted counted apart : keyN evicts key7, key8 and key9 expire
+
+    time.sleep(1.1)
+    cache.check('keyN','fileN','partN')
+    cache.clean()
+    if cache.expired != 2 or cache.evicted != 8 or len(cache.cache_dict) != 1 or cache.bytes != entry_bytes :
+       logger.error("test 20: expecting 2 expired, 8 evicted, 1 entry...got %d, %d, %d" % \
+                   (cache.expired,cache.evicted,len(cache.cache_dict)))
+       failed = True
+    cache.close(unlink=True)
+
+    # cache_backend sqlite : check, refresh, expire
+
+    dbpath = tmpdirname + os.sep + 'recent_files.db'
+
+    if type(sr_cache_create(test_config(logger))) != sr_cache :
+       logger.error("test 21: cache_backend file expecting sr_cache")
+       failed = True
+
+    cache  = sr_cache_create(test_config(logger, cache_backend='sqlite'))
+    if type(cache) != sr_cache_sqlite :
+       logger.error("test 21: cache_backend sqlite expecting sr_cache_sqlite...got %s" % type(cache))
+       failed = True
+
+    cache.open(dbpath)
+    new = [ cache.check('key1','file1','part1'), cache.check('key1','file1','part1'), \
+            cache.check('key1','file1','part2'), cache.check('key2','file2','part2') ]
+    if new != [ True, False, True, True ] or cache.count != 3 :
+       logger.error("test 21: sqlite expecting new, dup, new, new...got %s, %d" % (new,cache.count))
+       failed = True
+
+    time.sleep(0.6)
+    cache.check('key1','file1','part1')
+    time.sleep(0.6)
+
+    # an expired entry not yet cleaned is new again, the refreshed one is not
+
+    new = [ cache.check('key2','file2','part2'), cache.check('key1','file1','part1') ]
+    cache.save()
+    if new != [ True, False ] or cache.expired != 1 or cache.count != 2 :
+       logger.error("test 22: sqlite expecting expired new, refreshed dup, 1 expired...got %s, %d expired" % (new,cache.expired))
+       failed = True
+
+    # delete_path, reopen
+
+    cache.delete_path('file1')
+    cache.close()
+    cache  = sr_cache_sqlite(test_config(logger))
+    cache.open(dbpath)
+    if cache.count != 1 or not cache.check('key1','file1','part1') or cache.check('key2','file2','part2') :
+       logger.error("test 23: sqlite expecting 1 entry left after delete_path...got %d" % cache.count)
+       failed = True
+    cache.close(unlink=True)
+
+    # instances sharing the db : each sum reported new by exactly one of them
+
+    results = multiprocessing.Queue()
+    procs   = [ multiprocessing.Process(target=sqlite_instance, args=(dbpath,500,results)) for i in range(4) ]
+    for p in procs : p.start()
+    new     = sum([ results.get(timeout=60) for p in procs ])
+    for p in procs : p.join()
+
+    if new != 500 :
+       logger.error("test 24: sqlite 4 instances expecting 500 new...got %d" % new)
+       failed = True
+
+    cache  = sr_cache_sqlite(test_config(logger,cache_max_entries=100))
+    cache.open(dbpath)
+    if cache.count != 100 or cache.evicted != 400 or cache.check('key0','file0','part0') != True :
+       logger.error("test 25: sqlite cache_max_entries expecting 100 entries, 400 evicted...got %d, %d" % (cache.count,cache.evicted))
+       failed = True
+    cache.close(unlink=True)
+
+    # cache_journal crash recovery : the groups flushed (or synced) come back,
+    # the torn record is dropped, and entries appended later are read back
+
+    quiet       = test_logger()
+    quiet.error = quiet.silence
+
+    for cache_format in [ 'text', 'binary' ] :
+        for sync, flushed in [ ('none',0), ('flush',20), ('fsync',20) ] :
+            path = tmpdirname + os.sep + 'journal_%s_%s' % (cache_format,sync)
+
+            p = multiprocessing.Process(target=journal_instance, args=(path,cache_format,sync))
+            p.start()
+            p.join()
+
+            options = { 'caching':60, 'cache_format':cache_format, 'cache_journal':True }
+            cache   = sr_cache(test_config(quiet,**options))
+            cache.open(path)
+            keys    = sorted([ entry[0] for entry in cache.cache_dict ])
+            cache.check('key99','file99','part99')
+            cache.close()
+
+            cache   = sr_cache(test_config(quiet,**options))
+            cache.open(path)
+            if keys != sorted([ 'key%d'%i for i in range(flushed) ]) or len(cache.cache_dict) != flushed + 1 :
+               logger.error("test 26: cache_journal %s sync %s expecting %d entries recovered...got %d, %d after append" % \
+                           (cache_format,sync,flushed,len(keys),len(cache.cache_dict)))
+               failed = True
+            cache.close(unlink=True)
+
+    # cache_segments : a new segment every caching/cache_segments seconds,
+    # entries reloaded across segments, segments last written more than
+    # caching ago dropped whole (journal : a refreshed entry written again)
+
+    for journal in [ False, True ] :
+        options = { 'caching':2, 'cache_segments':4, 'cache_journal':journal }
+        start   = time.time()
+
+        cache = sr_cache(test_config(logger,**options))
+        cache.open(tmppath)
+        for i in range(3) : cache.check('key%d'%i,'file%d'%i,'part%d'%i)
+        time.sleep(0.5)
+        cache.save()
+        for i in range(3,5) : cache.check('key%d'%i,'file%d'%i,'part%d'%i)
+
+        segments = [ seq for seq,path in cache.segment_files() ]
+        if segments != [ 1, 2 ] or os.path.exists(tmppath) :
+           logger.error("test 27: cache_segments journal %s expecting segments 1 2...got %s" % (journal,segments))
+           failed = True
+
+        cache.close()
+        cache = sr_cache(test_config(logger,**options))
+        cache.open(tmppath)
+
+        segments = [ seq for seq,path in cache.segment_files() ]
+        if len(cache.cache_dict) != 5 or segments != [ 1, 2, 3 ] :
+           logger.error("test 28: cache_segments journal %s expecting 5 entries in segments 1 2 3...got %d in %s" % \
+                       (journal,len(cache.cache_dict),segments))
+           failed = True
+
+        time.sleep(max(0, start + 1.5 - time.time()))
+        cache.check('key0','file0','part0')
+        time.sleep(max(0, start + 2.7 - time.time()))
+        cache.save()
+
+        segments = [ seq for seq,path in cache.segment_files() ]
+        keys     = [ entry[0] for entry in cache.cache_dict ]
+        if keys != [ 'key0' ] or segments != [ 3, 4 ] :
+           logger.error("test 29: cache_segments journal %s expecting key0 in segments 3 4...got %s in %s" % (journal,keys,segments))
+           failed = True
+
+        cache.close()
+        cache = sr_cache(test_config(logger,**options))
+        cache.open(tmppath)
+
+        keys     = [ entry[0] for entry in cache.cache_dict ]
+        if keys != [ 'key0' ] :
+           logger.error("test 30: cache_segments journal %s expecting key0 reloaded...got %s" % (journal,keys))
+           failed = True
+        cache.close(unlink=True)
+
+        if cache.segment_files() :
+           logger.error("test 31: cache_segments journal %s expecting segments removed" % journal)
+           failed = True
+
     if not failed :
                     print("sr_cache.py TEST PASSED")
     else :          
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+try    :
+         from sr_config         import *
+         from sr_file           import *
+except :
+         from sarra.sr_config   import *
+         from sarra.sr_file     import *
+
+import errno, hashlib, shutil, tempfile
+
+# ===================================
+# self_test
+# ===================================
+
+class test_logger:
+      def silence(self,str):
+          pass
+      def __init__(self):
+          self.debug   = self.silence
+          self.error   = print
+          self.info    = self.silence
+          self.warning = self.silence
+
+def self_test():
+
+    failed = False
+
+    tmpdir = tempfile.mkdtemp()
+    data   = os.urandom(3 * 1024 * 1024 + 123)
+
+    src_path = tmpdir + os.sep + 'src'
+    dst_path = tmpdir + os.sep + 'dst'
+    with open(src_path,'wb') as f : f.write(data)
+
+    cfg = sr_config()
+    cfg.defaults()
+    cfg.load_sums()
+    cfg.logger = test_logger()
+
+    # which sums need the data
+
+    needs = []
+    for sumflg in [ '0', 'd', 's', 'n' ] :
+        cfg.set_sumalgo(sumflg)
+        needs.append(sum_needs_data(cfg.sumalgo))
+
+    # a plugin algorithm : from the data unless it says otherwise
+
+    try    : from sr_checksum       import sr_checksum
+    except : from sarra.sr_checksum import sr_checksum
+
+    class checksum_plugin(sr_checksum):
+          def update(self,chunk):
+              self.value = chunk
+
+    class checksum_plugin_name(checksum_plugin):
+          needs_data = False
+
+    needs.append(sum_needs_data(checksum_plugin()))
+    needs.append(sum_needs_data(checksum_plugin_name()))
+
+    if needs != [ False, True, True, False, True, False ] or sum_needs_data(None) :
+       print("test 01: sr_file sum_needs_data %s" % needs)
+       failed = True
+
+    # parts inserted in reverse order, at their offsets, kernel copy (no checksum)
+
+    with open(dst_path,'wb') as f : pass
+
+    part = 1024 * 1024
+    with open(src_path,'rb') as src, open(dst_path,'r+b') as dst :
+         for offset in [ 3*part, 2*part, part, 0 ] :
+             length = min(part,len(data)-offset)
+             src.seek(offset)
+             dst.seek(offset)
+             n = file_copy_range(src, dst, length, 8192)
+             if n != length or src.tell() != offset + length or dst.tell() != offset + length :
+                print("test 02: sr_file file_copy_range copied %d of %d, positions %d %d" % \
+                     (n,length,src.tell(),dst.tell()))
+                failed = True
+
+    if open(dst_path,'rb').read() != data :
+       print("test 03: sr_file file_copy_range parts inserted differ from the source")
+       failed = True
+
+    # with a checksum needing the data : same copy, same checksum
+
+    cfg.set_sumalgo('d')
+    chk = cfg.sumalgo
+    chk.set_path(src_path)
+
+    with open(src_path,'rb') as src, open(dst_path,'r+b') as dst :
+         src.seek(10)
+         dst.seek(20)
+         n = file_copy_range(src, dst, 1000000, 65536, chk)
+
+    if n != 1000000 or chk.get_value() != hashlib.md5(data[10:1000010]).hexdigest() or \
+       open(dst_path,'rb').read()[20:1000020] != data[10:1000010] :
+       print("test 04: sr_file file_copy_range with checksum, %d bytes" % n)
+       failed = True
+
+    # source shorter than announced : what there is, then the buffered loop ends it
+
+    with open(src_path,'rb') as src, open(dst_path,'r+b') as dst :
+         src.seek(len(data) - 100)
+         n = file_copy_range(src, dst, 1000, 8192)
+
+    if n != 100 :
+       print("test 05: sr_file file_copy_range past the end of the source copied %d" % n)
+       failed = True
+
+    # copy_file_range refused (another file system, old kernel) : sendfile does it
+
+    def refused(*args) :
+        raise OSError(errno.EXDEV,'Invalid cross-device link')
+
+    copy_file_range = getattr(os,'copy_file_range',None)
+    os.copy_file_range = refused
+
+    with open(dst_path,'wb') as f : pass
+    with open(src_path,'rb') as src, open(dst_path,'r+b') as dst :
+         src.seek(part)
+         dst.seek(part)
+         n = file_copy_range(src, dst, part, 8192)
+
+    if copy_file_range : os.copy_file_range = copy_file_range
+    else               : del os.copy_file_range
+
+    if n != part or open(dst_path,'rb').read()[part:] != data[part:2*part] :
+       print("test 06: sr_file file_copy_range through sendfile copied %d" % n)
+       failed = True
+
+    # file_write_length (file_insert) : whole file, written through the kernel copy
+
+    cfg.set_sumalgo('0')
+
+    class msg_stub:
+          pass
+
+    msg = msg_stub()
+    msg.logger         = cfg.logger
+    msg.sumalgo        = None
+    msg.new_file       = tmpdir + os.sep + 'inserted'
+    msg.local_offset   = 0
+    msg.length         = len(data)
+    msg.filesize       = len(data)
+    msg.headers        = {}
+    msg.codes          = []
+    msg.report_publish = lambda code, message : msg.codes.append(code)
+
+    cfg.msg            = msg
+    cfg.preserve_mode  = False
+    cfg.preserve_time  = False
+
+    with open(src_path,'rb') as src :
+         ok = file_write_length(src, msg, cfg.bufsize, msg.filesize, cfg)
+
+    if not ok or msg.codes != [ 201 ] or open(msg.new_file,'rb').read() != data :
+       print("test 07: sr_file file_write_length %s %s" % (ok,msg.codes))
+       failed = True
+
+    shutil.rmtree(tmpdir)
+
+    if not failed :
+                    print("sr_file.py TEST PASSED")
+    else :
+                    print("sr_file.py TEST FAILED")
+                    sys.exit(1)
+
+# ===================================
+# MAIN
+# ===================================
+
+def main():
+
+    try:    self_test()
+    except:
+            (stype, svalue, tb) = sys.exc_info()
+            print("%s, Value: %s" % (stype, svalue))
+            print("sr_file.py TEST FAILED")
+            sys.exit(1)
+
+    sys.exit(0)
+
+# =========================================
+# direct invocation : self testing
+# =========================================
+
+if __name__=="__main__":
+   main()
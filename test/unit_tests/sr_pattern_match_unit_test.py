@@ -64,6 +64,83 @@ def self_test():
         print("Pass\n")
 
 
+    # compiled accept/reject masks (sr_masks) : same mask as trying each in turn
+
+    print('Testing compiled accept/reject masks')
+
+    def each_mask(masks,chaine):
+        for i,mask in enumerate(masks):
+            if mask[3].match(chaine) : return i
+        return -1
+
+    urls = [ 'http://host/20180101/bulletins/SACN43_CWAO_%d.txt' % i for i in range(20) ] + \
+           [ 'http://host/radar/CAPPI/%d/WKR_%d.gif' % (i,i) for i in range(20) ] + \
+           [ 'sftp://host/a+b/c(d)/x.xml', 'http://host/', 'http://host/aaa/xx', 'http://host/abab' ]
+
+    configs = [
+      # keyed masks (literal prefilter)
+      [ '.*/SACN4[0-9]_CWAO.*', '.*/radar/CAPPI/1.*', '.*/radar/.*WKR_1[0-9]\\.gif', '.*a\\+b/c\\(d\\).*', '.*' ],
+      # masks without literal (alternation), some that cannot be joined
+      [ '.*[0-9]\\.txt', '(?P<d>[a-z]+)://host/.*', '.*/(a)\\1a.*', '.*x+', '.*(ab)+$', '.*\\x41.*', '(?i).*GIF' ],
+      # top level alternations, optional and repeated characters
+      [ 'http://host/rad|.*CAPPI/3/.*', '.*/SACN43?_CWAO_1.*', '.*/a+b/.*', '.*ttp://host/2018.*', 'x{0}.*xml' ],
+    ]
+
+    for patterns in configs :
+        masks = [ (p,'/tmp',None,re.compile(p),i % 2 == 0,False,False,False,False) for i,p in enumerate(patterns) ]
+        for chunk in [ 2, 256 ] :
+            compiled = sr_masks(masks,chunk)
+            for url in urls :
+                if compiled.match(url) != each_mask(masks,url) :
+                   print('test: %s mask %d, expected %d' % (url,compiled.match(url),each_mask(masks,url)))
+                   failed = True
+
+    # isMatchingPattern keeps its attributes : matching mask, or the last one
+
+    cfg.defaults()
+    cfg.option( [ 'directory', '/tmp/a' ] )
+    cfg.option( [ 'accept', '.*a.*' ] )
+    cfg.option( [ 'directory', '/tmp/b' ] )
+    cfg.option( [ 'reject', '.*b.*' ] )
+
+    if not cfg.isMatchingPattern('xa') or cfg.currentDir != '/tmp/a' or \
+       cfg.isMatchingPattern('xb')     or cfg.currentDir != '/tmp/b' or \
+       not cfg.isMatchingPattern('xc',True) or cfg.currentDir != '/tmp/b' :
+       print('test: isMatchingPattern with compiled masks')
+       failed = True
+
+    cfg.option( [ 'accept', '.*c.*' ] )
+    if cfg.isMatchingPattern('xc') != True :
+       print('test: isMatchingPattern, masks added after compiling')
+       failed = True
+
+    # mask_cache : directory keyed when masks allow, least recently used evicted
+
+    dirmasks = [ '.*/radar/.*', '.*/bulletins/', '.*' ]
+    masks    = [ (p,'/tmp',None,re.compile(p),i % 2 == 0,False,False,False,False) for i,p in enumerate(dirmasks) ]
+    cached   = sr_masks(masks,cache=2)
+
+    for url in urls + urls :
+        if cached.lookup(url) != each_mask(masks,url) :
+           print('test: mask_cache %s mask %d, expected %d' % (url,cached.lookup(url),each_mask(masks,url)))
+           failed = True
+
+    # 24 directories (20 in radar) twice : only the 19 other bulletins and http://host/abab hit
+
+    if not cached.directory_only or cached.misses != 48 or len(cached.cache) != 2 or cached.evicted != 46 :
+       print('test: mask_cache on directories, %d hits %d misses %d evicted' % (cached.hits,cached.misses,cached.evicted))
+       failed = True
+
+    masks  = [ (p,'/tmp',None,re.compile(p),True,False,False,False,False) for p in [ '.*/radar/.*gif', '.*' ] ]
+    cached = sr_masks(masks,cache=1000)
+    for url in urls + urls : cached.lookup(url)
+
+    if cached.directory_only or cached.hits != len(urls) or cached.misses != len(urls) :
+       print('test: mask_cache on urls, %d hits %d misses' % (cached.hits,cached.misses))
+       failed = True
+
+    if not failed :
+        print("Pass\n")
 
     if not failed :
         print("sr_pattern_test.py TEST PASSED")
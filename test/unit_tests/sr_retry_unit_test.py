@@ -364,6 +364,294 @@ def test_retry_ctrl_c(retry,message):
        retry.logger.error("test 17: ctrl_c retry_path completely read, should have been deleted")
        failed = True
 
+# sqlite backend : import of retry files
+def test_retry_sqlite_migrate(retry,message):
+    global failed
+
+    # 10 messages in retry file, 2 of them done in state, 1 new
+
+    fp = None
+    i  = 0
+    while i < 10 :
+          message.body = '%s xyz://user@host /my/sqlite/path%.10d' % (timeflt2str(time.time()),i)
+          message.properties['application_headers']['sum'] = message.body
+          fp = retry.msg_append_to_file(fp,retry.retry_path,message)
+          if i < 2 : retry.add_msg_to_state_file(message,done=True)
+          try   : del message.properties['application_headers']['_retry_tag_']
+          except: pass
+          i = i + 1
+    fp.close()
+
+    message.body = '%s xyz://user@host /my/sqlite/path%.10d' % (timeflt2str(time.time()),i)
+    message.properties['application_headers']['sum'] = message.body
+    retry.add_msg_to_new_file(message)
+    retry.close()
+
+    sqlite_retry = sr_retry_sqlite(retry.parent)
+    sqlite_retry.on_heartbeat(retry.parent)
+
+    t = 0
+    while sqlite_retry.get() : t = t + 1
+
+    if t != 9 :
+       retry.logger.error("test 18: sqlite migrate expected 9 messages (%d)" % t)
+       failed = True
+
+    for path in [ retry.retry_path, retry.state_path, retry.new_path ] :
+        if os.path.isfile(path) :
+           retry.logger.error("test 19: sqlite migrate %s should have been deleted" % path)
+           failed = True
+
+    sqlite_retry.cleanup()
+
+# sqlite backend : same as overall case
+def test_retry_sqlite_overall(retry,message):
+    global failed
+
+    # 10 messages to retry ... half fails ... and every 4 messages processed one new added
+
+    msg_count = 0 
+    while msg_count < 10 :
+          message.body = '%s xyz://user@host /my/terrible/path%.10d' % (timeflt2str(time.time()),msg_count)
+          message.properties['application_headers']['sum'] = message.body
+          retry.add_msg_to_new_file(message)
+          msg_count = msg_count + 1
+
+    retry.on_heartbeat(retry.parent)
+
+    i       = 0
+    h_done  = 1 # heartbeat done
+    h_count = 0 # heartbeat count
+    d_count = 0 # done      count
+    f_count = 0 # failed    count
+    while True :
+          msg = retry.get()
+
+          # heartbeat or done
+          if not msg :
+             if h_done : break
+             retry.on_heartbeat(retry.parent)
+             h_count = h_count + 1
+             h_done  = 1
+             continue
+          h_done = 0
+
+          # processing another message
+          i = i+1
+
+          # success or fail
+          r = i%2
+          if r == 1 :
+             retry.add_msg_to_state_file(msg)
+             f_count = f_count + 1
+          else :
+             retry.add_msg_to_state_file(msg,done=True)
+             d_count = d_count + 1
+
+          # every 4 success add a new retry
+          r = i % 4
+          if r == 0 :
+             message.body = '%s xyz://user@host /my/terrible/path%.10d' % (timeflt2str(time.time()),msg_count)
+             message.properties['application_headers']['sum'] = message.body
+             retry.add_msg_to_new_file(message)
+             msg_count = msg_count + 1
+
+    if msg_count != d_count :
+       retry.logger.error("test 20: sqlite overall count failed msg_count %d  done_count %d ( failed %d, heartb %d)" % \
+       (msg_count,d_count,f_count,h_count))
+       failed = True
+
+    retry.cleanup()
+
+    if os.path.isfile(retry.db_path) :
+       retry.logger.error("test 21: sqlite cleanup, database should have been deleted")
+       failed = True
+
+# sqlite backend : retries left by a previous run, retried before any heartbeat
+def test_retry_sqlite_restart(retry,message):
+    global failed
+
+    i = 0
+    while i < 5 :
+          message.body = '%s xyz://user@host /my/restart/path%.10d' % (timeflt2str(time.time()),i)
+          message.properties['application_headers']['sum'] = message.body
+          retry.add_msg_to_new_file(message)
+          i = i + 1
+    retry.close()
+
+    retry = sr_retry_sqlite(retry.parent)
+    retry.on_start(retry.parent)
+
+    t = 0
+    while True :
+          msg = retry.get()
+          if not msg : break
+          t = t + 1
+          retry.add_msg_to_state_file(msg,done=True)
+
+    if t != 5 :
+       retry.logger.error("test 24: sqlite restart expected 5 messages before the heartbeat (%d)" % t)
+       failed = True
+
+    retry.cleanup()
+
+# per destination backoff : a failing destination does not hold the others
+def test_retry_backoff(retry,message):
+    global failed
+
+    # 10 messages, half from a failing server
+
+    i = 0
+    while i < 10 :
+          host = [ 'good', 'bad' ][i%2]
+          message.body = '%s xyz://user@%s /my/backoff/path%.10d' % (timeflt2str(time.time()),host,i)
+          message.properties['application_headers']['sum'] = message.body
+          retry.add_msg_to_new_file(message)
+          if host == 'bad' and not retry.backoff : retry.dest_failed(message)
+          i = i + 1
+
+    retry.on_heartbeat(retry.parent)
+
+    hosts = []
+    while True :
+          msg = retry.get()
+          if not msg : break
+          hosts.append(msg.body.split()[1])
+          retry.add_msg_to_state_file(msg,done=True)
+
+    if hosts != [ 'xyz://user@good' ] * 5 :
+       retry.logger.error("test 22: backoff expected only good server retries (%s)" % hosts)
+       failed = True
+
+    # once eligible, the failing server messages come back
+
+    retry.backoff['xyz://user@bad'][1] = time.time()
+    retry.on_heartbeat(retry.parent)
+
+    t = 0
+    while True :
+          msg = retry.get()
+          if not msg : break
+          t = t + 1
+          retry.dest_worked(msg)
+          retry.add_msg_to_state_file(msg,done=True)
+
+    if t != 5 or retry.backoff :
+       retry.logger.error("test 23: backoff expected 5 bad server retries (%d) and no backoff (%s)" % (t,retry.backoff))
+       failed = True
+
+    retry.cleanup()
+
+# per destination backoff : held messages come back once eligible, without a heartbeat
+def test_retry_backoff_release(retry,message):
+    global failed
+
+    i = 0
+    while i < 6 :
+          host = [ 'good', 'bad' ][i%2]
+          message.body = '%s xyz://user@%s /my/release/path%.10d' % (timeflt2str(time.time()),host,i)
+          message.properties['application_headers']['sum'] = message.body
+          retry.add_msg_to_new_file(message)
+          i = i + 1
+
+    retry.on_heartbeat(retry.parent)
+    retry.backoff['xyz://user@bad'] = [ 1, time.time() + 0.5 ]
+
+    hosts = []
+    while True :
+          msg = retry.get()
+          if not msg : break
+          hosts.append(msg.body.split()[1])
+          retry.add_msg_to_state_file(msg,done=True)
+
+    time.sleep(0.6)
+
+    while True :
+          msg = retry.get()
+          if not msg : break
+          hosts.append(msg.body.split()[1])
+          retry.dest_worked(msg)
+          retry.add_msg_to_state_file(msg,done=True)
+
+    if hosts != [ 'xyz://user@good' ] * 3 + [ 'xyz://user@bad' ] * 3 :
+       retry.logger.error("test 25: backoff expected good then bad server retries, no heartbeat (%s)" % hosts)
+       failed = True
+
+    # nothing left at the heartbeat : the held messages were retried
+
+    retry.on_heartbeat(retry.parent)
+    if retry.get() :
+       retry.logger.error("test 26: backoff held messages retried twice")
+       failed = True
+
+    retry.cleanup()
+
+# per destination backoff : keyed on the message server, whatever host was downloaded last
+def test_retry_backoff_download(retry,message):
+    global failed
+
+    parent = retry.parent
+
+    i = 0
+    while i < 6 :
+          host = [ 'good', 'bad' ][i%2]
+          message.body = '%s xyz://user@%s /my/download/path%.10d' % (timeflt2str(time.time()),host,i)
+          message.properties['application_headers']['sum'] = message.body
+          # as sr_transport.download does
+          parent.destination = message.body.split()[1]
+          if host == 'bad' :
+             retry.dest_failed(message)
+             retry.add_msg_to_new_file(message)
+          i = i + 1
+
+    i = 0
+    while i < 6 :
+          host = [ 'good', 'bad' ][i%2]
+          message.body = '%s xyz://user@%s /my/download/retry%.10d' % (timeflt2str(time.time()),host,i)
+          message.properties['application_headers']['sum'] = message.body
+          retry.add_msg_to_new_file(message)
+          i = i + 1
+
+    retry.on_heartbeat(retry.parent)
+
+    if isinstance(retry,sr_retry_sqlite) :
+       dests = sorted([ row[0] for row in retry.db.execute('SELECT DISTINCT dest FROM retry') ])
+       if dests != [ 'xyz://user@bad', 'xyz://user@good' ] :
+          retry.logger.error("test 28: sqlite dest column expected each message server (%s)" % dests)
+          failed = True
+
+    # the last download was from the failing server : the good server still retried
+
+    hosts = []
+    while True :
+          msg = retry.get()
+          if not msg : break
+          hosts.append(msg.body.split()[1])
+          retry.add_msg_to_state_file(msg,done=True)
+
+    if hosts != [ 'xyz://user@good' ] * 3 or list(retry.backoff) != [ 'xyz://user@bad' ] :
+       retry.logger.error("test 27: backoff after downloads expected good server retries (%s) %s" % \
+                         (hosts,list(retry.backoff)))
+       failed = True
+
+    retry.cleanup()
+    parent.destination = None
+
+    # sender : the configured destination, not what parent.destination became
+
+    parent.program_name = 'sr_sender'
+    parent.destination  = 'sftp://user@target'
+    sender = sr_retry(parent)
+    parent.destination  = 'xyz://user@good'
+
+    if sender.msg_dest(message) != 'sftp://user@target' :
+       retry.logger.error("test 29: sender backoff expected its destination (%s)" % sender.msg_dest(message))
+       failed = True
+
+    sender.cleanup()
+    parent.program_name = 'sr_retry_unit_test'
+    parent.destination  = None
+
 def self_test():
 
     retry_path = '/tmp/retry'
@@ -430,6 +718,21 @@ def self_test():
     # test close
 
     retry.close()
+
+    # test sqlite backend
+
+    test_retry_sqlite_migrate(retry,message)
+    test_retry_sqlite_overall(sr_retry_sqlite(cfg),message)
+    test_retry_sqlite_restart(sr_retry_sqlite(cfg),message)
+
+    # test per destination backoff
+
+    test_retry_backoff(sr_retry(cfg),message)
+    test_retry_backoff(sr_retry_sqlite(cfg),message)
+    test_retry_backoff_release(sr_retry(cfg),message)
+    test_retry_backoff_release(sr_retry_sqlite(cfg),message)
+    test_retry_backoff_download(sr_retry(cfg),message)
+    test_retry_backoff_download(sr_retry_sqlite(cfg),message)
     e = time.time() - now
 
     # performance test
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-import tempfile
+import io, shutil, socket, tempfile
 
 try :
          from sr_util         import *
@@ -123,10 +123,172 @@ def self_test():
 
     if status == 4 : print("test 14: alarm_cancel 2 NOT OK")
 
+    # ===================================
+    # TESTING sr_proto read_write
+    # ===================================
+
+    print("testing sr_util sr_proto read_write ")
+
+    class parent_stub:
+          def __init__(self):
+              self.logger      = logger_stub()
+              self.bufsize     = 1000
+              self.bufsize_max = 0
+              self.kbytes_ps   = 0
+              self.timeout     = 0
+
+    class logger_stub:
+          def silence(self,str):
+              pass
+          def __init__(self):
+              self.debug   = self.silence
+              self.error   = print
+
+    class md5_view:
+          update_view = True
+          def set_path(self,path): self.hash = md5()
+          def update(self,chunk):  self.hash.update(chunk)
+          def get_value(self):     return self.hash.hexdigest()
+
+    class md5_bytes(md5_view):
+          update_view = False
+          def update(self,chunk):
+              if type(chunk) != bytes : raise TypeError("bytes expected")
+              self.hash.update(chunk)
+
+    # sources : a python io object (readinto), and one with read only
+
+    class reads_recorded(io.BytesIO):
+          def readinto(self,b):
+              self.sizes.append(len(b))
+              return io.BytesIO.readinto(self,b)
+
+    class read_only:
+          def __init__(self,data): self.src = io.BytesIO(data)
+          def read(self,n):        return self.src.read(n)
+
+    class write_only:
+          def __init__(self):      self.chunks = []
+          def write(self,chunk):   self.chunks.append(chunk)
+
+    data     = os.urandom(100123)
+    tmpdir   = tempfile.mkdtemp()
+    dst_path = tmpdir + os.sep + 'dst'
+
+    parent   = parent_stub()
+    proto    = sr_proto(parent)
+
+    for i, sumalgo in enumerate( [ md5_view(), md5_bytes() ] ) :
+        proto.set_sumalgo(sumalgo)
+        n = proto.read_writelocal('src', io.BytesIO(data), dst_path)
+        if n != len(data) or open(dst_path,'rb').read() != data or proto.checksum != md5(data).hexdigest() :
+           print("test %d: sr_proto read_writelocal %d bytes %s" % (15+i,n,proto.checksum))
+           failed = True
+
+    # exact length, at an offset, from a source with read only
+
+    proto.set_sumalgo(None)
+    src = read_only(data)
+    src.read(10)
+    n   = proto.read_writelocal('src', src, dst_path, 50, 5000)
+    if n != 5000 or open(dst_path,'rb').read()[50:5050] != data[10:5010] :
+       print("test 17: sr_proto read_writelocal length 5000 at offset 50, %d bytes" % n)
+       failed = True
+
+    # bufsize_max : chunks grow, up to it
+
+    parent.bufsize_max = 8000
+    proto = sr_proto(parent)
+    src   = reads_recorded(data)
+    src.sizes = []
+    n     = proto.read_writelocal('src', src, dst_path)
+    if n != len(data) or src.sizes[:5] != [ 1000, 2000, 4000, 8000, 8000 ] or open(dst_path,'rb').read() != data :
+       print("test 18: sr_proto bufsize_max chunks %s" % src.sizes[:5])
+       failed = True
+
+    # writing where memoryviews are not taken : bytes
+
+    dst = write_only()
+    n   = proto.readlocal_write(dst_path, 0, 0, dst)
+    if n != len(data) or b''.join(dst.chunks) != data or set(map(type,dst.chunks)) != set([bytes]) :
+       print("test 19: sr_proto readlocal_write %d bytes" % n)
+       failed = True
+
+    # ===================================
+    # TESTING sr_deadline
+    # ===================================
+
+    print("testing sr_util sr_deadline ")
+
+    deadline = sr_deadline(0.2)
+    before   = [ deadline.expired(), 0 < deadline.remaining() <= 0.2 ]
+    time.sleep(0.3)
+    after    = [ deadline.expired(), deadline.remaining() > 0 ]
+    try   :
+            deadline.check('test')
+            after.append(False)
+    except TimeoutException : after.append(True)
+    deadline.start()
+    again    = deadline.expired()
+    never    = sr_deadline(None)
+
+    if before != [ False, True ] or after != [ True, True, True ] or again or \
+       never.expired() or never.remaining() != None :
+       print("test 20: sr_deadline %s %s %s" % (before,after,again))
+       failed = True
+
+    # io timeouts in a thread : a socket stalled, reads making progress slowly, a read too long
+
+    class slow_read(read_only):
+          def __init__(self,data,delay):
+              read_only.__init__(self,data)
+              self.delay = delay
+          def read(self,n):
+              time.sleep(self.delay)
+              return read_only.read(self,n)
+
+    def stalled_socket(results):
+        sender, receiver = socket.socketpair()
+        sender.sendall(data[:5000])
+        proto = sr_proto(parent)
+        proto.set_iotime(1)
+        proto.deadline.settimeout(receiver)
+        start = time.time()
+        try   :
+                proto.read_writelocal('src', receiver.makefile('rb'), dst_path)
+                results.append(None)
+        except socket.timeout : results.append(time.time() - start)
+        sender.close()
+        receiver.close()
+
+    def slow_source(results,delay):
+        proto = sr_proto(parent)
+        proto.set_iotime(1)
+        try   : results.append(proto.read_writelocal('src', slow_read(data[:3000],delay), dst_path))
+        except TimeoutException : results.append('timeout')
+
+    results = []
+    for target, args in [ (stalled_socket, (results,)), (slow_source, (results,0.4)), (slow_source, (results,1.2)) ] :
+        t = threading.Thread(target=target, args=args)
+        t.start()
+        t.join()
+
+    if results[0] == None or not 0.9 < results[0] < 2 :
+       print("test 21: sr_proto read_write stalled socket in a thread %s" % results[0])
+       failed = True
+
+    if results[1] != 3000 :
+       print("test 22: sr_proto read_write slow progress %s" % results[1])
+       failed = True
+
+    if results[2] != 'timeout' :
+       print("test 23: sr_proto read_write read too long %s" % results[2])
+       failed = True
+
+    shutil.rmtree(tmpdir)
 
 ###### missing coverage ######
 # class raw_message
-# class sr_proto()
 # class sr_transport()
 
 
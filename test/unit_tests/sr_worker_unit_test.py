@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+try :
+         from sr_worker         import *
+except :
+         from sarra.sr_worker   import *
+
+import random, threading, time
+
+# ===================================
+# self_test
+# ===================================
+
+class test_logger:
+      def silence(self,str):
+          pass
+      def __init__(self):
+          self.debug   = self.silence
+          self.error   = print
+          self.info    = self.silence
+          self.warning = self.silence
+
+class raw:
+      def __init__(self,i,isRetry=False):
+          self.body    = str(i)
+          self.isRetry = isRetry
+
+def self_test():
+
+    failed = False
+    logger = test_logger()
+
+    acked     = []
+    completed = []
+    running   = []
+    most      = [ 0 ]
+    lock      = threading.Lock()
+
+    def task(view,job):
+        with lock :
+             running.append(job)
+             most[0] = max(most[0],len(running))
+        time.sleep(random.random()/100)
+        with lock : running.remove(job)
+        return job.msg != 'fail'
+
+    def done(job):
+        completed.append( (job.raw_msg.body, job.ok, threading.current_thread() is threading.main_thread()) )
+
+    def ack(raw_msg):
+        acked.append(raw_msg.body)
+
+    pool = sr_worker_pool(logger, [ 'view1', 'view2', 'view3' ], 6, task, done, ack)
+
+    # every other message to a thread, the others processed at once
+
+    for i in range(50) :
+        msg = raw(i)
+        pool.consumed(msg)
+        if i % 2 == 0 : pool.submit(msg, ['fail','ok'][i%4 == 0], key='file_%d' % (i % 10) )
+        if pool.inflight > 6 :
+           print("test 01: sr_worker %d messages in flight, at most 6" % pool.inflight)
+           failed = True
+
+    # a retry message (not from the broker, not acknowledged)
+
+    pool.consumed(None)
+    pool.submit(raw(99,True),'ok')
+
+    pool.close()
+
+    if acked != [ str(i) for i in range(50) ] :
+       print("test 02: sr_worker acknowledged out of order %s" % acked)
+       failed = True
+
+    if len(completed) != 26 or not all( [ c[2] for c in completed ] ) :
+       print("test 03: sr_worker completed %d jobs, all in main thread %s" % \
+            (len(completed), all( [ c[2] for c in completed ] )))
+       failed = True
+
+    if [ c[1] for c in completed if c[0] != '99' ].count(False) != 12 :
+       print("test 04: sr_worker results %s" % completed)
+       failed = True
+
+    if most[0] > 3 :
+       print("test 05: sr_worker %d jobs at once with 3 threads" % most[0])
+       failed = True
+
+    # a busy feed (never idle, nothing else submitted) : a job done is completed
+    # and acknowledged as messages are consumed, not only at close
+
+    acked     = []
+    completed = []
+    pool = sr_worker_pool(logger, [ 'view1' ], 2, task, done, ack)
+
+    msg = raw(0)
+    pool.consumed(msg)
+    pool.submit(msg, 'ok')
+    time.sleep(0.1)
+
+    for i in range(1,200) : pool.consumed(raw(i))
+
+    if [ c[0] for c in completed ] != [ '0' ] or len(acked) != 199 or len(pool.order) != 1 :
+       print("test 07: sr_worker busy feed completed %s acked %d pending ack %d" % \
+            ([ c[0] for c in completed ],len(acked),len(pool.order)))
+       failed = True
+
+    pool.close()
+
+    # reports kept in the thread, published on completion
+
+    class publisher:
+          def __init__(self): self.published = []
+          def publish(self,exchange,topic,notice,headers): self.published.append(topic)
+
+    reports = sr_worker_reports()
+    headers = { 'message' : 'Downloaded' }
+    reports.publish('xs_test','v02.report.a','notice',headers)
+    del headers['message']
+    p = publisher()
+    reports.replay(p)
+
+    if p.published != [ 'v02.report.a' ] or reports.reports != [] :
+       print("test 06: sr_worker_reports %s" % p.published)
+       failed = True
+
+    if not failed :
+                    print("sr_worker.py TEST PASSED")
+    else :
+                    print("sr_worker.py TEST FAILED")
+                    sys.exit(1)
+
+# ===================================
+# MAIN
+# ===================================
+
+def main():
+
+    try:    self_test()
+    except:
+            (stype, svalue, tb) = sys.exc_info()
+            print("%s, Value: %s" % (stype, svalue))
+            print("sr_worker.py TEST FAILED")
+            sys.exit(1)
+
+    sys.exit(0)
+
+# =========================================
+# direct invocation : self testing
+# =========================================
+
+if __name__=="__main__":
+   main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+#
+# cache_bench.py : time sr_cache operations on large synthetic caches.
+#
+# usage: cache_bench.py [nentries ...]     (default: 1000000 10000000)
+#
+# For each size, the cache is filled with entries spread over the caching
+# interval, time is advanced so that 1% of them are expired, and the time
+# taken by clean() (what check_expire and hb_cache trigger) is reported.
+# The cache is then saved and loaded back (what a restart does) in each
+# cache_format.  Last, the time taken by the heartbeat save() is measured
+# with and without cache_segments.
+#
+
+import logging,os,sys,tempfile,time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)) + os.sep + '..' )
+
+from sarra.sr_cache import sr_cache
+
+class parent_stub():
+    def __init__(self,caching):
+        self.logger            = logging.getLogger('cache_bench')
+        self.caching           = caching
+        self.cache_format      = 'text'
+        self.cache_max_bytes   = 0
+        self.cache_max_entries = 0
+        self.cache_journal     = False
+        self.cache_journal_batch    = 100
+        self.cache_journal_interval = 1.0
+        self.cache_journal_sync     = 'flush'
+        self.cache_segments    = 0
+        self.instance          = 1
+        self.user_cache_dir    = tempfile.mkdtemp()
+
+def fill(cache, nentries):
+    sums  = [ 'd%.32x' % i for i in range(nentries) ]
+    start = time.time()
+    for i,key in enumerate(sums) :
+        cache.check(key, '/data/product/%d/file_%d.txt' % (i%1000,i), '1,1024,1,0,0')
+    return time.time() - start
+
+def bench(nentries):
+    caching = 1200
+    cache   = sr_cache(parent_stub(caching))
+    cache.open()
+
+    elapse  = fill(cache, nentries)
+    print("%10d entries : fill %8.2f sec" % (nentries,elapse))
+
+    # make 1% of the entries older than the caching interval
+
+    nexpired = nentries // 100
+    index    = cache.cache_dict
+    for i,k in enumerate(index) :
+        if i >= nexpired : break
+        index[k] -= 2*caching
+
+    start   = time.time()
+    cache.clean()
+    elapse  = time.time() - start
+    print("%10d entries : clean %8.4f sec, %d expired, %d left" % (nentries,elapse,nexpired,cache.count))
+
+    # nothing expired : should be nearly free
+
+    start   = time.time()
+    cache.clean()
+    elapse  = time.time() - start
+    print("%10d entries : clean %8.4f sec, nothing expired" % (nentries,elapse))
+
+    for cache_format in [ 'text', 'binary' ] :
+        cache.cache_format = cache_format
+
+        start   = time.time()
+        cache.save()
+        cache.close()
+        elapse  = time.time() - start
+        size    = os.stat(cache.cache_file).st_size
+
+        start   = time.time()
+        cache.open()
+        print("%10d entries : %6s save %8.2f sec, load %8.2f sec, %d bytes" % \
+             (nentries,cache_format,elapse,time.time()-start,size))
+
+    cache.close(unlink=True)
+    os.rmdir(cache.parent.user_cache_dir)
+
+def bench_segments(nentries):
+
+    for segments in [ 0, 10 ] :
+        parent = parent_stub(1200)
+        parent.cache_segments = segments
+
+        cache  = sr_cache(parent)
+        cache.open()
+        fill(cache, nentries)
+
+        start  = time.time()
+        cache.save()
+        elapse = time.time() - start
+        print("%10d entries : segments %2d heartbeat save %8.4f sec" % (nentries,segments,elapse))
+
+        cache.close(unlink=True)
+        os.rmdir(parent.user_cache_dir)
+
+sizes = [ int(a) for a in sys.argv[1:] ]
+if not sizes : sizes = [ 1000000, 10000000 ]
+
+for n in sizes : bench(n)
+for n in sizes : bench_segments(n)
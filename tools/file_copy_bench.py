@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+#
+# file_copy_bench.py : file:// copies (sr_file file_insert, file_insert_part),
+#                      the read/write loop against file_copy_range
+#
+# usage: file_copy_bench.py [size_MB [count [srcdir [dstdir]]]]
+#        (default: 256 4, temporary directories in the current one)
+#
+# Give a dstdir on another file system to see the copy done when a link
+# cannot be.  Each file is copied whole then in 4 parts (offset/length
+# inserts), with sum 0 (no data needed) and d (md5 of the data).  The
+# source files are read once first, so all copies come from the page cache.
+#
+
+import os,shutil,sys,tempfile,time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)) + os.sep + '..' )
+
+from sarra.sr_config import sr_config
+from sarra.sr_file   import file_copy_range
+
+size    = 256
+count   = 4
+bufsize = 1024 * 1024
+
+if len(sys.argv) > 1 : size  = int(sys.argv[1])
+if len(sys.argv) > 2 : count = int(sys.argv[2])
+
+srcdir = tempfile.mkdtemp(dir=sys.argv[3] if len(sys.argv) > 3 else '.')
+dstdir = tempfile.mkdtemp(dir=sys.argv[4] if len(sys.argv) > 4 else '.')
+
+length = size * 1024 * 1024
+
+cfg = sr_config()
+cfg.defaults()
+cfg.load_sums()
+
+# the loop sr_file used (file_write_length)
+
+def loop_copy(src, dst, length, bufsize, chk=None):
+    nc = int(length/bufsize)
+    r  =     length%bufsize
+    i  = 0
+    while i < nc :
+          chunk = src.read(bufsize)
+          dst.write(chunk)
+          if chk : chk.update(chunk)
+          i = i + 1
+    if r > 0 :
+       chunk = src.read(r)
+       dst.write(chunk)
+       if chk : chk.update(chunk)
+    return length
+
+def copy(copier, src_path, dst_path, chk, parts):
+
+    if chk : chk.set_path(src_path)
+
+    part = length // parts
+
+    with open(dst_path,'w') : pass
+
+    with open(src_path,'rb') as src, open(dst_path,'r+b') as dst :
+         for p in range(parts) :
+             offset = p * part
+             n      = part if p < parts-1 else length - offset
+             src.seek(offset)
+             dst.seek(offset)
+             copier(src, dst, n, bufsize, chk)
+         dst.flush()
+         os.fsync(dst.fileno())
+
+    if chk : return chk.get_value()
+
+for i in range(count) :
+    with open(srcdir + os.sep + 'file_%d' % i,'wb') as f :
+         for j in range(size) : f.write(os.urandom(1024*1024))
+
+for i in range(count) :
+    with open(srcdir + os.sep + 'file_%d' % i,'rb') as f :
+         while f.read(bufsize) : pass
+
+for sumflg in [ '0', 'd' ] :
+    for parts in [ 1, 4 ] :
+        sums = {}
+        for name, copier in [ ('loop', loop_copy), ('file_copy_range', file_copy_range) ] :
+
+            cfg.set_sumalgo(sumflg)
+            chk = cfg.sumalgo
+            if sumflg == '0' : chk = None
+
+            start = time.time()
+            sums[name] = []
+            for i in range(count) :
+                src_path = srcdir + os.sep + 'file_%d' % i
+                dst_path = dstdir + os.sep + 'file_%d' % i
+                sums[name].append( copy(copier, src_path, dst_path, chk, parts) )
+            elapse = time.time() - start
+
+            print("sum %s, %d part(s), %-16s : %d x %d MB in %6.2f sec, %8.1f MB/sec" % \
+                 (sumflg,parts,name,count,size,elapse,count*size/elapse))
+
+            for i in range(count) : os.unlink(dstdir + os.sep + 'file_%d' % i)
+
+        if sums['loop'] != sums['file_copy_range'] :
+           print("checksums differ %s %s" % (sums['loop'],sums['file_copy_range']))
+
+shutil.rmtree(srcdir)
+shutil.rmtree(dstdir)
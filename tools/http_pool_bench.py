@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+#
+# http_pool_bench.py : sr_http getting small files one after the other,
+#                      a connection per file (urlopen, as before) against
+#                      the keep-alive connections of sr_http_pool
+#
+# usage: http_pool_bench.py [nfiles [size_KB [setup_delay]]]
+#        (default: 500 4 0.01)
+#
+# A local http server (HTTP/1.1) waits setup_delay seconds when a connection
+# is accepted, standing for the TCP and TLS handshakes with a distant server.
+#
+
+import http.server,logging,os,shutil,socket,socketserver,sys,tempfile,threading,time,urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)) + os.sep + '..' )
+
+from sarra.sr_config      import sr_config
+from sarra.sr_credentials import sr_credentials
+from sarra.sr_http        import sr_http, http_pool
+
+nfiles      = 500
+size        = 4
+setup_delay = 0.01
+
+if len(sys.argv) > 1 : nfiles      = int(sys.argv[1])
+if len(sys.argv) > 2 : size        = int(sys.argv[2])
+if len(sys.argv) > 3 : setup_delay = float(sys.argv[3])
+
+srcdir = tempfile.mkdtemp()
+dstdir = tempfile.mkdtemp()
+
+for i in range(nfiles) :
+    with open(srcdir + os.sep + 'file_%d' % i,'wb') as f : f.write(os.urandom(size*1024))
+
+class bench_handler(http.server.SimpleHTTPRequestHandler):
+      protocol_version = 'HTTP/1.1'
+      def __init__(self, *args, **kwargs):
+          super().__init__(*args, directory=srcdir, **kwargs)
+      def setup(self):
+          time.sleep(setup_delay)
+          # as real servers do : no delayed ack stall between headers and body
+          self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+          super().setup()
+      def log_message(self, *args):
+          pass
+
+class bench_server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+      daemon_threads = True
+
+server = bench_server(('localhost',0), bench_handler)
+port   = server.server_address[1]
+threading.Thread(target=server.serve_forever,daemon=True).start()
+
+cfg = sr_config()
+cfg.defaults()
+cfg.logger      = logging.getLogger('http_pool_bench')
+cfg.credentials = sr_credentials(cfg.logger)
+cfg.destination = 'http://localhost:%d' % port
+
+# a connection per file, as sr_http did
+
+def urlopen_get(i):
+    with urllib.request.urlopen(cfg.destination + '/file_%d' % i, timeout=30) as src, \
+         open(dstdir + os.sep + 'file_%d' % i,'wb') as dst :
+         shutil.copyfileobj(src, dst)
+
+proto = sr_http(cfg)
+proto.connect()
+proto.cd('')
+
+def pool_get(i):
+    proto.get('file_%d' % i, dstdir + os.sep + 'file_%d' % i)
+
+print("%d files of %d KB, connection setup %.3f sec" % (nfiles,size,setup_delay))
+
+for name, get in [ ('urlopen', urlopen_get), ('sr_http_pool', pool_get) ] :
+    start = time.time()
+    for i in range(nfiles) : get(i)
+    elapse = time.time() - start
+    print("%-14s : %8.1f files/sec" % (name,nfiles/elapse))
+
+print("pool : %s" % http_pool.stats())
+
+server.shutdown()
+shutil.rmtree(srcdir)
+shutil.rmtree(dstdir)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+#
+# mask_bench.py : sr_config.isMatchingPattern with many accept/reject masks,
+#                 each mask tried in turn (as before sr_masks) and compiled (sr_masks)
+#
+# usage: mask_bench.py [nmasks [nurls]]
+#        (default: 1000 10000)
+#
+# The masks look like those of a pump migrated from sundew : a directory
+# each, accepting some bulletin headers and rejecting others, a last
+# reject .* (so many urls go through all the masks).
+#
+
+import logging,os,random,sys,time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)) + os.sep + '..' )
+
+from sarra.sr_config import sr_config
+
+logger = logging.getLogger('mask_bench')
+logging.basicConfig(level=logging.WARNING)
+
+nmasks = 1000
+nurls  = 10000
+
+if len(sys.argv) > 1 : nmasks = int(sys.argv[1])
+if len(sys.argv) > 2 : nurls  = int(sys.argv[2])
+
+random.seed(1)
+
+cfg = sr_config()
+cfg.defaults()
+cfg.logger = logger
+
+headers = [ 'SA', 'SN', 'FT', 'FC', 'WO', 'UA', 'SX', 'CS' ]
+
+for i in range(nmasks-1) :
+    cfg.option( [ 'directory', '/data/%d' % i ] )
+    cfg.option( [ 'accept' if i % 3 else 'reject', '.*/%s%s%.2d_C[A-Z]{3}_.*%d.*' % \
+                ( headers[i % len(headers)], 'CN'[i % 2], i % 100, i ) ] )
+cfg.option( [ 'reject', '.*' ] )
+
+urls = []
+for i in range(nurls) :
+    j = random.randrange(2*nmasks)
+    urls.append( 'http://localhost/%s/bulletins/%s%s%.2d_CWAO_%d%.4d' % \
+                 ( '20180101', headers[j % len(headers)], 'CN'[j % 2], j % 100, j, i ) )
+
+# before sr_masks : every mask tried in turn, attributes set for each
+
+def each_mask(self, chaine, accept_unmatch = False):
+    for mask in self.masks:
+        pattern, maskDir, maskFileOption, mask_regexp, accepting, mirror, strip, pstrip, flatten = mask
+        self.currentPattern    = pattern
+        self.currentDir        = maskDir
+        self.currentFileOption = maskFileOption
+        self.currentRegexp     = mask_regexp
+        self.mirror = mirror
+        self.strip = strip
+        self.pstrip = pstrip
+        self.flatten = flatten
+        if mask_regexp.match(chaine) :
+           if not accepting : return False
+           return True
+    return accept_unmatch
+
+def bench(name,match):
+    accepted = 0
+    start    = time.time()
+    results  = []
+    for url in urls :
+        ok = match(cfg,url,False)
+        results.append( (ok,cfg.currentDir) )
+        if ok : accepted += 1
+    elapse = time.time() - start
+    print("%8s : %d masks, %d urls in %6.2f sec, %10.1f urls/sec, %d accepted" % \
+         (name,nmasks,nurls,elapse,nurls/elapse,accepted))
+    return results
+
+start = time.time()
+cfg.isMatchingPattern(urls[0])
+print("%8s : %d masks in %6.2f sec" % ('compile',nmasks,time.time()-start))
+
+before = bench('each',each_mask)
+after  = bench('sr_masks',sr_config.isMatchingPattern)
+
+if before != after : print("results differ")
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+#
+# message_bench.py : messages/sec parsed by sr_message.from_amqplib (everything)
+#                    and by sr_notice (the compact view sr_consumer matches on)
+#
+# usage: message_bench.py [nmessages [accepted_percent]]
+#        (default: 100000 10)
+#
+#   full    : from_amqplib on every message (what sr_consumer did before sr_notice)
+#   notice  : sr_notice.load and its urlstr for every message
+#   consume : the sr_consumer path, accept/reject on the sr_notice,
+#             from_amqplib only for the accepted_percent of messages accepted
+#
+
+import logging,os,sys,time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)) + os.sep + '..' )
+
+from sarra.sr_config  import sr_config
+from sarra.sr_message import *
+from sarra.sr_util    import raw_message, timeflt2str
+
+logger = logging.getLogger('message_bench')
+logging.basicConfig(level=logging.WARNING)
+
+nmessages = 100000
+accepted  = 10
+
+if len(sys.argv) > 1 : nmessages = int(sys.argv[1])
+if len(sys.argv) > 2 : accepted  = int(sys.argv[2])
+
+cfg = sr_config()
+cfg.defaults()
+cfg.load_sums()
+cfg.logger = logger
+cfg.option( 'accept .*/keep/.*'.split() )
+cfg.option( 'reject .*'.split() )
+
+msgs = []
+for i in range(nmessages) :
+    kind    = [ 'skip', 'keep' ][ (i % 100) < accepted ]
+    relpath = '%s/%d/file_%d.txt' % (kind,i%100,i)
+    raw     = raw_message(logger)
+    raw.delivery_info['exchange']          = 'xpublic'
+    raw.delivery_info['routing_key']       = 'v02.post.' + relpath.replace('/','.')
+    raw.properties['application_headers']  = { 'sum' : 'd,%.32x' % i, 'parts' : '1,1024,1,0,0', \
+                                               'to_clusters' : 'bench', 'source' : 'bench' }
+    raw.body    = ('%s http://localhost/ %s' % (timeflt2str(time.time()),relpath)).encode('utf-8')
+    raw.isRetry = False
+    msgs.append(raw)
+
+def report(name,start,count):
+    elapse = time.time() - start
+    print("%8s : %d messages in %6.2f sec, %10.1f msg/sec, %d fully parsed" % \
+         (name,nmessages,elapse,nmessages/elapse,count))
+
+msg = sr_message(cfg)
+
+start = time.time()
+for raw in msgs : msg.from_amqplib(raw)
+report('full',start,nmessages)
+
+notice = sr_notice()
+
+start = time.time()
+for raw in msgs : notice.load(raw).urlstr
+report('notice',start,0)
+
+count = 0
+start = time.time()
+for raw in msgs :
+    if not cfg.isMatchingPattern(notice.load(raw).urlstr,cfg.accept_unmatch) : continue
+    msg.from_amqplib(raw)
+    count += 1
+report('consume',start,count)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+#
+# read_write_bench.py : sr_proto.read_write (download loop) from a file, an
+#                       http server and an sftp server into a local file,
+#                       the loop as it was against the current one
+#
+# usage: read_write_bench.py [size_MB [bufsize_KB [bufsize_max_KB]]]
+#        (default: 256 64 4096)
+#
+# The http server (http.server) and the sftp server (paramiko, over a
+# socketpair) run in this process, on threads : what is measured is the
+# client loop, wall clock and cpu time of the whole process.
+#
+
+import hashlib,http.server,logging,os,shutil,socket,socketserver,sys,tempfile,threading,time,urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)) + os.sep + '..' )
+
+import paramiko
+
+from sarra.sr_config import sr_config
+from sarra.sr_util   import *
+
+size        = 256
+bufsize     = 64
+bufsize_max = 4096
+
+if len(sys.argv) > 1 : size        = int(sys.argv[1])
+if len(sys.argv) > 2 : bufsize     = int(sys.argv[2])
+if len(sys.argv) > 3 : bufsize_max = int(sys.argv[3])
+
+workdir = tempfile.mkdtemp()
+src_path = workdir + os.sep + 'src'
+dst_path = workdir + os.sep + 'dst'
+
+with open(src_path,'wb') as f :
+     for i in range(size) : f.write(os.urandom(1024*1024))
+
+cfg = sr_config()
+cfg.defaults()
+cfg.load_sums()
+cfg.logger = logging.getLogger('read_write_bench')
+
+logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+
+# the loop as it was
+
+class old_proto(sr_proto):
+
+    def read_write(self, src, dst, length=0):
+        rw_length     = 0
+        self.tbytes   = 0.0
+        self.tbegin   = time.time()
+        while True :
+              if self.iotime: alarm_set(self.iotime)
+              chunk = src.read(self.bufsize)
+              if chunk :
+                 dst.write(chunk)
+                 rw_length += len(chunk)
+              alarm_cancel()
+              if not chunk : break
+              if self.sumalgo  : self.sumalgo.update(chunk)
+              if self.kbytes_ps: self.throttle(chunk)
+        return rw_length
+
+# http server
+
+class quiet_handler(http.server.SimpleHTTPRequestHandler):
+      def __init__(self, *args, **kwargs):
+          super().__init__(*args, directory=workdir, **kwargs)
+      def log_message(self, *args):
+          pass
+
+class threading_server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+      daemon_threads = True
+
+server = threading_server(('localhost',0), quiet_handler)
+port   = server.server_address[1]
+threading.Thread(target=server.serve_forever,daemon=True).start()
+
+# sftp server
+
+class stub_server(paramiko.ServerInterface):
+      def check_auth_none(self, username):
+          return paramiko.AUTH_SUCCESSFUL
+      def get_allowed_auths(self, username):
+          return 'none'
+      def check_channel_request(self, kind, chanid):
+          return paramiko.OPEN_SUCCEEDED
+
+class stub_sftp(paramiko.SFTPServerInterface):
+      def open(self, path, flags, attr):
+          handle = paramiko.SFTPHandle(flags)
+          handle.readfile = open(path,'rb')
+          return handle
+      def stat(self, path):
+          return paramiko.SFTPAttributes.from_stat(os.stat(path))
+      lstat = stat
+
+def sftp_client():
+    client_sock, server_sock = socket.socketpair()
+    host_key = paramiko.RSAKey.generate(2048)
+
+    t = paramiko.Transport(server_sock)
+    t.add_server_key(host_key)
+    t.set_subsystem_handler('sftp', paramiko.SFTPServer, stub_sftp)
+    t.start_server(event=threading.Event(), server=stub_server())
+
+    c = paramiko.Transport(client_sock)
+    c.connect()
+    c.auth_none('bench')
+    return paramiko.SFTPClient.from_transport(c)
+
+sftp = sftp_client()
+
+def sources():
+    yield 'file', open(src_path,'rb')
+    yield 'http', urllib.request.urlopen('http://localhost:%d/src' % port)
+    yield 'sftp', sftp.file(src_path,'rb',bufsize*1024)
+
+# runs
+
+expected = hashlib.md5(open(src_path,'rb').read()).hexdigest()
+
+print("%d MB, bufsize %d KB, bufsize_max %d KB" % (size,bufsize,bufsize_max))
+
+for sumflg, name, proto_class, cfg_bufsize_max in [ ('0', 'before', old_proto, 0), \
+                                                    ('0', 'readinto', sr_proto, 0), \
+                                                    ('0', 'bufsize_max', sr_proto, bufsize_max*1024), \
+                                                    ('d', 'before', old_proto, 0), \
+                                                    ('d', 'readinto', sr_proto, 0), \
+                                                    ('d', 'bufsize_max', sr_proto, bufsize_max*1024) ] :
+
+    cfg.bufsize     = bufsize*1024
+    cfg.bufsize_max = cfg_bufsize_max
+
+    proto = proto_class(cfg)
+
+    for source, src in sources() :
+        cfg.set_sumalgo('d')
+        proto.set_sumalgo(cfg.sumalgo if sumflg == 'd' else None)
+
+        start = time.time()
+        cpu   = time.process_time()
+        n     = proto.read_writelocal('src', src, dst_path)
+        cpu   = time.process_time() - cpu
+        elapse= time.time() - start
+        src.close()
+
+        ok = n == size*1024*1024 and (sumflg == '0' or proto.checksum == expected)
+
+        print("sum %s %-12s %-5s : %8.1f MB/sec, cpu %5.2f sec %s" % \
+             (sumflg, name, source, size/elapse, cpu, '' if ok else 'WRONG'))
+
+server.shutdown()
+shutil.rmtree(workdir)